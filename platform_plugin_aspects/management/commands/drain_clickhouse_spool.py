@@ -0,0 +1,68 @@
+"""
+Management command for sending inserts waiting in the local ClickHouse spool.
+
+When ``spool_dir`` is set in EVENT_SINK_CLICKHOUSE_BACKEND_CONFIG, inserts that
+ClickHouse could not accept are written to disk instead of failing. This command
+replays them, merging small inserts into large batches, and should be run
+periodically (or the ``drain_clickhouse_spool`` Celery task scheduled) on every
+host that writes to the spool.
+
+Example usages:
+
+    # Send everything waiting in the spool
+    python manage.py cms drain_clickhouse_spool
+
+    # Only report how much data is waiting, per table
+    python manage.py cms drain_clickhouse_spool --stats
+"""
+
+import logging
+from textwrap import dedent
+
+from django.core.management.base import BaseCommand, CommandError
+
+from platform_plugin_aspects.sinks.base_sink import BaseSink
+
+log = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    Send the inserts waiting in the local ClickHouse spool.
+    """
+
+    help = dedent(__doc__).strip()
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--table",
+            type=str,
+            help="only drain the spooled inserts of this ClickHouse table",
+        )
+        parser.add_argument(
+            "--stats",
+            action="store_true",
+            help="report the size of the spool without sending anything",
+        )
+
+    def handle(self, *args, **options):
+        sink = BaseSink({}, log)
+        if not sink.ch_spool:
+            message = "The ClickHouse spool is not configured, set spool_dir first."
+            log.error(message)
+            raise CommandError(message)
+
+        if options["stats"]:
+            stats = sink.ch_spool.get_stats()
+            if not stats:
+                log.info("The ClickHouse spool is empty.")
+            for table, table_stats in stats.items():
+                log.info(
+                    f"{table}: {table_stats['segments']} segments, "
+                    f"{table_stats['bytes']} bytes, "
+                    f"{table_stats['dead_letter_segments']} dead letter segments"
+                )
+            return
+
+        sent = sink.drain_spool(table=options["table"])
+        log.info(f"Sent {sent} spooled inserts to ClickHouse.")
@@ -13,72 +13,704 @@ Example usages (see usage for more options):
 
     # Dump a limited number of objects to prevent stress on production systems
     python manage.py cms dump_objects_to_clickhouse --limit 1000
+
+    # Split the primary keys into 8 ranges dumped by parallel worker processes
+    python manage.py cms dump_objects_to_clickhouse --object user_profile --workers 8
+
+    # Continue an interrupted dump from its last checkpoint (requires checkpoint_dir)
+    python manage.py cms dump_objects_to_clickhouse --object user_profile --workers 8 --resume
+
+    # Resync every enabled sink, 4 of them at once, smallest tables first
+    python manage.py cms dump_objects_to_clickhouse --object all --concurrency 4
+
+    # Estimate the rows, bytes and time of a dump without sending anything
+    python manage.py cms dump_objects_to_clickhouse --object user_profile --plan
 """
 
+import functools
 import logging
+import math
+import multiprocessing
+import queue
+import threading
 import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field, replace
 from textwrap import dedent
 
+import requests
+from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
 
-from platform_plugin_aspects.sinks.base_sink import ModelBaseSink
+from platform_plugin_aspects.sinks import async_transport
+from platform_plugin_aspects.sinks.async_transport import AsyncTransport
+from platform_plugin_aspects.sinks.base_sink import CountedItems, ModelBaseSink
+from platform_plugin_aspects.sinks.checkpoint import get_checkpoint_store
+from platform_plugin_aspects.sinks.flow_control import (
+    FlowController,
+    get_flow_control_config,
+)
 
 log = logging.getLogger(__name__)
 
+# --object value dumping every enabled sink
+ALL_OBJECTS = "all"
+
+
+@dataclass(frozen=True)
+class DumpOptions:
+    """
+    Settings of the dump of a sink's objects, shared by all its pk ranges.
+    """
+
+    # Keys of the objects to dump, all of them if empty
+    object_ids: list = field(default_factory=list)
+    # Keys of the objects not to dump
+    objects_to_skip: list = field(default_factory=list)
+    # Dump the objects even if they were dumped since they last changed
+    force: bool = False
+    batch_size: int = 1000
+    # Seconds to sleep between batches
+    sleep_time: float = 10
+    # Number of inserts kept in flight at once, more than 1 sends them through
+    # the asyncio transport
+    concurrency: int = 1
+    # Number of batches fetched ahead of the one being sent, 0 fetches each batch
+    # only once the previous one was sent
+    prefetch_batches: int = 2
+    # Adapt the batch size and sleep time to ClickHouse's health, starting from
+    # batch_size and sleep_time
+    adaptive: bool = False
+
 
 def dump_target_objects_to_clickhouse(
-    sink=None,
+    sink,
     start_pk=None,
-    object_ids=None,
-    objects_to_skip=None,
-    force=False,
+    dump_options=None,
+    *,
+    end_pk=None,
     limit=None,
-    batch_size=1000,
-    sleep_time=10,
+    progress=None,
+    checkpoint=None,
+    report_progress=None,
 ):
     """
     Iterates through a list of objects in the ORN, serializes them to csv,
     then submits tasks to post them to ClickHouse.
 
     Arguments:
-        force: serialize the objects even if they've been recently
-            serialized
+        dump_options: DumpOptions of the dump, defaults to DumpOptions()
+        end_pk: only dump objects with a primary key up to this one
+        limit: maximum number of objects to dump
+        progress: SharedProgress of a parallel dump, enforcing its global limit
+        checkpoint: RangeCheckpoint recording the progress of the dump
+        report_progress: called with the number of objects of each batch dumped
 
-    Returns: two lists--one of the objects that had dump jobs queued for them
-        and one of objects that did not.
+    Returns: the number of objects dumped.
     """
+    dump_options = dump_options or DumpOptions()
+    if dump_options.concurrency > 1:
+        with AsyncTransport(dump_options.concurrency) as transport:
+            sink.use_async_transport(transport)
+            try:
+                count = dump_target_objects_to_clickhouse(
+                    sink,
+                    start_pk,
+                    replace(dump_options, concurrency=1),
+                    end_pk=end_pk,
+                    limit=limit,
+                    progress=progress,
+                    checkpoint=checkpoint,
+                    report_progress=report_progress,
+                )
+            finally:
+                sink.use_async_transport(None)
+        # Closing the transport waited for every insert to be acknowledged
+        sink.commit_ledger()
+        return count
+
+    sink.use_force_dump(dump_options.force)
+    sink_dump = SinkDump(
+        sink,
+        dump_options,
+        limit=limit,
+        progress=progress,
+        checkpoint=checkpoint,
+        report_progress=report_progress,
+    )
+    count = sink_dump.run(start_pk, end_pk)
+    log.info(f"Dumped {count} objects to ClickHouse")
+    return count
 
-    count = 0
-    skipped_objects = []
-    objects_to_submit = []
 
-    for obj, should_be_dumped, reason in sink.fetch_target_items(
-        start_pk, object_ids, objects_to_skip, force, batch_size
+class SinkDump:
+    """
+    Dump of the objects of a sink in a range of primary keys, batch after batch.
+    """
+
+    def __init__(
+        self,
+        sink,
+        dump_options,
+        limit=None,
+        progress=None,
+        checkpoint=None,
+        report_progress=None,
     ):
-        if not should_be_dumped:
-            skipped_objects.append(obj.pk)
-            log.info(f"{sink.model}: Skipping object {obj.pk}, reason: '{reason}'")
-        else:
-            objects_to_submit.append(obj)
-            if len(objects_to_submit) % batch_size == 0:
-                count += len(objects_to_submit)
-                sink.dump(objects_to_submit, many=True)
-                objects_to_submit = []
-                log.info(f"Last ID: {obj.pk}")
-                time.sleep(sleep_time)
-
-            if limit and count == limit:
+        self.sink = sink
+        self.options = dump_options
+        self.limit = limit
+        self.progress = progress
+        self.checkpoint = checkpoint
+        self.report_progress = report_progress
+        self.count = 0
+        self.flow_controller = None
+
+    @property
+    def batch_size(self):
+        if self.flow_controller:
+            return self.flow_controller.batch_size
+        return self.options.batch_size
+
+    @property
+    def sleep_time(self):
+        if self.flow_controller:
+            return self.flow_controller.sleep_time
+        return self.options.sleep_time
+
+    def run(self, start_pk=None, end_pk=None):
+        """
+        Dump the objects with a pk in (start_pk, end_pk].
+
+        Returns: the number of objects dumped.
+        """
+        if self.options.adaptive:
+            self.flow_controller = get_flow_controller(
+                self.sink, self.options.batch_size, self.options.sleep_time
+            )
+
+        # Batches are fetched from the database in a background thread while the
+        # previous ones are serialized and sent, at most prefetch_batches ahead.
+        batches = self.iter_batches(start_pk, end_pk)
+        if self.options.prefetch_batches:
+            batches = prefetch(batches, self.options.prefetch_batches)
+        try:
+            completed = self.dump_batches(batches)
+        finally:
+            batches.close()
+            # Forget the ledger hashes of the objects fetched but not dumped
+            self.sink.discard_ledger()
+            if self.flow_controller:
+                self.sink.use_flow_controller(None)
+
+        if self.checkpoint:
+            if completed:
+                self.commit_sent()
+                self.checkpoint.finish()
+            else:
+                self.save_checkpoint()
+        return self.count
+
+    def iter_batches(self, start_pk, end_pk):
+        """
+        Yield the batches of objects that should be dumped.
+        """
+        sink = self.sink
+        batch = []
+        for obj, should_be_dumped, reason in sink.fetch_target_items(
+            start_pk,
+            self.options.object_ids,
+            self.options.objects_to_skip,
+            self.options.force,
+            self.options.batch_size,
+            end_pk=end_pk,
+        ):
+            if not should_be_dumped:
+                log.info(f"{sink.model}: Skipping object {obj.pk}, reason: '{reason}'")
+                continue
+            batch.append(obj)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def dump_batches(self, batches):
+        """
+        Dump the batches, sleeping between them.
+
+        Returns: False if the dump stopped before the last batch.
+        """
+        for i, batch in enumerate(batches):
+            if i:
+                time.sleep(self.sleep_time)
+            if self.limit:
+                remaining = self.limit - self.count
+                self.sink.discard_ledger(batch[remaining:])
+                batch = batch[:remaining]
+            self.dump_batch(batch)
+            if self.flow_controller:
+                change = self.flow_controller.update()
+                if change:
+                    log.info(f"Adapting {self.sink.name} dump to ClickHouse, {change}")
+            if self.limit and self.count >= self.limit:
                 log.info(
-                    f"Limit of {limit} eligible objects has been reached, quitting!"
+                    f"Limit of {self.limit} eligible objects has been reached, quitting!"
                 )
-                break
+                return False
+            if self.progress and self.progress.is_stopped():
+                return False
+        return True
+
+    def dump_batch(self, objects):
+        """
+        Dump a batch of objects and record the progress of the dump.
+        """
+        if self.progress:
+            reserved = self.progress.reserve(len(objects))
+            self.sink.discard_ledger(objects[reserved:])
+            objects = objects[:reserved]
+            if not objects:
+                return
+        self.count += len(objects)
+        self.sink.dump(objects, many=True)
+        log.info(f"Last ID: {objects[-1].pk}")
+        if self.report_progress:
+            self.report_progress(len(objects))
+        if self.checkpoint:
+            self.checkpoint.advance(objects[-1].pk, len(objects))
+            if self.checkpoint.is_due():
+                self.save_checkpoint()
+        if self.progress:
+            log.info(
+                f"{multiprocessing.current_process().name}: dumped {self.count} "
+                f"objects, {self.progress.get_dumped()} by all workers"
+            )
 
-    if objects_to_submit:
-        sink.dump(objects_to_submit, many=True)
-        count += len(objects_to_submit)
-        log.info(f"Last ID: {objects_to_submit[-1].pk}")
+    def commit_sent(self):
+        """
+        Wait for the inserts in flight and record them in the dump ledger.
+        """
+        if self.sink.ch_transport:
+            self.sink.ch_transport.flush()
+            self.sink.commit_ledger()
+
+    def save_checkpoint(self):
+        """
+        Save the checkpoint, only recording the inserts ClickHouse acknowledged.
+        """
+        self.commit_sent()
+        self.checkpoint.save()
+
+
+def plan_dump(sink, start_pk=None, dump_options=None, workers=1, sample_size=1000):
+    """
+    Estimate the size and duration of a dump without inserting anything.
+
+    The first sample_size selected objects are read, filtered, serialized, encoded
+    and compressed through the sink's real path, and the results are extrapolated
+    to every selected object. The duration only covers the work done locally and
+    the sleeps between batches, not the time ClickHouse takes to insert them.
+
+    The related objects dumped by nested sinks, like the blocks of courses, are
+    estimated the same way from the sampled objects, under "nested". They assume
+    every object's related objects are dumped, even the ones that would be skipped
+    because they didn't change.
+
+    Returns: a dict of the estimates.
+    """
+    dump_options = dump_options or DumpOptions()
+    queryset = sink.get_target_queryset(
+        start_pk, dump_options.object_ids, dump_options.objects_to_skip
+    )
+    total = queryset.count()
+    lookups = list(sink.projection.values()) if sink.projection else None
+
+    start = time.perf_counter()
+    sample = next(sink.iter_keyset_pages(queryset, sample_size, lookups), [])
+    if dump_options.force:
+        eligible = sample
+    else:
+        eligible = [
+            item
+            for item, (should_be_dumped, _reason) in zip(
+                sample, sink.should_dump_items(sample)
+            )
+            if should_be_dumped
+        ]
+    body = b""
+    serialized = []
+    if eligible and lookups is not None:
+        body = b"".join(
+            sink.ch_encoder.iter_encode_values(sink.iter_projected_values(eligible))
+        )
+    elif eligible:
+        serialized = sink.serialize_item(eligible, many=True)
+        body = b"".join(sink.ch_encoder.iter_encode(serialized))
+    compressed_body, _headers = sink.compress_body(body)
+    nested_samples = {
+        nested_sink.name: sample_nested_dump(nested_sink, serialized)
+        for nested_sink in sink.get_nested_sinks()
+    }
+    sample_secs = time.perf_counter() - start
+
+    plan = {
+        "total_objects": total,
+        "sampled": len(sample),
+        "rows": 0,
+        "bytes": 0,
+        "compressed_bytes": 0,
+        "codec": sink.ch_compression.name if sink.ch_compression else "none",
+        "batches": 0,
+        "duration_secs": 0,
+        "nested": {
+            name: {"rows": 0, "bytes": 0, "compressed_bytes": 0}
+            for name in nested_samples
+        },
+    }
+    if not sample:
+        return plan
+
+    scale = total / len(sample)
+    plan["rows"] = round(len(eligible) * scale)
+    plan["bytes"] = round(len(body) * scale)
+    plan["compressed_bytes"] = round(len(compressed_body) * scale)
+    for name, nested_sample in nested_samples.items():
+        plan["nested"][name] = {
+            key: round(value * scale) for key, value in nested_sample.items()
+        }
+    plan["batches"] = math.ceil(plan["rows"] / dump_options.batch_size)
+    plan["duration_secs"] = (
+        sample_secs * scale + max(0, plan["batches"] - 1) * dump_options.sleep_time
+    ) / max(1, min(workers, plan["batches"]))
+    return plan
 
-    log.info(f"Dumped {count} objects to ClickHouse")
+
+def sample_nested_dump(nested_sink, serialized_items):
+    """
+    Return the rows and bytes a nested sink dumps for the given serialized items.
+    """
+    rows = CountedItems(
+        row
+        for item in serialized_items
+        for row in nested_sink.iter_serialize_items(
+            item,
+            initial={
+                "dump_id": item["dump_id"],
+                "time_last_dumped": item["time_last_dumped"],
+            },
+        )
+    )
+    body = b"".join(nested_sink.ch_encoder.iter_encode(rows))
+    compressed_body, _headers = nested_sink.compress_body(body)
+    return {
+        "rows": rows.count,
+        "bytes": len(body),
+        "compressed_bytes": len(compressed_body),
+    }
+
+
+def get_flow_controller(sink, batch_size, sleep_time):
+    """
+    Return a FlowController adapting the dump of the sink, and report its requests to it.
+    """
+
+    def get_active_parts():
+        try:
+            return sink.get_active_parts()
+        except requests.exceptions.RequestException as e:
+            log.warning(f"Could not read the active parts of {sink.name}: {e}")
+            return None
+
+    flow_controller = FlowController(
+        batch_size,
+        sleep_time,
+        get_active_parts,
+        **get_flow_control_config(
+            settings.EVENT_SINK_CLICKHOUSE_BACKEND_CONFIG, sink.connection_overrides
+        ),
+    )
+    sink.use_flow_controller(flow_controller)
+    return flow_controller
+
+
+def prefetch(iterable, max_items):
+    """
+    Iterate over iterable in a background thread, staying at most max_items ahead.
+
+    Errors raised by iterable are raised to the consumer. Closing the returned
+    generator stops the thread once it's done with its current item.
+    """
+    items = queue.Queue(maxsize=max_items)
+    stop = threading.Event()
+    end = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((end, None))
+        except BaseException as e:
+            put((end, e))
+        finally:
+            # The thread's database connections are its own
+            connections.close_all()
+
+    thread = threading.Thread(target=produce, name="dump-prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if item is end:
+                if error:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def get_resync_sinks(connection_overrides):
+    """
+    Return the enabled sinks dumped by --object all, with the size of their tables.
+
+    Sinks are sorted smallest table first, so small tables are complete early.
+    """
+    sinks = [
+        Sink(connection_overrides, log)
+        for Sink in ModelBaseSink.__subclasses__()
+        if Sink.model and Sink.include_in_resync and Sink.is_enabled()
+    ]
+    sizes = {sink.model: sink.get_queryset().count() for sink in sinks}
+    return sorted(sinks, key=lambda sink: sizes[sink.model]), sizes
+
+
+class ResyncProgress:
+    """
+    Combined progress of the sinks dumped concurrently by --object all.
+    """
+
+    def __init__(self, totals, report_interval_secs=30):
+        self.totals = totals
+        self.dumped = dict.fromkeys(totals, 0)
+        self.status = dict.fromkeys(totals, "waiting")
+        self.report_interval_secs = report_interval_secs
+        self._lock = threading.Lock()
+        self._reported_at = time.monotonic()
+
+    def set_status(self, model, status):
+        with self._lock:
+            self.status[model] = status
+
+    def add(self, model, num_objects):
+        """
+        Count dumped objects of a sink, reporting the progress once in a while.
+        """
+        with self._lock:
+            self.dumped[model] += num_objects
+            due = time.monotonic() - self._reported_at >= self.report_interval_secs
+        if due:
+            self.report()
+
+    def report(self):
+        """
+        Log the progress of every sink on one line.
+        """
+        with self._lock:
+            self._reported_at = time.monotonic()
+            sinks = ", ".join(
+                f"{model} {self.status[model]} {self.dumped[model]}/{total}"
+                for model, total in self.totals.items()
+            )
+            dumped = sum(self.dumped.values())
+        log.info(
+            f"Resync progress: {dumped}/{sum(self.totals.values())} objects, {sinks}"
+        )
+
+
+class SharedProgress:
+    """
+    Count of dumped objects and stop flag shared by the workers of a parallel dump.
+
+    Must be created before the worker processes are forked.
+    """
+
+    def __init__(self, context, limit=None):
+        self.limit = limit
+        self._dumped = context.Value("q", 0)
+        self._stop = context.Event()
+
+    def reserve(self, num_objects):
+        """
+        Return how many of num_objects may still be dumped, counting them as dumped.
+
+        Nothing may be dumped once the dump is stopped, which happens when the global
+        limit is reached.
+        """
+        with self._dumped.get_lock():
+            if self._stop.is_set():
+                return 0
+            allowed = num_objects
+            if self.limit:
+                allowed = max(0, min(num_objects, self.limit - self._dumped.value))
+                if self._dumped.value + allowed >= self.limit:
+                    self._stop.set()
+            self._dumped.value += allowed
+        return allowed
+
+    def get_dumped(self):
+        return self._dumped.value
+
+    def stop(self):
+        """
+        Ask every worker to stop after its current batch.
+        """
+        self._stop.set()
+
+    def is_stopped(self):
+        return self._stop.is_set()
+
+
+def get_pk_ranges(queryset, workers, start_pk=None):
+    """
+    Split the primary keys of the queryset into at most `workers` (start, end] ranges.
+
+    Integer keys are split evenly between the smallest and the largest one, others
+    at quantiles sampled with a COUNT(*) and an OFFSET query per range. The last
+    range is open ended, so objects created during the dump are still picked up.
+
+    Quantiles are kept in the order the database returns them and never compared
+    in Python: keys like CourseKeys can't be ordered across types, and Python may
+    not order them like the database's collation does.
+    """
+    pks = queryset.order_by("pk").values_list("pk", flat=True)
+    first, last = pks.first(), pks.last()
+    if first is None:
+        return []
+
+    if isinstance(first, int):
+        span = last - first + 1
+        bounds = sorted(
+            bound
+            for bound in {first - 1 + span * i // workers for i in range(1, workers)}
+            if first <= bound < last
+        )
+    else:
+        total = queryset.count()
+        bounds = []
+        for i in range(1, workers):
+            if total * i // workers == 0:
+                continue
+            bound = pks[total * i // workers - 1]
+            if bound != last and (not bounds or bound != bounds[-1]):
+                bounds.append(bound)
+
+    edges = [start_pk, *bounds]
+    return list(zip(edges, edges[1:] + [None]))
+
+
+_worker_progress = None
+
+
+def _init_worker(progress):
+    """
+    Keep the SharedProgress inherited from the parent, it can't be pickled.
+    """
+    global _worker_progress  # pylint: disable=global-statement
+    _worker_progress = progress
+
+
+def _dump_pk_range(
+    worker, model, connection_overrides, pk_range, checkpoint, dump_options
+):
+    """
+    Dump the objects of one primary key range, in a worker process.
+    """
+    multiprocessing.current_process().name = f"Worker {worker}"
+    sink = ModelBaseSink.get_sink_by_model_name(model)(connection_overrides, log)
+    start_pk, end_pk = pk_range
+    log.info(
+        f"Worker {worker}: dumping {sink.name} with keys in ({start_pk}, {end_pk}]"
+    )
+    return dump_target_objects_to_clickhouse(
+        sink,
+        start_pk,
+        dump_options,
+        end_pk=end_pk,
+        progress=_worker_progress,
+        checkpoint=checkpoint,
+    )
+
+
+def dump_in_parallel(
+    model,
+    connection_overrides,
+    pk_ranges,
+    dump_options,
+    checkpoints=None,
+    limit=None,
+):
+    """
+    Dump the objects of a model from a pool of worker processes, one per pk range.
+
+    The limit is shared by every worker. If a worker fails or the dump is
+    interrupted, the other workers stop after their current batch.
+
+    Returns: the number of objects dumped.
+    """
+    checkpoints = checkpoints or [None] * len(pk_ranges)
+    context = multiprocessing.get_context("fork")
+    progress = SharedProgress(context, limit)
+    # Each worker must open its own database connections
+    connections.close_all()
+
+    count = 0
+    with ProcessPoolExecutor(
+        max_workers=len(pk_ranges),
+        mp_context=context,
+        initializer=_init_worker,
+        initargs=(progress,),
+    ) as executor:
+        futures = {
+            executor.submit(
+                _dump_pk_range,
+                worker,
+                model,
+                connection_overrides,
+                pk_range,
+                checkpoint,
+                dump_options,
+            ): worker
+            for worker, (pk_range, checkpoint) in enumerate(
+                zip(pk_ranges, checkpoints), start=1
+            )
+        }
+        try:
+            for future in as_completed(futures):
+                worker_count = future.result()
+                count += worker_count
+                log.info(f"Worker {futures[future]} finished, dumped {worker_count}")
+        except BaseException:
+            log.error("Stopping the other workers after their current batch")
+            progress.stop()
+            raise
+
+    if limit and count >= limit:
+        log.info(f"Limit of {limit} eligible objects has been reached, quitting!")
+    log.info(f"Dumped {count} objects to ClickHouse with {len(pk_ranges)} workers")
+    return count
 
 
 class Command(BaseCommand):
@@ -114,10 +746,16 @@ class Command(BaseCommand):
             type=int,
             help="timeout for ClickHouse requests, in seconds",
         )
+        parser.add_argument(
+            "--compression",
+            type=str,
+            choices=["gzip", "zstd", "lz4"],
+            help="compress insert bodies with this codec",
+        )
         parser.add_argument(
             "--object",
             type=str,
-            help="the type of object to dump",
+            help=f"the type of object to dump, '{ALL_OBJECTS}' dumps every enabled sink",
         )
         parser.add_argument(
             "--start_pk",
@@ -142,7 +780,9 @@ class Command(BaseCommand):
         parser.add_argument(
             "--force",
             action="store_true",
-            help="dump all objects regardless of when they were last published",
+            help="dump all objects regardless of when they were last published, "
+            "including the blocks of courses whose published structure didn't change, "
+            "which are otherwise not dumped again after tag edits or serializer changes",
         )
         parser.add_argument(
             "--limit",
@@ -161,6 +801,47 @@ class Command(BaseCommand):
             default=1,
             help="number of seconds to sleep between batches",
         )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=1,
+            help="number of inserts to keep in flight at once, requires aiohttp if more than 1; "
+            f"with '--object {ALL_OBJECTS}', the number of sinks dumped at once",
+        )
+        parser.add_argument(
+            "--adaptive",
+            action="store_true",
+            help="adapt the batch size and sleep time to ClickHouse's health, "
+            "starting from --batch_size and --sleep_time",
+        )
+        parser.add_argument(
+            "--prefetch_batches",
+            type=int,
+            default=2,
+            help="number of batches read from the database ahead of the one being sent, 0 to disable",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="number of processes dumping ranges of primary keys in parallel",
+        )
+        parser.add_argument(
+            "--plan",
+            action="store_true",
+            help="only estimate the rows, bytes and time the dump would take, from a sample",
+        )
+        parser.add_argument(
+            "--plan_sample_size",
+            type=int,
+            default=1000,
+            help="number of objects sampled to estimate the dump with --plan",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="continue the last run of the same dump from its checkpoint, requires checkpoint_dir",
+        )
 
     def handle(self, *args, **options):
         """
@@ -168,40 +849,284 @@ class Command(BaseCommand):
         """
         connection_overrides = {
             key: options[key]
-            for key in ["url", "username", "password", "database", "timeout_secs"]
+            for key in [
+                "url",
+                "username",
+                "password",
+                "database",
+                "timeout_secs",
+                "compression",
+            ]
             if options[key]
         }
+        self.validate_options(options)
 
-        ids = options["ids"] if options["ids"] else []
-        ids_to_skip = options["ids_to_skip"] if options["ids_to_skip"] else []
+        checkpoint_store = get_checkpoint_store(
+            settings.EVENT_SINK_CLICKHOUSE_BACKEND_CONFIG, connection_overrides
+        )
+        if options["resume"] and not checkpoint_store:
+            self.fail("'resume' requires checkpoint_dir to be configured.")
+
+        dump_options = DumpOptions(
+            object_ids=[object_id.strip() for object_id in options["ids"] or []],
+            objects_to_skip=[
+                object_id.strip() for object_id in options["ids_to_skip"] or []
+            ],
+            force=options["force"],
+            batch_size=options["batch_size"],
+            sleep_time=options["sleep_time"],
+            concurrency=options["concurrency"],
+            prefetch_batches=options["prefetch_batches"],
+            adaptive=options["adaptive"],
+        )
 
+        if options["object"] == ALL_OBJECTS:
+            self.dump_all(connection_overrides, options, dump_options, checkpoint_store)
+            return
+
+        Sink = ModelBaseSink.get_sink_by_model_name(options["object"])
+        self.dump_sink(
+            Sink(connection_overrides, log),
+            connection_overrides,
+            options,
+            dump_options,
+            checkpoint_store,
+        )
+
+    def fail(self, message):
+        """
+        Log the error and stop the command.
+        """
+        log.error(message)
+        raise CommandError(message)
+
+    def validate_options(self, options):
+        """
+        Stop the command if the options can't be used together.
+        """
         if options["limit"] is not None and int(options["limit"]) < 1:
-            message = "'limit' must be greater than 0!"
-            log.error(message)
-            raise CommandError(message)
+            self.fail("'limit' must be greater than 0!")
 
         if options["limit"] and options["force"]:
-            message = (
+            self.fail(
                 "The 'limit' option cannot be used with 'force' as running the "
                 "command repeatedly will result in the same objects being dumped every time."
             )
-            log.error(message)
-            raise CommandError(message)
+
+        for option in ["concurrency", "plan_sample_size", "workers"]:
+            if options[option] < 1:
+                self.fail(f"'{option}' must be greater than 0!")
+
+        dump_all = options["object"] == ALL_OBJECTS
+        if dump_all:
+            for option in ["ids", "ids_to_skip", "start_pk", "limit"]:
+                if options[option]:
+                    self.fail(
+                        f"'{option}' cannot be used with '--object {ALL_OBJECTS}'."
+                    )
+            if options["workers"] > 1:
+                self.fail(f"'workers' cannot be used with '--object {ALL_OBJECTS}'.")
+
+        if (
+            options["concurrency"] > 1
+            and not dump_all
+            and not async_transport.is_available()
+        ):
+            self.fail("'concurrency' greater than 1 requires the aiohttp library.")
+
+        if options["prefetch_batches"] < 0:
+            self.fail("'prefetch_batches' must not be negative!")
 
         if options["object"] is None:
-            message = "You must specify an object type to dump!"
+            self.fail("You must specify an object type to dump!")
+
+    def dump_all(self, connection_overrides, options, dump_options, checkpoint_store):
+        """
+        Dump every enabled sink, --concurrency of them at once, smallest table first.
+
+        Each sink sends one insert at a time, so at most --concurrency inserts are in
+        flight, through the connection pool shared by every sink of the process.
+        """
+        sinks, sizes = get_resync_sinks(connection_overrides)
+        if not sinks:
+            log.info("No enabled sink to dump")
+            return
+        sink_sizes = ", ".join(
+            f"{sink.model} ({sizes[sink.model]} objects)" for sink in sinks
+        )
+        log.info(f"Dumping {sink_sizes}")
+
+        if options["plan"]:
+            for sink in sinks:
+                self.dump_sink(
+                    sink, connection_overrides, options, dump_options, checkpoint_store
+                )
+            return
+
+        progress = ResyncProgress({sink.model: sizes[sink.model] for sink in sinks})
+        sink_dump_options = replace(dump_options, concurrency=1)
+
+        def dump_one(sink):
+            progress.set_status(sink.model, "running")
+            try:
+                self.dump_sink(
+                    sink,
+                    connection_overrides,
+                    options,
+                    sink_dump_options,
+                    checkpoint_store,
+                    report_progress=functools.partial(progress.add, sink.model),
+                )
+            except Exception:
+                progress.set_status(sink.model, "failed")
+                log.exception(f"Dumping {sink.name} failed")
+                raise
+            finally:
+                # The thread's database connections are its own
+                connections.close_all()
+            progress.set_status(sink.model, "done")
+
+        failed = []
+        with ThreadPoolExecutor(
+            max_workers=min(options["concurrency"], len(sinks)),
+            thread_name_prefix="dump-sink",
+        ) as executor:
+            futures = {executor.submit(dump_one, sink): sink for sink in sinks}
+            for future in as_completed(futures):
+                if future.exception():
+                    failed.append(futures[future].model)
+                progress.report()
+
+        if failed:
+            message = (
+                f"Dumping {', '.join(sorted(failed))} failed, see the errors above."
+            )
             log.error(message)
             raise CommandError(message)
 
-        Sink = ModelBaseSink.get_sink_by_model_name(options["object"])
-        sink = Sink(connection_overrides, log)
-        dump_target_objects_to_clickhouse(
-            sink,
-            options["start_pk"],
-            [object_id.strip() for object_id in ids],
-            [object_id.strip() for object_id in ids_to_skip],
-            options["force"],
-            options["limit"],
-            options["batch_size"],
-            options["sleep_time"],
+    def dump_sink(
+        self,
+        sink,
+        connection_overrides,
+        options,
+        dump_options,
+        checkpoint_store,
+        report_progress=None,
+    ):
+        """
+        Dump the objects of one sink, or only plan it with --plan.
+
+        Returns: the number of objects dumped.
+        """
+        model = sink.model
+        start_pk = options["start_pk"]
+        limit = options["limit"]
+
+        if options["plan"]:
+            self.log_plan(
+                sink,
+                plan_dump(
+                    sink,
+                    start_pk,
+                    dump_options,
+                    workers=options["workers"],
+                    sample_size=options["plan_sample_size"],
+                ),
+                options,
+            )
+            return 0
+
+        checkpoints = None
+        if checkpoint_store:
+            run_key = checkpoint_store.get_run_key(
+                model=model,
+                database=sink.ch_database,
+                start_pk=start_pk,
+                object_ids=dump_options.object_ids,
+                objects_to_skip=dump_options.objects_to_skip,
+                force=dump_options.force,
+            )
+            if options["resume"]:
+                checkpoints = checkpoint_store.load(model, run_key)
+                if checkpoints:
+                    log.info(
+                        f"Resuming {sink.name} dump {run_key}, "
+                        f"{sum(c.dumped for c in checkpoints)} objects already dumped"
+                    )
+                else:
+                    log.info(f"No checkpoint found for {sink.name} dump {run_key}")
+
+        if not checkpoints:
+            if options["workers"] > 1:
+                pk_ranges = get_pk_ranges(
+                    sink.get_queryset(start_pk), options["workers"], start_pk
+                )
+            else:
+                pk_ranges = [(start_pk, None)]
+            if checkpoint_store:
+                checkpoints = checkpoint_store.start(model, run_key, pk_ranges)
+
+        if checkpoints:
+            checkpoints = [c for c in checkpoints if not c.done]
+            pk_ranges = [(c.resume_pk, c.end_pk) for c in checkpoints]
+
+        count = 0
+        if options["workers"] > 1 and pk_ranges:
+            count = dump_in_parallel(
+                model,
+                connection_overrides,
+                pk_ranges,
+                dump_options,
+                checkpoints,
+                limit,
+            )
+        else:
+            for (range_start_pk, end_pk), checkpoint in zip(
+                pk_ranges, checkpoints or [None] * len(pk_ranges)
+            ):
+                count += dump_target_objects_to_clickhouse(
+                    sink,
+                    range_start_pk,
+                    dump_options,
+                    end_pk=end_pk,
+                    limit=limit - count if limit else None,
+                    checkpoint=checkpoint,
+                    report_progress=report_progress,
+                )
+                if limit and count >= limit:
+                    break
+
+        if checkpoint_store:
+            if all(c.done for c in checkpoint_store.load(model, run_key)):
+                checkpoint_store.clear(model, run_key)
+            else:
+                log.info(f"Run again with --resume to continue {sink.name} dump")
+        return count
+
+    def log_plan(self, sink, plan, options):
+        """
+        Log the estimates of a dump planned with --plan.
+        """
+        log.info(
+            f"Plan for {sink.name} dump, nothing will be sent to ClickHouse. "
+            f"Estimates are extrapolated from {plan['sampled']} sampled objects."
+        )
+        log.info(
+            f"Rows: {plan['rows']} of {plan['total_objects']} selected objects, "
+            f"in {plan['batches']} batches of {options['batch_size']}"
+        )
+        log.info(
+            f"Payload: {plan['bytes']} bytes uncompressed, "
+            f"{plan['compressed_bytes']} bytes with compression {plan['codec']}"
+        )
+        for name, nested in plan["nested"].items():
+            log.info(
+                f"Related {name}: {nested['rows']} rows, {nested['bytes']} bytes "
+                f"uncompressed, {nested['compressed_bytes']} bytes compressed, "
+                "assuming every selected object's are dumped again"
+            )
+        log.info(
+            f"Duration: {plan['duration_secs']:.0f} seconds with "
+            f"{options['workers']} workers and a {options['sleep_time']}s sleep "
+            "between batches, not counting the time ClickHouse takes to insert"
         )
@@ -22,6 +22,7 @@ from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
 
 from platform_plugin_aspects.sinks.base_sink import ClickHouseAuth
+from platform_plugin_aspects.sinks.endpoints import get_endpoint_urls
 
 # For testing we won't be able to import from edx-platform
 try:  # pragma: no cover
@@ -63,7 +64,10 @@ class LoadTest:
 
         self.course_shortname = str(uuid.uuid4())[:6]
 
-        self.ch_url = settings.EVENT_SINK_CLICKHOUSE_BACKEND_CONFIG["url"]
+        # Replicas are equivalent, run events and lag are read from the first one
+        self.ch_url = get_endpoint_urls(
+            settings.EVENT_SINK_CLICKHOUSE_BACKEND_CONFIG["url"]
+        )[0]
         self.ch_auth = ClickHouseAuth(
             settings.EVENT_SINK_CLICKHOUSE_BACKEND_CONFIG["username"],
             settings.EVENT_SINK_CLICKHOUSE_BACKEND_CONFIG["password"],
@@ -17,6 +17,7 @@ from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
 
 from platform_plugin_aspects.sinks.base_sink import ClickHouseAuth
+from platform_plugin_aspects.sinks.endpoints import get_endpoint_urls
 
 try:
     import confluent_kafka
@@ -34,7 +35,10 @@ class Monitor:
     run_id = None
 
     def __init__(self, sleep_time: float, backend: str):
-        self.ch_url = settings.EVENT_SINK_CLICKHOUSE_BACKEND_CONFIG["url"]
+        # Replicas are equivalent, run events and lag are read from the first one
+        self.ch_url = get_endpoint_urls(
+            settings.EVENT_SINK_CLICKHOUSE_BACKEND_CONFIG["url"]
+        )[0]
         self.ch_auth = ClickHouseAuth(
             settings.EVENT_SINK_CLICKHOUSE_BACKEND_CONFIG["username"],
             settings.EVENT_SINK_CLICKHOUSE_BACKEND_CONFIG["password"],
@@ -0,0 +1,181 @@
+"""
+asyncio transport to keep several ClickHouse inserts in flight at once.
+
+Bulk dumps are usually bound by the network round trip of each insert rather than
+by CPU. With an AsyncTransport, sinks still serialize and encode batches in the
+calling thread, where the Django ORM can be used, but hand the encoded request to an
+event loop running in a background thread and carry on with the next batch. A
+semaphore bounds the number of inserts in flight, which also bounds the memory held
+by encoded bodies waiting to be sent.
+
+Requires the optional ``aiohttp`` package.
+"""
+
+import asyncio
+import concurrent.futures
+import threading
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover
+    aiohttp = None
+
+
+def is_available():
+    """
+    Return True if the libraries needed by the asyncio transport are installed.
+    """
+    return aiohttp is not None
+
+
+class AsyncTransport:
+    """
+    Send ClickHouse requests concurrently from an event loop in a background thread.
+
+    submit() blocks once `concurrency` requests are in flight. Errors are raised by
+    the next call to submit() or by flush(), so a failed insert stops the dump
+    instead of being silently dropped. Use as a context manager, or call close().
+    """
+
+    def __init__(self, concurrency=4):
+        if not is_available():
+            raise ValueError(
+                "The asyncio ClickHouse transport needs the aiohttp library, "
+                "which is not installed"
+            )
+        if concurrency < 1:
+            raise ValueError("The asyncio transport needs a concurrency of at least 1")
+
+        self.concurrency = concurrency
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._futures = set()
+        self._lock = threading.Lock()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever,
+            name="clickhouse-async-transport",
+            daemon=True,
+        )
+        self._thread.start()
+        self._session = self._run(self._create_session())
+
+    async def _create_session(self):
+        return aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.concurrency)
+        )
+
+    def _run(self, coroutine):
+        """
+        Run a coroutine on the event loop and wait for its result.
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    async def post(self, url, request, timeout_secs):
+        """
+        POST a requests.Request to the given URL.
+
+        aiohttp errors are raised as the equivalent requests exceptions, so that
+        sinks handle failures the same way whichever transport sent the request.
+        """
+        auth = aiohttp.BasicAuth(*request.auth) if request.auth else None
+        try:
+            async with self._session.post(
+                url,
+                params=request.params,
+                data=request.data,
+                headers=request.headers,
+                auth=auth,
+                timeout=aiohttp.ClientTimeout(total=timeout_secs),
+            ) as response:
+                content = await response.read()
+        except (asyncio.TimeoutError, aiohttp.ServerTimeoutError) as e:
+            raise requests.exceptions.Timeout(str(e)) from e
+        except aiohttp.ClientConnectionError as e:
+            raise requests.exceptions.ConnectionError(str(e)) from e
+        except aiohttp.ClientError as e:
+            raise requests.exceptions.RequestException(str(e)) from e
+
+        result = requests.Response()
+        result.status_code = response.status
+        result.reason = response.reason
+        result.headers = CaseInsensitiveDict(response.headers)
+        result.url = str(response.url)
+        result._content = content  # pylint: disable=protected-access
+        result.raise_for_status()
+        return result
+
+    async def _send(self, sink, request, on_failure):
+        """
+        Send a request through the sink, then free its concurrency slot.
+
+        on_failure runs in the loop's default executor, as it may block, e.g. to
+        write the insert to the spool, while the other requests are in flight.
+        """
+        try:
+            # pylint: disable=protected-access
+            return await sink._async_send_clickhouse_request(self, request)
+        except requests.exceptions.RequestException as e:
+            if on_failure is None:
+                raise
+            return await asyncio.get_running_loop().run_in_executor(None, on_failure, e)
+        finally:
+            self._slots.release()
+
+    def _raise_errors(self):
+        """
+        Forget the finished requests, raising the error of the first failed one.
+        """
+        with self._lock:
+            done = [future for future in self._futures if future.done()]
+            self._futures.difference_update(done)
+
+        for future in done:
+            if future.exception() is not None:
+                raise future.exception()
+
+    def submit(self, sink, request, on_failure=None):
+        """
+        Send the request to ClickHouse in the background.
+
+        request.data must be bytes. on_failure is called with the exception if the
+        request fails for good, e.g. to spool the insert; errors it raises are
+        reported like any other.
+        """
+        self._raise_errors()
+        self._slots.acquire()  # pylint: disable=consider-using-with
+        future = asyncio.run_coroutine_threadsafe(
+            self._send(sink, request, on_failure), self._loop
+        )
+        with self._lock:
+            self._futures.add(future)
+        return future
+
+    def flush(self):
+        """
+        Wait for every request in flight and raise the first error, if any.
+        """
+        with self._lock:
+            futures = list(self._futures)
+        concurrent.futures.wait(futures)
+        self._raise_errors()
+
+    def close(self):
+        """
+        Wait for the requests in flight, then stop the event loop.
+        """
+        try:
+            self.flush()
+        finally:
+            self._run(self._session.close())
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
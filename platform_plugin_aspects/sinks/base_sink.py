@@ -2,22 +2,57 @@
 Base classes for event sinks
 """
 
-import csv
+import asyncio
 import datetime
-import io
+import functools
+import itertools
 import logging
+import threading
+import time
+import uuid
 from collections import namedtuple
+from collections.abc import Sized
 
 import requests
 from django.conf import settings
-from django.core.paginator import Paginator
+from django.utils import timezone
 from edx_toggles.toggles import WaffleFlag
 
+from platform_plugin_aspects.sinks.circuit_breaker import (
+    get_breaker_config,
+    get_circuit_breaker,
+)
+from platform_plugin_aspects.sinks.compression import get_codec
+from platform_plugin_aspects.sinks.connection import (
+    get_clickhouse_session,
+    get_pool_config,
+)
+from platform_plugin_aspects.sinks.encoders import get_encoder, iter_chunks
+from platform_plugin_aspects.sinks.endpoints import (
+    get_endpoint_config,
+    get_endpoint_pool,
+    get_endpoint_urls,
+)
+from platform_plugin_aspects.sinks.ledger import get_dump_ledger, hash_row
+from platform_plugin_aspects.sinks.retry import ReplayableBody, RetryPolicy
+from platform_plugin_aspects.sinks.schema import (
+    SchemaMismatchError,
+    check_row_columns,
+    get_cached_schema,
+    get_schema_config,
+    invalidate_schema,
+    parse_describe_table,
+)
+from platform_plugin_aspects.sinks.serializers import format_projected_value
+from platform_plugin_aspects.sinks.spool import SpoolFullError, get_spool
 from platform_plugin_aspects.utils import get_model
 from platform_plugin_aspects.waffle import WAFFLE_FLAG_NAMESPACE
 
 ClickHouseAuth = namedtuple("ClickHouseAuth", ["username", "password"])
 
+# Insert bodies larger than this are streamed to ClickHouse in chunks of this size
+DEFAULT_INSERT_CHUNK_SIZE = 1024 * 1024
+
 
 class BaseSink:
     """
@@ -29,6 +64,12 @@ class BaseSink:
         "input_format_allow_errors_ratio": 0.1,
     }
 
+    compression = None
+    """
+    str: The codec used to compress insert bodies (gzip, zstd or lz4), None to send
+    them uncompressed. Can be overridden through settings and connection overrides.
+    """
+
     def __init__(self, connection_overrides, log):
         self.connection_overrides = connection_overrides
         self.log = log
@@ -54,23 +95,274 @@ class BaseSink:
                 "timeout_secs", self.ch_timeout_secs
             )
 
-    def _send_clickhouse_request(self, request):
+        # "url" can be a list of equivalent replicas, requests are balanced between them
+        self.ch_urls = get_endpoint_urls(self.ch_url)
+        self.ch_url = self.ch_urls[0]
+        self.ch_endpoints = get_endpoint_pool(
+            self.ch_urls,
+            get_endpoint_config(
+                settings.EVENT_SINK_CLICKHOUSE_BACKEND_CONFIG, connection_overrides
+            ),
+        )
+
+        self.ch_breaker = get_circuit_breaker(
+            self.ch_urls,
+            get_breaker_config(
+                settings.EVENT_SINK_CLICKHOUSE_BACKEND_CONFIG, connection_overrides
+            ),
+        )
+
+        self.ch_pool_config = get_pool_config(
+            settings.EVENT_SINK_CLICKHOUSE_BACKEND_CONFIG, connection_overrides
+        )
+        self.ch_retry_policy = RetryPolicy.from_config(
+            settings.EVENT_SINK_CLICKHOUSE_BACKEND_CONFIG, connection_overrides
+        )
+        self.ch_spool = get_spool(
+            settings.EVENT_SINK_CLICKHOUSE_BACKEND_CONFIG, connection_overrides
+        )
+        self.ch_compression = get_codec(self.get_compression())
+        # Set with use_async_transport() to send inserts without waiting for them
+        self.ch_transport = None
+        # Set with use_flow_controller() to report request latencies and failures
+        self.ch_flow_controller = None
+        self.ch_insert_chunk_size = settings.EVENT_SINK_CLICKHOUSE_BACKEND_CONFIG.get(
+            "insert_chunk_size", DEFAULT_INSERT_CHUNK_SIZE
+        )
+        if connection_overrides:
+            self.ch_insert_chunk_size = connection_overrides.get(
+                "insert_chunk_size", self.ch_insert_chunk_size
+            )
+
+    def send_spooled(self, params, body, content_encoding=None):
+        """
+        Send an insert that was read back from the spool.
+        """
+        headers = {"Content-Encoding": content_encoding} if content_encoding else {}
+        self.post_query(params, body, headers)
+
+    def post_query(self, params, data=None, headers=None):
+        """
+        POST a query to ClickHouse, with an optional body, and return the response.
+        """
+        request = requests.Request(
+            "POST",
+            self.ch_url,
+            data=data,
+            params=params,
+            headers=headers or {},
+            auth=self.ch_auth,
+        )
+        return self._send_clickhouse_request(request)
+
+    def drain_spool(self, table=None):
+        """
+        Send the inserts waiting in the spool, merged into large batches.
+
+        Returns the number of spooled inserts that were sent.
+        """
+        if not self.ch_spool:
+            return 0
+        return self.ch_spool.drain(self.send_spooled, table=table)
+
+    def get_compression(self):
+        """
+        Return the name of the codec to compress insert bodies with.
+
+        Connection overrides take precedence over the sink's own setting, which
+        takes precedence over the backend config.
+        """
+        compression = self.get_sink_compression() or (
+            settings.EVENT_SINK_CLICKHOUSE_BACKEND_CONFIG.get("compression")
+        )
+        if self.connection_overrides:
+            compression = self.connection_overrides.get("compression", compression)
+        return compression
+
+    def get_sink_compression(self):
+        """
+        Return the compression codec configured for this specific sink.
+        """
+        return self.compression
+
+    def _send_clickhouse_request(self, request, is_insert=False):
         """
         Perform the actual HTTP requests to ClickHouse.
+
+        Requests go through the process-wide connection pool so that connections
+        are kept alive and shared by every sink in the process. Each attempt is sent
+        to an endpoint picked by the endpoint pool. Transient failures mark the
+        endpoint unhealthy and fail over to the next healthy one; when none is left
+        the request is retried with exponential backoff, resending the already
+        encoded body.
+
+        While the circuit breaker is open, CircuitOpenError is raised straight away
+        instead of sending anything. Only inserts, flagged with is_insert, are
+        reported to the flow controller, as other queries don't reflect how fast
+        ClickHouse takes in batches.
         """
-        session = requests.Session()
-        prepared_request = request.prepare()
+        session = get_clickhouse_session(self.ch_pool_config)
+
+        replayable_body = None
+        if ReplayableBody.is_streamed(request.data):
+            replayable_body = ReplayableBody(request.data, self.ch_insert_chunk_size)
+            request.data = replayable_body
 
+        attempt = 0
+        tried_urls = set()
         try:
-            response = session.send(prepared_request, timeout=self.ch_timeout_secs)
-            response.raise_for_status()
-            return response
+            while True:
+                if self.ch_breaker:
+                    self.ch_breaker.before_request()
+                url = self.ch_endpoints.select(exclude=tried_urls)
+                request.url = url
+                prepared_request = request.prepare()
+                start = time.monotonic()
+                try:
+                    response = session.send(
+                        prepared_request, timeout=self.ch_timeout_secs
+                    )
+                    response.raise_for_status()
+                except requests.exceptions.RequestException as e:
+                    delay = self._handle_request_failure(
+                        url, e, start, attempt, tried_urls, is_insert
+                    )
+                    if delay is not None:
+                        attempt += 1
+                        time.sleep(delay)
+                else:
+                    self._record_request_success(
+                        url, time.monotonic() - start, is_insert
+                    )
+                    return response
         except requests.exceptions.HTTPError as e:
-            self.log.error(str(e))
-            self.log.error(e.response.headers)
-            self.log.error(e.response)
-            self.log.error(e.response.text)
+            self._log_http_error(e)
             raise
+        finally:
+            if replayable_body:
+                replayable_body.close()
+
+    async def _async_send_clickhouse_request(self, transport, request):
+        """
+        Perform an HTTP request to ClickHouse through an AsyncTransport.
+
+        Endpoint selection, failover, retries and the circuit breaker behave as in
+        _send_clickhouse_request, but waiting doesn't block the other requests in
+        flight. request.data must be bytes. AsyncTransport only sends inserts.
+        """
+        attempt = 0
+        tried_urls = set()
+        try:
+            while True:
+                if self.ch_breaker:
+                    self.ch_breaker.before_request()
+                url = self.ch_endpoints.select(exclude=tried_urls)
+                start = time.monotonic()
+                try:
+                    response = await transport.post(url, request, self.ch_timeout_secs)
+                except requests.exceptions.RequestException as e:
+                    delay = self._handle_request_failure(
+                        url, e, start, attempt, tried_urls, is_insert=True
+                    )
+                    if delay is not None:
+                        attempt += 1
+                        await asyncio.sleep(delay)
+                else:
+                    self._record_request_success(
+                        url, time.monotonic() - start, is_insert=True
+                    )
+                    return response
+        except requests.exceptions.HTTPError as e:
+            self._log_http_error(e)
+            raise
+
+    def _record_request_success(self, url, latency, is_insert=False):
+        """
+        Record a request ClickHouse accepted with the endpoint pool and breaker.
+
+        The latency of inserts is also reported to the flow controller.
+        """
+        self.ch_endpoints.mark_success(url, latency)
+        if self.ch_breaker:
+            self.ch_breaker.record_success(latency)
+        if self.ch_flow_controller and is_insert:
+            self.ch_flow_controller.record_latency(latency)
+
+    def _handle_request_failure(
+        self, url, exception, start, attempt, tried_urls, is_insert=False
+    ):
+        """
+        Record a failed request attempt and decide what to do next.
+
+        Returns None to fail over to another healthy replica straight away, or the
+        number of seconds to wait before retrying. Raises the exception if the
+        request should not be tried again.
+        """
+        if not self.ch_retry_policy.is_retryable(exception):
+            # ClickHouse answered, it just didn't like the request
+            if self.ch_breaker:
+                self.ch_breaker.record_success(time.monotonic() - start)
+            raise exception
+
+        if self.ch_breaker:
+            self.ch_breaker.record_failure()
+        if self.ch_flow_controller and is_insert:
+            self.ch_flow_controller.record_failure()
+        self.ch_endpoints.mark_failure(url)
+        tried_urls.add(url)
+
+        # Fail over to another healthy replica straight away
+        if self.ch_endpoints.has_healthy(exclude=tried_urls):
+            self.log.warning(
+                f"ClickHouse request to {url} failed ({exception}), "
+                "failing over to another endpoint"
+            )
+            return None
+
+        if not self.ch_retry_policy.should_retry(attempt, exception):
+            raise exception
+
+        delay = self.ch_retry_policy.get_delay(attempt)
+        tried_urls.clear()
+        self.log.warning(
+            f"ClickHouse request failed ({exception}), retrying in {delay:.2f}s "
+            f"(attempt {attempt + 1} of {self.ch_retry_policy.max_retries})"
+        )
+        return delay
+
+    def _log_http_error(self, exception):
+        """
+        Log the details of an error response from ClickHouse.
+        """
+        self.log.error(str(exception))
+        self.log.error(exception.response.headers)
+        self.log.error(exception.response)
+        self.log.error(exception.response.text)
+
+
+class ProjectedRow(tuple):
+    """
+    The pk of a row read through a sink projection, followed by the projected values.
+    """
+
+    @property
+    def pk(self):
+        return self[0]
+
+
+class CountedItems:
+    """
+    Iterates over serialized items of unknown length, counting them as they go.
+    """
+
+    def __init__(self, items):
+        self.items = items
+        self.count = 0
+
+    def __iter__(self):
+        for item in self.items:
+            self.count += 1
+            yield item
 
 
 class ModelBaseSink(BaseSink):
@@ -132,6 +424,37 @@ class ModelBaseSink(BaseSink):
     function: A function to format the primary key of the model
     """
 
+    insert_format = "CSV"
+    """
+    str: The ClickHouse input format used for inserts, "CSV" or "RowBinary".
+    Can be overridden with the EVENT_SINK_CLICKHOUSE_<TABLE NAME>_INSERT_FORMAT setting.
+    """
+
+    clickhouse_schema = None
+    """
+    list: (column name, ClickHouse type) tuples describing the table columns, in order.
+    When not set, the schema is fetched with DESCRIBE TABLE and cached.
+    """
+
+    excluded_columns = ()
+    """
+    tuple: Columns left out of inserts, ClickHouse fills them with their default value.
+    Can be overridden with the EVENT_SINK_CLICKHOUSE_<TABLE NAME>_EXCLUDED_COLUMNS setting.
+    """
+
+    projection = None
+    """
+    dict: ClickHouse column name -> ORM lookup (e.g. "user__username"). When set, bulk
+    dumps read only these columns with values_list() and encode the tuples directly,
+    instead of loading model instances and running them through the serializer. The
+    dump_id and time_last_dumped columns are filled in by the sink.
+    """
+
+    include_in_resync = True
+    """
+    bool: Whether ``dump_data_to_clickhouse --object all`` dumps this sink, when it's enabled.
+    """
+
     def __init__(self, connection_overrides, log):
         super().__init__(connection_overrides, log)
 
@@ -152,6 +475,163 @@ class ModelBaseSink(BaseSink):
             sink(connection_overrides, log) for sink in self.nested_sinks
         ]
 
+        self.ch_schema_config = get_schema_config(
+            settings.EVENT_SINK_CLICKHOUSE_BACKEND_CONFIG, connection_overrides
+        )
+        self._ch_encoder = None
+
+        self.ch_ledger = get_dump_ledger(
+            settings.EVENT_SINK_CLICKHOUSE_BACKEND_CONFIG, connection_overrides
+        )
+        # Row hashes of the items about to be dumped, and of the ones sent but not
+        # yet recorded in the ledger, by pk
+        self._ledger_pending = {}
+        self._ledger_sent = {}
+        # Rows serialized to be hashed, reused when the items are dumped, by pk
+        self._ledger_rows = {}
+        # Pages are checked against the ledger in a prefetch thread while batches
+        # are dumped
+        self._ledger_lock = threading.Lock()
+        # Set with use_force_dump() to dump related objects even if they didn't change
+        self.force_dump = False
+
+    @property
+    def ch_encoder(self):
+        """
+        Return the encoder for the insert columns, describing the table if needed.
+        """
+        if self._ch_encoder is None:
+            self._ch_encoder = get_encoder(
+                self.get_sink_setting("INSERT_FORMAT", self.insert_format),
+                self.get_clickhouse_schema(),
+            )
+        return self._ch_encoder
+
+    def get_schema_cache_key(self):
+        """
+        Return the key the sink's table schema is cached under in this process.
+        """
+        return (tuple(self.ch_urls), self.ch_database, self.clickhouse_table_name)
+
+    def get_clickhouse_schema(self):
+        """
+        Return the (column name, ClickHouse type) tuples to insert, in table order.
+        """
+        schema = self.clickhouse_schema or get_cached_schema(
+            self.get_schema_cache_key(),
+            self.describe_table,
+            self.ch_schema_config["schema_cache_secs"],
+        )
+        excluded_columns = self.get_excluded_columns()
+        return [
+            (name, ch_type) for name, ch_type in schema if name not in excluded_columns
+        ]
+
+    def invalidate_clickhouse_schema(self):
+        """
+        Describe the table again before the next insert.
+        """
+        invalidate_schema(self.get_schema_cache_key())
+        self._ch_encoder = None
+
+    def describe_table(self):
+        """
+        Fetch the insertable columns of the sink's table from ClickHouse.
+        """
+        params = {
+            "query": f"DESCRIBE TABLE {self.ch_database}.{self.clickhouse_table_name} "
+            "FORMAT JSONEachRow"
+        }
+        request = requests.Request("GET", self.ch_url, params=params, auth=self.ch_auth)
+        response = self._send_clickhouse_request(request)
+
+        schema = parse_describe_table(response.text)
+        if not schema:
+            raise SchemaMismatchError(
+                f"ClickHouse table {self.ch_database}.{self.clickhouse_table_name} "
+                "has no insertable columns"
+            )
+        return schema
+
+    def get_excluded_columns(self):
+        """
+        Return the columns left out of this sink's inserts.
+        """
+        return set(self.get_sink_setting("EXCLUDED_COLUMNS", self.excluded_columns))
+
+    def get_nested_sinks(self):
+        """
+        Return the sinks dumping the related objects of this sink's items.
+        """
+        return list(self._nested_sinks)
+
+    def use_async_transport(self, transport):
+        """
+        Send this sink's inserts, and its nested sinks', through an AsyncTransport.
+
+        Pass None to go back to sending them synchronously.
+        """
+        self.ch_transport = transport
+        for sink in self._nested_sinks:
+            sink.use_async_transport(transport)
+
+    def use_flow_controller(self, flow_controller):
+        """
+        Report the requests of this sink, and its nested sinks', to a FlowController.
+
+        Pass None to stop reporting them.
+        """
+        self.ch_flow_controller = flow_controller
+        for sink in self._nested_sinks:
+            sink.use_flow_controller(flow_controller)
+
+    def use_force_dump(self, force_dump):
+        """
+        Dump the related objects of this sink's items, and its nested sinks', even
+        if they didn't change since they were last dumped.
+        """
+        self.force_dump = force_dump
+        for sink in self._nested_sinks:
+            sink.use_force_dump(force_dump)
+
+    def get_active_parts(self):
+        """
+        Return the largest number of active parts in a partition of the sink's table.
+
+        ClickHouse delays, then rejects, inserts into partitions with too many parts.
+        """
+        params = {
+            "query": "SELECT max(parts) FROM (SELECT count() AS parts "
+            "FROM system.parts WHERE active "
+            f"AND database = '{self.ch_database}' "
+            f"AND table = '{self.clickhouse_table_name}' GROUP BY partition)"
+        }
+        request = requests.Request("GET", self.ch_url, params=params, auth=self.ch_auth)
+        response = self._send_clickhouse_request(request)
+        text = response.text.strip()
+        return int(text) if text else 0
+
+    def get_sink_setting(self, name, default=None):
+        """
+        Return the EVENT_SINK_CLICKHOUSE_<TABLE NAME>_<NAME> setting for this sink.
+        """
+        if not self.clickhouse_table_name:
+            return default
+
+        return getattr(
+            settings,
+            f"{WAFFLE_FLAG_NAMESPACE.upper()}_{self.clickhouse_table_name.upper()}_{name}",
+            default,
+        )
+
+    def get_sink_compression(self):
+        """
+        Return the compression codec configured for this specific sink.
+
+        ``EVENT_SINK_CLICKHOUSE_<TABLE NAME>_COMPRESSION`` allows configuring it per sink.
+        """
+        return self.get_sink_setting("COMPRESSION", self.compression)
+
     def get_model(self):
         """
         Return the model to be used for the insert
@@ -172,16 +652,38 @@ class ModelBaseSink(BaseSink):
         """
         Do the serialization and send to ClickHouse
         """
-        if many:
-            # If we're dumping many items, we expect to get a list of items
-            serialized_item = self.serialize_item(item_id, many=many, initial=initial)
-            self.log.info(
-                f"Now dumping {len(serialized_item)} {self.name} to ClickHouse",
-            )
-            self.send_item_and_log(item_id, serialized_item, many)
-            self.log.info(
-                f"Completed dumping {len(serialized_item)} {self.name} to ClickHouse"
-            )
+        if (
+            many
+            and isinstance(item_id, list)
+            and item_id
+            and isinstance(item_id[0], ProjectedRow)
+        ):
+            self.dump_projected(item_id)
+            self.record_dumped(item_id)
+        elif many:
+            # If we're dumping many items, we expect to get a list of items. The
+            # serialized items are a generator, consumed as the insert is streamed.
+            serialized_item = self.iter_serialize_items(item_id, initial=initial)
+            if self._nested_sinks:
+                # Nested sinks need the serialized items again after the insert
+                serialized_item = list(serialized_item)
+            if isinstance(serialized_item, Sized) or isinstance(item_id, list):
+                num_items = len(
+                    serialized_item if isinstance(serialized_item, Sized) else item_id
+                )
+                self.log.info(
+                    f"Now dumping {num_items} {self.name} to ClickHouse",
+                )
+                self.send_item_and_log(item_id, serialized_item, many)
+            else:
+                # Items streamed from a single object, only counted once sent
+                serialized_item = CountedItems(serialized_item)
+                self.log.info(f"Now dumping {self.name} to ClickHouse")
+                self.send_item_and_log(item_id, serialized_item, many)
+                num_items = serialized_item.count
+            self.log.info(f"Completed dumping {num_items} {self.name} to ClickHouse")
+            if isinstance(item_id, list):
+                self.record_dumped(item_id)
 
             for item in serialized_item:
                 for nested_sink in self._nested_sinks:
@@ -204,6 +706,56 @@ class ModelBaseSink(BaseSink):
                     serialized_item["time_last_dumped"],
                 )
 
+    def dump_projected(self, rows):
+        """
+        Send ProjectedRows read by fetch_target_items to ClickHouse.
+        """
+        self.log.info(f"Now dumping {len(rows)} {self.name} to ClickHouse")
+        try:
+            self.send_projected_values(self.iter_projected_values(rows))
+        except Exception:
+            self.log.exception(
+                f"Error trying to dump {self.name} {[row.pk for row in rows]} to ClickHouse!",
+            )
+            raise
+        self.log.info(f"Completed dumping {len(rows)} {self.name} to ClickHouse")
+
+    def get_projection_getters(self):
+        """
+        Return a function per insert column, reading its value from a ProjectedRow.
+
+        Values are formatted like the serializer fields would. The getters share one
+        dump_id and time_last_dumped, so a batch has a single deduplication token.
+        """
+        positions = {column: i for i, column in enumerate(self.projection, start=1)}
+        dump_id = uuid.uuid4()
+        time_last_dumped = timezone.now()
+        getters = []
+        for column in self.ch_encoder.columns:
+            if column in positions:
+                getters.append(
+                    lambda row, i=positions[column]: format_projected_value(row[i])
+                )
+            elif column == "dump_id":
+                getters.append(lambda _row: dump_id)
+            elif column == "time_last_dumped":
+                getters.append(lambda _row: time_last_dumped)
+            else:
+                raise SchemaMismatchError(
+                    f"Column {column} of ClickHouse table "
+                    f"{self.ch_database}.{self.clickhouse_table_name} "
+                    f"is not in the {self.name} projection"
+                )
+        return getters
+
+    def iter_projected_values(self, rows):
+        """
+        Yield the values of each ProjectedRow in insert column order.
+        """
+        getters = self.get_projection_getters()
+        for row in rows:
+            yield tuple(get(row) for get in getters)
+
     def send_item_and_log(
         self,
         item_id,
@@ -234,6 +786,14 @@ class ModelBaseSink(BaseSink):
             f"{self.__class__.__name__}!"
         )
 
+    def prefetch_related(self, items):
+        """
+        Look up what dump_related needs for a page of the parent sink's items at once.
+
+        Called with the items of each page the parent sink is about to dump, unless
+        the dump is forced. Does nothing by default.
+        """
+
     def serialize_item(self, item, many=False, initial=None):
         """
         Serialize the data to be sent to ClickHouse
@@ -244,52 +804,278 @@ class ModelBaseSink(BaseSink):
         )
         return serializer.data
 
+    def iter_serialize_items(self, items, initial=None):
+        """
+        Serialize many items to be sent to ClickHouse, yielding one row at a time.
+
+        Unlike serialize_item, the rows can only be read once, so only the row being
+        encoded is held in memory. Rows already serialized to check the dump ledger
+        are not serialized again.
+        """
+        Serializer = self.get_serializer()
+        serializer = Serializer(  # pylint: disable=not-callable
+            items, many=True, initial=initial
+        )
+        child = getattr(serializer, "child", None)
+        if child is None:
+            yield from serializer.data
+            return
+        for instance in items:
+            row = None
+            if initial is None:
+                with self._ledger_lock:
+                    row = self._ledger_rows.pop(getattr(instance, "pk", None), None)
+            yield child.to_representation(instance) if row is None else row
+
     def get_serializer(self):
         """
         Return the serializer to be used for the insert
         """
         return self.serializer_class
 
-    def send_item(self, serialized_item, many=False):
+    def encode_items(self, serialized_item, many=False):
         """
-        Create the insert query and CSV to send the serialized CourseOverview to ClickHouse.
+        Return the uncompressed insert body for the serialized item(s).
 
-        We still use a CSV here even though there's only 1 row because it affords handles
-        type serialization for us and keeps the pattern consistent.
+        We still use the encoder here even though there may be only 1 row because it
+        handles type serialization for us and keeps the pattern consistent.
         """
-        params = self.CLICKHOUSE_BULK_INSERT_PARAMS.copy()
+        return self.ch_encoder.encode(serialized_item if many else [serialized_item])
+
+    def get_insert_query(self, table_name=None):
+        """
+        Return the INSERT statement, with the encoder's format and explicit columns.
 
-        # "query" is a special param for the query, it's the best way to get the FORMAT CSV in there.
-        params["query"] = (
-            f"INSERT INTO {self.ch_database}.{self.clickhouse_table_name} FORMAT CSV"
+        Rows go to the sink's table unless another table_name is given.
+        """
+        columns = ", ".join(f"`{name}`" for name in self.ch_encoder.columns)
+        return (
+            f"INSERT INTO {self.ch_database}.{table_name or self.clickhouse_table_name} "
+            f"({columns}) FORMAT {self.ch_encoder.format}"
         )
 
-        output = io.StringIO()
-        writer = csv.writer(output, quoting=csv.QUOTE_NONNUMERIC)
+    def get_insert_body(self, serialized_item, many=False, projected=False):
+        """
+        Return the body to post for the serialized item(s) and the headers it needs.
 
+        Rows are encoded (and compressed) lazily. Bodies that fit in a single chunk are
+        returned as bytes, larger ones as a generator of chunks, which requests sends
+        with chunked transfer encoding so memory is bounded by the chunk size.
+        Projected rows are tuples of values already in column order.
+        """
+        rows = serialized_item if many else [serialized_item]
+        encoded_rows = (
+            self.ch_encoder.iter_encode_values(rows)
+            if projected
+            else self.ch_encoder.iter_encode(rows)
+        )
+        chunks = iter_chunks(encoded_rows, self.ch_insert_chunk_size)
+
+        first_chunk = next(chunks, b"")
+        second_chunk = next(chunks, None)
+        if second_chunk is None:
+            return self.compress_body(first_chunk)
+
+        chunks = itertools.chain([first_chunk, second_chunk], chunks)
+        if not self.ch_compression:
+            return chunks, {}
+
+        return self.ch_compression.compress_stream(chunks), {
+            "Content-Encoding": self.ch_compression.name
+        }
+
+    def compress_body(self, body):
+        """
+        Compress the insert body with the configured codec.
+
+        Returns the body to send and the headers ClickHouse needs to decode it.
+        """
+        if not self.ch_compression:
+            return body, {}
+
+        return self.ch_compression.compress(body), {
+            "Content-Encoding": self.ch_compression.name
+        }
+
+    def send_item(self, serialized_item, many=False):
+        """
+        Create the insert query and body to send the serialized item(s) to ClickHouse.
+        """
         if many:
-            for node in serialized_item:
-                writer.writerow(node.values())
+            serialized_item = iter(serialized_item)
+            first_item = next(serialized_item, None)
+            if first_item is None:
+                return
+            serialized_item = itertools.chain([first_item], serialized_item)
         else:
-            writer.writerow(serialized_item.values())
+            first_item = serialized_item
 
-        request = requests.Request(
+        check_row_columns(
+            first_item,
+            self.ch_encoder.columns,
+            self.get_excluded_columns(),
+            f"{self.ch_database}.{self.clickhouse_table_name}",
+        )
+
+        data, headers = self.get_insert_body(serialized_item, many=many)
+        self.send_insert_body(first_item, data, headers)
+
+    def send_projected_values(self, values):
+        """
+        Send tuples of values in insert column order to ClickHouse.
+
+        The values are the ones yielded by iter_projected_values().
+        """
+        values = iter(values)
+        first_values = next(values, None)
+        if first_values is None:
+            return
+
+        data, headers = self.get_insert_body(
+            itertools.chain([first_values], values), many=True, projected=True
+        )
+        self.send_insert_body(
+            dict(zip(self.ch_encoder.columns, first_values)), data, headers
+        )
+
+    def send_insert_body(self, first_item, data, headers):
+        """
+        Post an encoded insert body, whose first row is first_item, to ClickHouse.
+
+        Inserts are submitted to the async transport when one is used. Inserts
+        that fail with a transient error are spooled when the spool is configured.
+        """
+        params = self.CLICKHOUSE_BULK_INSERT_PARAMS.copy()
+
+        # "query" is a special param for the query, it's the best way to get the FORMAT in there.
+        params["query"] = self.get_insert_query()
+
+        deduplication_token = self.get_deduplication_token(first_item)
+        if deduplication_token:
+            params["insert_deduplication_token"] = deduplication_token
+
+        if self.ch_transport:
+            # Encode in this thread, the event loop only sends the bytes
+            if ReplayableBody.is_streamed(data):
+                data = b"".join(data)
+            self.ch_transport.submit(
+                self,
+                self.get_insert_request(data, params, headers),
+                on_failure=functools.partial(self.spool_item, params, data, headers),
+            )
+            return
+
+        # Keep streamed bodies replayable here, so they can be spooled if sending fails
+        if ReplayableBody.is_streamed(data):
+            data = ReplayableBody(data, self.ch_insert_chunk_size)
+
+        try:
+            self._send_clickhouse_request(
+                self.get_insert_request(data, params, headers), is_insert=True
+            )
+        except requests.exceptions.RequestException as e:
+            if not self.ch_retry_policy.is_retryable(e):
+                # The table may have changed since it was described
+                self.invalidate_clickhouse_schema()
+            self.spool_item(params, data, headers, e)
+        finally:
+            if isinstance(data, ReplayableBody):
+                data.close()
+
+    def get_insert_request(self, data, params, headers):
+        """
+        Return the request posting an insert body to ClickHouse.
+        """
+        return requests.Request(
             "POST",
             self.ch_url,
-            data=output.getvalue().encode("utf-8"),
+            data=data,
             params=params,
+            headers=headers,
             auth=self.ch_auth,
         )
 
-        self._send_clickhouse_request(request)
+    def spool_item(self, params, data, headers, exception):
+        """
+        Write an insert that ClickHouse failed to accept to the local spool.
+
+        The original exception is raised again if the spool is not configured or
+        full, or if the failure is not transient.
+        """
+        if not self.ch_spool or not self.ch_retry_policy.is_retryable(exception):
+            raise exception
+
+        try:
+            self.ch_spool.append(
+                self.clickhouse_table_name,
+                params,
+                data,
+                content_encoding=headers.get("Content-Encoding"),
+            )
+        except SpoolFullError as e:
+            self.log.error(str(e))
+            raise exception from e
+
+        self.log.warning(
+            f"ClickHouse is unavailable ({exception}), {self.name} insert was "
+            "spooled to be sent later"
+        )
+
+    def get_deduplication_token(self, serialized_item):
+        """
+        Return the insert_deduplication_token for a batch starting with this item.
+
+        dump_id is unique per serialized batch, so the first row's dump_id identifies
+        the batch. Retrying the same insert reuses the token and ClickHouse skips it
+        if the first attempt was already written.
+        """
+        dump_id = serialized_item.get("dump_id")
+        if not dump_id:
+            return None
+        return f"{self.clickhouse_table_name}-{dump_id}"
 
     def fetch_target_items(
-        self, start_pk=None, ids=None, skip_ids=None, force_dump=False, batch_size=None
+        self,
+        start_pk=None,
+        ids=None,
+        skip_ids=None,
+        force_dump=False,
+        batch_size=None,
+        end_pk=None,
     ):
         """
         Fetch the items that should be dumped to ClickHouse
+
+        Items have a pk greater than start_pk and, if given, less or equal to end_pk.
+        """
+        queryset = self.get_target_queryset(start_pk, ids, skip_ids, end_pk)
+        lookups = list(self.projection.values()) if self.projection else None
+        for page in self.iter_keyset_pages(queryset, batch_size, lookups):
+            if force_dump:
+                if self.ch_ledger is not None:
+                    self.hash_for_ledger(page)
+                for item in page:
+                    yield item, True, "Force is set"
+            else:
+                results = self.should_dump_items(page)
+                to_dump = [
+                    item
+                    for item, (should_be_dumped, _reason) in zip(page, results)
+                    if should_be_dumped
+                ]
+                for nested_sink in self._nested_sinks:
+                    nested_sink.prefetch_related(to_dump)
+                for item, (should_be_dumped, reason) in zip(page, results):
+                    yield item, should_be_dumped, reason
+
+    def get_target_queryset(self, start_pk=None, ids=None, skip_ids=None, end_pk=None):
+        """
+        Return the queryset of the items selected for a dump, in no particular order.
         """
         queryset = self.get_queryset(start_pk)
+        if end_pk is not None:
+            queryset = queryset.filter(pk__lte=self.pk_format(end_pk))
+
         if ids:
             ids = [self.pk_format(id) for id in ids]
             queryset = queryset.filter(pk__in=ids)
@@ -297,17 +1083,37 @@ class ModelBaseSink(BaseSink):
         if skip_ids:
             skip_ids = [self.pk_format(id) for id in skip_ids]
             queryset = queryset.exclude(pk__in=skip_ids)
+        return queryset
 
-        paginator = Paginator(queryset, batch_size)
-        for i in range(1, paginator.num_pages + 1):
-            page = paginator.page(i)
-            items = page.object_list
-            for item in items:
-                if force_dump:
-                    yield item, True, "Force is set"
-                else:
-                    should_be_dumped, reason = self.should_dump_item(item)
-                    yield item, should_be_dumped, reason
+    def iter_keyset_pages(self, queryset, batch_size=None, lookups=None):
+        """
+        Yield lists of the items of the queryset in pk order, batch_size at a time.
+
+        Each page seeks past the last pk of the previous one (pk > last_pk ORDER BY pk
+        LIMIT batch_size) instead of using an OFFSET, so late pages of a large table
+        are as cheap to fetch as the first one and no COUNT(*) is needed. This works
+        for any orderable pk, including the string keys of course overviews.
+
+        With lookups, only those columns are read with values_list() and ProjectedRows
+        are yielded instead of model instances.
+        """
+        queryset = queryset.order_by("pk")
+        last_pk = None
+        while True:
+            page = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+            if lookups is not None:
+                page = page.values_list("pk", *lookups)
+            if batch_size:
+                page = page[:batch_size]
+
+            items = list(page)
+            if lookups is not None:
+                items = [ProjectedRow(item) for item in items]
+            if items:
+                yield items
+            if not batch_size or len(items) < batch_size:
+                return
+            last_pk = items[-1].pk
 
     def should_dump_item(self, item):  # pylint: disable=unused-argument
         """
@@ -315,6 +1121,163 @@ class ModelBaseSink(BaseSink):
         """
         return True, "No reason"
 
+    def should_dump_items(self, items):
+        """
+        Return a (should be dumped, reason) tuple for each of a page of items.
+
+        Sinks that need to look up ClickHouse to decide can override this to do it
+        once for the whole page instead of once per item. When a dump ledger is
+        configured, items whose row didn't change since they were last dumped are
+        skipped.
+        """
+        results = [self.should_dump_item(item) for item in items]
+        if self.ch_ledger is None:
+            return results
+        return self.check_ledger(items, results)
+
+    def get_ledger_key(self):
+        """
+        Return the key the sink's rows are recorded under in the dump ledger.
+
+        The key includes the ClickHouse URLs, so a dump to another cluster doesn't
+        skip the rows that were only sent to the previous one.
+        """
+        return f"{','.join(sorted(self.ch_urls))}/{self.ch_database}.{self.clickhouse_table_name}"
+
+    def get_row_hash(self, item):
+        """
+        Return the hash of the row the item is dumped as.
+
+        Model instances are serialized to be hashed, the row is kept so dumping the
+        item doesn't serialize it again.
+        """
+        if isinstance(item, ProjectedRow):
+            return hash_row(item)
+        row = self.serialize_item(item)
+        with self._ledger_lock:
+            self._ledger_rows[item.pk] = row
+        return hash_row(row)
+
+    def hash_for_ledger(self, items):
+        """
+        Hash the rows of items about to be dumped, to record them once they are sent.
+
+        The hashes are kept until record_dumped() or discard_ledger(). Forced dumps
+        hash their items too, so the next dump skips the rows they sent.
+        """
+        hashes = {item.pk: self.get_row_hash(item) for item in items}
+        with self._ledger_lock:
+            self._ledger_pending.update(hashes)
+        return hashes
+
+    def check_ledger(self, items, results):
+        """
+        Skip the items of a page whose row hash is the one last recorded in the ledger.
+        """
+        hashes = self.hash_for_ledger(
+            [
+                item
+                for item, (should_be_dumped, _reason) in zip(items, results)
+                if should_be_dumped
+            ]
+        )
+        last_hashes = self.ch_ledger.get_hashes(self.get_ledger_key(), hashes)
+
+        checked = []
+        for item, (should_be_dumped, reason) in zip(items, results):
+            if not should_be_dumped:
+                checked.append((should_be_dumped, reason))
+            elif last_hashes.get(str(item.pk)) == hashes[item.pk]:
+                self.discard_ledger([item])
+                checked.append((False, "Unchanged since last dump"))
+            else:
+                checked.append((True, reason))
+        return checked
+
+    def discard_ledger(self, items=None):
+        """
+        Forget the hashes and rows kept for items that won't be dumped.
+
+        Without items, forgets those of every item not dumped yet, like the ones left
+        when a dump stops early. Inserts already sent are still recorded.
+        """
+        with self._ledger_lock:
+            if items is None:
+                self._ledger_pending.clear()
+                self._ledger_rows.clear()
+                return
+            for item in items:
+                self._ledger_pending.pop(item.pk, None)
+                self._ledger_rows.pop(item.pk, None)
+
+    def record_dumped(self, items):
+        """
+        Record the rows of dumped items in the ledger.
+
+        Inserts sent through an AsyncTransport are only recorded by commit_ledger(),
+        once the transport has been flushed.
+        """
+        with self._ledger_lock:
+            if not self._ledger_pending:
+                return
+            for item in items:
+                if item.pk in self._ledger_pending:
+                    self._ledger_sent[item.pk] = self._ledger_pending.pop(item.pk)
+        if not self.ch_transport:
+            self.commit_ledger()
+
+    def commit_ledger(self):
+        """
+        Record the rows sent to ClickHouse since the last commit in the ledger.
+        """
+        with self._ledger_lock:
+            sent, self._ledger_sent = self._ledger_sent, {}
+        if self.ch_ledger is None or not sent:
+            return
+        self.ch_ledger.record(self.get_ledger_key(), sent)
+
+    def get_last_dumped_timestamps(self, item_ids):
+        """
+        Return the last timestamp dumped to ClickHouse for each of item_ids.
+
+        All the ids are looked up with a single GROUP BY query. Ids that have never
+        been dumped are left out of the returned dict.
+        """
+        if not item_ids:
+            return {}
+
+        keys = self.format_clickhouse_strings(item_ids)
+        params = {
+            "query": f"SELECT {self.unique_key}, max({self.timestamp_field}) "
+            f"FROM {self.ch_database}.{self.clickhouse_table_name} "
+            f"WHERE {self.unique_key} IN ({keys}) "
+            f"GROUP BY {self.unique_key} FORMAT TabSeparated"
+        }
+
+        request = requests.Request("GET", self.ch_url, params=params, auth=self.ch_auth)
+
+        response = self._send_clickhouse_request(request)
+        response.raise_for_status()
+
+        timestamps = {}
+        for line in response.text.splitlines():
+            if not line.strip():
+                continue
+            item_id, timestamp = line.rsplit("\t", 1)
+            # Same transformation as get_last_dumped_timestamp
+            timestamps[item_id] = str(datetime.datetime.fromisoformat(timestamp))
+        return timestamps
+
+    @staticmethod
+    def format_clickhouse_strings(values):
+        """
+        Return the values as a comma separated list of ClickHouse string literals.
+        """
+        return ", ".join(
+            "'" + str(value).replace("\\", "\\\\").replace("'", "\\'") + "'"
+            for value in values
+        )
+
     def get_last_dumped_timestamp(self, item_id):
         """
         Return the last timestamp that was dumped to ClickHouse
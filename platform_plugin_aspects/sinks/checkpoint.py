@@ -0,0 +1,188 @@
+"""
+Checkpoints of long-running bulk dumps, so that an interrupted dump can be resumed.
+
+A dump is identified by a run key, derived from the sink and the options selecting
+the objects to dump. Its primary keys are split into one or more ranges, one per
+worker process, and the progress of each range is saved to its own small file::
+
+    <checkpoint_dir>/<model>-<run key>-<range>.json
+
+so that workers never write the same file. Files are replaced atomically, and
+removed once every range of the run is done.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import time
+
+from platform_plugin_aspects.sinks.config import get_config
+
+# Checkpoint settings and their default values, read with get_config()
+CHECKPOINT_CONFIG_DEFAULTS = {
+    # Directory to save dump checkpoints to, None disables checkpoints
+    "checkpoint_dir": None,
+    # Minimum number of seconds between two checkpoints of the same range
+    "checkpoint_interval_secs": 60,
+}
+
+
+def get_checkpoint_config(*configs):
+    """
+    Return the checkpoint settings found in the given configuration dicts.
+    """
+    return get_config(CHECKPOINT_CONFIG_DEFAULTS, *configs)
+
+
+def get_checkpoint_store(*configs):
+    """
+    Return the CheckpointStore configured in the given configuration dicts, if any.
+    """
+    checkpoint_config = get_checkpoint_config(*configs)
+    if not checkpoint_config["checkpoint_dir"]:
+        return None
+    return CheckpointStore(**checkpoint_config)
+
+
+class RangeCheckpoint:
+    """
+    Progress of the dump of one primary key range, (start_pk, end_pk].
+    """
+
+    def __init__(
+        self,
+        path,
+        start_pk=None,
+        end_pk=None,
+        last_pk=None,
+        dumped=0,
+        done=False,
+        interval_secs=CHECKPOINT_CONFIG_DEFAULTS["checkpoint_interval_secs"],
+    ):
+        self.path = path
+        self.start_pk = start_pk
+        self.end_pk = end_pk
+        self.last_pk = last_pk
+        self.dumped = dumped
+        self.done = done
+        self.interval_secs = interval_secs
+        self._saved_at = time.monotonic()
+
+    @property
+    def resume_pk(self):
+        """
+        Return the primary key the dump of this range continues after.
+        """
+        return self.start_pk if self.last_pk is None else self.last_pk
+
+    def advance(self, last_pk, num_dumped):
+        """
+        Record that every object up to last_pk was handled, num_dumped of them dumped.
+
+        Nothing is written until save() is called.
+        """
+        self.last_pk = last_pk
+        self.dumped += num_dumped
+
+    def is_due(self):
+        """
+        Return True if the checkpoint was last saved more than interval_secs ago.
+        """
+        return time.monotonic() - self._saved_at >= self.interval_secs
+
+    def save(self):
+        """
+        Write the checkpoint, atomically replacing the previous one.
+        """
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "start_pk": self.start_pk,
+                    "end_pk": self.end_pk,
+                    "last_pk": self.last_pk,
+                    "dumped": self.dumped,
+                    "done": self.done,
+                },
+                f,
+            )
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._saved_at = time.monotonic()
+
+    def finish(self):
+        """
+        Save the range as completely dumped.
+        """
+        self.done = True
+        self.save()
+
+
+class CheckpointStore:
+    """
+    Directory of RangeCheckpoints, grouped by dump run.
+    """
+
+    def __init__(
+        self,
+        checkpoint_dir,
+        checkpoint_interval_secs=CHECKPOINT_CONFIG_DEFAULTS["checkpoint_interval_secs"],
+    ):
+        self.checkpoint_dir = checkpoint_dir
+        self.interval_secs = checkpoint_interval_secs
+
+    @staticmethod
+    def get_run_key(**selection):
+        """
+        Return a short stable key for the options selecting the objects to dump.
+        """
+        data = json.dumps(selection, sort_keys=True, default=str)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()[:16]
+
+    def _run_pattern(self, model, run_key):
+        return os.path.join(self.checkpoint_dir, f"{model}-{run_key}-*.json")
+
+    def load(self, model, run_key):
+        """
+        Return the RangeCheckpoints saved for the run, in range order.
+        """
+        checkpoints = []
+        for path in glob.glob(self._run_pattern(model, run_key)):
+            with open(path, encoding="utf-8") as f:
+                state = json.load(f)
+            index = int(path[: -len(".json")].rsplit("-", 1)[1])
+            checkpoints.append(
+                (
+                    index,
+                    RangeCheckpoint(path, interval_secs=self.interval_secs, **state),
+                )
+            )
+        return [checkpoint for _index, checkpoint in sorted(checkpoints)]
+
+    def start(self, model, run_key, pk_ranges):
+        """
+        Replace the checkpoints of the run with new ones for the given pk ranges.
+        """
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        self.clear(model, run_key)
+
+        checkpoints = []
+        for index, (start_pk, end_pk) in enumerate(pk_ranges):
+            checkpoint = RangeCheckpoint(
+                os.path.join(self.checkpoint_dir, f"{model}-{run_key}-{index}.json"),
+                start_pk,
+                end_pk,
+                interval_secs=self.interval_secs,
+            )
+            checkpoint.save()
+            checkpoints.append(checkpoint)
+        return checkpoints
+
+    def clear(self, model, run_key):
+        """
+        Remove the checkpoints of the run.
+        """
+        for path in glob.glob(self._run_pattern(model, run_key)):
+            os.remove(path)
@@ -0,0 +1,210 @@
+"""
+Circuit breaker for requests to an overloaded or unreachable ClickHouse.
+
+The breaker watches the outcome of the most recent requests. Transient failures and
+requests slower than a threshold count as errors; once the error rate of the window
+goes over the threshold the breaker opens and requests fail fast with
+CircuitOpenError instead of each waiting out the full timeout. After a cool-down a
+limited number of probe requests are let through (half-open): a successful probe
+closes the breaker, a failed one opens it again.
+
+State is tracked per process and shared by every sink using the same ClickHouse.
+The breaker is off by default, as long bulk inserts (e.g. during a resync) are
+normal and must not be mistaken for an unhealthy cluster.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+
+import requests
+from edx_django_utils.monitoring import set_custom_attribute
+
+from platform_plugin_aspects.sinks.config import get_config
+
+log = logging.getLogger(__name__)
+
+# Circuit breaker settings and their default values, read with get_config()
+BREAKER_CONFIG_DEFAULTS = {
+    # True enables the circuit breaker
+    "breaker_enabled": False,
+    # Share of failed or slow requests in the window that opens the breaker
+    "breaker_error_rate": 0.5,
+    # Requests slower than this many seconds count as failures, None to only
+    # count failed requests (including timeouts)
+    "breaker_slow_request_secs": None,
+    # Number of recent requests the error rate is computed over
+    "breaker_window_size": 20,
+    # Minimum number of requests in the window before the breaker can open
+    "breaker_min_requests": 10,
+    # Seconds the breaker stays open before probing ClickHouse again
+    "breaker_open_secs": 30,
+    # Number of concurrent probe requests allowed while half-open
+    "breaker_half_open_probes": 1,
+}
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """
+    Raised instead of sending a request while the circuit breaker is open.
+
+    It is a ConnectionError so callers treat it like ClickHouse being unreachable,
+    e.g. by spooling the insert.
+    """
+
+
+class CircuitBreaker:
+    """
+    Error rate and latency based circuit breaker with half-open probing.
+    """
+
+    def __init__(
+        self,
+        name,
+        breaker_error_rate=BREAKER_CONFIG_DEFAULTS["breaker_error_rate"],
+        breaker_slow_request_secs=BREAKER_CONFIG_DEFAULTS["breaker_slow_request_secs"],
+        breaker_window_size=BREAKER_CONFIG_DEFAULTS["breaker_window_size"],
+        breaker_min_requests=BREAKER_CONFIG_DEFAULTS["breaker_min_requests"],
+        breaker_open_secs=BREAKER_CONFIG_DEFAULTS["breaker_open_secs"],
+        breaker_half_open_probes=BREAKER_CONFIG_DEFAULTS["breaker_half_open_probes"],
+    ):
+        if breaker_half_open_probes < 1:
+            raise ValueError("The circuit breaker needs at least 1 half-open probe")
+        if breaker_window_size < 1 or breaker_min_requests < 1:
+            raise ValueError(
+                "The circuit breaker window and minimum requests must be at least 1"
+            )
+        if not 0 < breaker_error_rate <= 1:
+            raise ValueError("The circuit breaker error rate must be in (0, 1]")
+
+        self.name = name
+        self.error_rate = breaker_error_rate
+        self.slow_request_secs = breaker_slow_request_secs
+        self.min_requests = breaker_min_requests
+        self.open_secs = breaker_open_secs
+        self.half_open_probes = breaker_half_open_probes
+        self.state = CLOSED
+        self._window = deque(maxlen=breaker_window_size)
+        self._opened_at = None
+        self._probes = 0
+        self._last_probe_at = None
+        self._lock = threading.Lock()
+
+    def _set_state(self, state):
+        """
+        Move the breaker to a new state, logging and reporting the change.
+        """
+        if state == self.state:
+            return
+        log.warning(
+            f"ClickHouse circuit breaker for {self.name}: {self.state} -> {state}"
+        )
+        set_custom_attribute("clickhouse_circuit_breaker", state)
+        self.state = state
+
+    def before_request(self):
+        """
+        Raise CircuitOpenError if a request must not be sent right now.
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return
+
+            now = time.monotonic()
+            if self.state == OPEN:
+                if now - self._opened_at < self.open_secs:
+                    set_custom_attribute("clickhouse_circuit_breaker", OPEN)
+                    raise CircuitOpenError(
+                        f"ClickHouse circuit breaker for {self.name} is open, "
+                        f"retrying in {self.open_secs - (now - self._opened_at):.0f}s"
+                    )
+                self._set_state(HALF_OPEN)
+                self._probes = 0
+
+            # Probes that never reported back (e.g. the worker died) expire
+            if self._probes >= self.half_open_probes and (
+                now - self._last_probe_at < self.open_secs
+            ):
+                raise CircuitOpenError(
+                    f"ClickHouse circuit breaker for {self.name} is half-open, "
+                    "waiting for the probe request"
+                )
+            self._probes = min(self._probes + 1, self.half_open_probes)
+            self._last_probe_at = now
+
+    def record_success(self, latency):
+        """
+        Record a request ClickHouse answered, slow ones count as failures.
+        """
+        if self.slow_request_secs and latency >= self.slow_request_secs:
+            self.record_failure()
+            return
+
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._window.clear()
+                self._set_state(CLOSED)
+            self._window.append(False)
+
+    def record_failure(self):
+        """
+        Record a transient failure, opening the breaker if the error rate is too high.
+        """
+        with self._lock:
+            self._window.append(True)
+            if self.state == HALF_OPEN or (
+                len(self._window) >= self.min_requests
+                and sum(self._window) / len(self._window) >= self.error_rate
+            ):
+                self._opened_at = time.monotonic()
+                self._set_state(OPEN)
+
+
+def get_breaker_config(*configs):
+    """
+    Return the circuit breaker settings found in the given configuration dicts.
+    """
+    return get_config(BREAKER_CONFIG_DEFAULTS, *configs)
+
+
+def get_circuit_breaker(urls, breaker_config=None):
+    """
+    Return the process-wide CircuitBreaker for the given URLs, None if disabled.
+    """
+    breaker_config = get_breaker_config(breaker_config)
+    if not breaker_config["breaker_enabled"]:
+        return None
+
+    key = (tuple(urls), tuple(sorted(breaker_config.items())))
+
+    with _breakers_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                ", ".join(urls),
+                breaker_error_rate=breaker_config["breaker_error_rate"],
+                breaker_slow_request_secs=breaker_config["breaker_slow_request_secs"],
+                breaker_window_size=breaker_config["breaker_window_size"],
+                breaker_min_requests=breaker_config["breaker_min_requests"],
+                breaker_open_secs=breaker_config["breaker_open_secs"],
+                breaker_half_open_probes=breaker_config["breaker_half_open_probes"],
+            )
+            _breakers[key] = breaker
+
+    return breaker
+
+
+def reset_circuit_breakers():
+    """
+    Forget the state of every circuit breaker in this process.
+    """
+    with _breakers_lock:
+        _breakers.clear()
@@ -0,0 +1,195 @@
+"""
+Request body compression for ClickHouse inserts.
+
+ClickHouse decompresses HTTP request bodies according to the ``Content-Encoding``
+header, so large inserts can be sent compressed to cut bytes on the wire. ``gzip``
+is always available, ``zstd`` and ``lz4`` need the optional ``zstandard`` and
+``lz4`` packages to be installed.
+"""
+
+import io
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:  # pragma: no cover
+    lz4_frame = None
+
+
+class Codec:
+    """
+    A ClickHouse supported request body compression codec.
+    """
+
+    name = None
+    """
+    str: The value sent in the Content-Encoding header, also used in settings.
+    """
+
+    def is_available(self):
+        """
+        Return True if the libraries needed by this codec are installed.
+        """
+        return True
+
+    def compressobj(self):
+        """
+        Return a streaming compressor with compress(bytes) and flush() methods.
+        """
+        raise NotImplementedError
+
+    def compress(self, data):
+        """
+        Compress a whole body at once.
+        """
+        compressor = self.compressobj()
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data):
+        """
+        Decompress a whole body, used to merge compressed bodies together.
+
+        Bodies can hold several concatenated frames, like the ones compressed
+        separately and spooled together, which are all decompressed.
+        """
+        raise NotImplementedError
+
+    def compress_stream(self, chunks):
+        """
+        Compress an iterable of chunks, yielding compressed data as it is produced.
+        """
+        compressor = self.compressobj()
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+
+
+class GzipCodec(Codec):
+    """
+    gzip, from the standard library.
+    """
+
+    name = "gzip"
+    level = 6
+
+    def compressobj(self):
+        # wbits=31 writes a gzip header and trailer instead of a raw zlib stream
+        return zlib.compressobj(self.level, zlib.DEFLATED, 31)
+
+    def decompress(self, data):
+        chunks = []
+        while data:
+            decompressor = zlib.decompressobj(31)
+            chunks.append(decompressor.decompress(data))
+            data = decompressor.unused_data
+        return b"".join(chunks)
+
+
+class ZstdCodec(Codec):
+    """
+    Zstandard, requires the ``zstandard`` package.
+    """
+
+    name = "zstd"
+    level = 3
+
+    def is_available(self):
+        return zstandard is not None
+
+    def compressobj(self):
+        return zstandard.ZstdCompressor(level=self.level).compressobj()
+
+    def decompress(self, data):
+        reader = zstandard.ZstdDecompressor().stream_reader(
+            io.BytesIO(data), read_across_frames=True
+        )
+        return reader.read()
+
+
+class _LZ4FrameCompressor:
+    """
+    Give lz4.frame's compressor the same interface as zlib.compressobj.
+    """
+
+    def __init__(self):
+        self._compressor = lz4_frame.LZ4FrameCompressor()
+        self._started = False
+
+    def _begin(self):
+        if self._started:
+            return b""
+        self._started = True
+        return self._compressor.begin()
+
+    def compress(self, data):
+        header = self._begin()
+        return header + self._compressor.compress(data)
+
+    def flush(self):
+        header = self._begin()
+        return header + self._compressor.flush()
+
+
+class LZ4Codec(Codec):
+    """
+    LZ4 frame format, requires the ``lz4`` package.
+    """
+
+    name = "lz4"
+
+    def is_available(self):
+        return lz4_frame is not None
+
+    def compressobj(self):
+        return _LZ4FrameCompressor()
+
+    def decompress(self, data):
+        chunks = []
+        while data:
+            decompressor = lz4_frame.LZ4FrameDecompressor()
+            chunks.append(decompressor.decompress(data))
+            data = decompressor.unused_data
+        return b"".join(chunks)
+
+
+CODECS = {codec.name: codec for codec in (GzipCodec(), ZstdCodec(), LZ4Codec())}
+
+
+def get_codec(name):
+    """
+    Return the codec for the given name, or None if compression is disabled.
+
+    Raises ValueError for unknown codecs or codecs whose library is not installed,
+    so that misconfiguration fails loudly rather than silently sending plain text.
+    """
+    if not name:
+        return None
+
+    codec = CODECS.get(name)
+    if codec is None:
+        raise ValueError(
+            f"Unknown ClickHouse compression codec '{name}', "
+            f"valid options are: {', '.join(CODECS)}"
+        )
+
+    if not codec.is_available():
+        raise ValueError(
+            f"ClickHouse compression codec '{name}' is configured but its "
+            "library is not installed"
+        )
+
+    return codec
+
+
+def get_available_codecs():
+    """
+    Return the codecs that can be used in this environment.
+    """
+    return [codec for codec in CODECS.values() if codec.is_available()]
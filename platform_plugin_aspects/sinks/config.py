@@ -0,0 +1,24 @@
+"""
+Settings of the ClickHouse sinks.
+
+Each feature of the sinks defines the settings it reads, with their default values.
+They can be provided in EVENT_SINK_CLICKHOUSE_BACKEND_CONFIG or in the sink
+connection overrides.
+"""
+
+
+def get_config(defaults, *configs):
+    """
+    Return the settings of defaults found in the given configuration dicts.
+
+    Later dicts take precedence over earlier ones, missing keys use defaults. Keys
+    that are not in defaults are ignored.
+    """
+    settings = defaults.copy()
+    for config in configs:
+        if not config:
+            continue
+        for key in defaults:
+            if key in config:
+                settings[key] = config[key]
+    return settings
@@ -0,0 +1,130 @@
+"""
+Shared HTTP connection pool for ClickHouse sink traffic.
+
+Every sink in a process shares one ``requests.Session`` per pool configuration so
+that inserts reuse keep-alive connections instead of opening a new TCP / TLS
+connection for each request. Sessions are tied to the process that created them
+and are rebuilt after a fork (e.g. when Celery starts a prefork worker child).
+"""
+
+import os
+import socket
+import threading
+
+import requests
+from celery.signals import worker_process_init
+from requests.adapters import DEFAULT_POOLBLOCK, DEFAULT_POOLSIZE, HTTPAdapter
+from urllib3.connection import HTTPConnection
+
+from platform_plugin_aspects.sinks.config import get_config
+
+# Pool settings and their default values, read with get_config()
+POOL_CONFIG_DEFAULTS = {
+    # Number of distinct hosts to keep connection pools for
+    "pool_connections": DEFAULT_POOLSIZE,
+    # Maximum number of connections kept open per host
+    "pool_maxsize": DEFAULT_POOLSIZE,
+    # Block instead of opening throw-away connections when a host pool is exhausted
+    "pool_block": DEFAULT_POOLBLOCK,
+    # Enable TCP keep-alive probes on pooled sockets
+    "tcp_keepalive": True,
+}
+
+_sessions = {}
+_sessions_pid = None
+_sessions_lock = threading.Lock()
+
+
+class ClickHouseHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that can turn on TCP keep-alive for the pooled sockets.
+    """
+
+    def __init__(self, tcp_keepalive=True, **kwargs):
+        self.tcp_keepalive = tcp_keepalive
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.tcp_keepalive:
+            kwargs["socket_options"] = HTTPConnection.default_socket_options + [
+                (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+            ]
+        super().init_poolmanager(*args, **kwargs)
+
+
+def get_pool_config(*configs):
+    """
+    Return the pool settings found in the given configuration dicts.
+    """
+    return get_config(POOL_CONFIG_DEFAULTS, *configs)
+
+
+def _build_session(pool_config):
+    """
+    Create a session with ClickHouse adapters mounted for http and https.
+    """
+    session = requests.Session()
+    adapter = ClickHouseHTTPAdapter(
+        tcp_keepalive=pool_config["tcp_keepalive"],
+        pool_connections=pool_config["pool_connections"],
+        pool_maxsize=pool_config["pool_maxsize"],
+        pool_block=pool_config["pool_block"],
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_clickhouse_session(pool_config=None):
+    """
+    Return the process-wide session for the given pool configuration.
+
+    Sessions created in a parent process are never handed to a forked child, the
+    child builds its own pool the first time it needs one.
+    """
+    global _sessions_pid  # pylint: disable=global-statement
+
+    pool_config = get_pool_config(pool_config)
+    key = tuple(sorted(pool_config.items()))
+
+    with _sessions_lock:
+        if _sessions_pid != os.getpid():
+            # The sockets belong to the parent process, drop them without closing
+            _sessions.clear()
+            _sessions_pid = os.getpid()
+
+        session = _sessions.get(key)
+        if session is None:
+            session = _build_session(pool_config)
+            _sessions[key] = session
+
+    return session
+
+
+def reset_clickhouse_sessions():
+    """
+    Close and forget every pooled session in this process.
+    """
+    global _sessions_pid  # pylint: disable=global-statement
+
+    with _sessions_lock:
+        if _sessions_pid == os.getpid():
+            for session in _sessions.values():
+                session.close()
+        _sessions.clear()
+        _sessions_pid = None
+
+
+@worker_process_init.connect
+def _reset_sessions_after_fork(**kwargs):  # pylint: disable=unused-argument
+    """
+    Rebuild the pool in each Celery worker child after the fork.
+
+    The lock is replaced rather than acquired, since it may have been copied from
+    the parent while held by another thread.
+    """
+    global _sessions_pid, _sessions_lock  # pylint: disable=global-statement
+
+    _sessions_lock = threading.Lock()
+    _sessions.clear()
+    _sessions_pid = os.getpid()
@@ -15,6 +15,15 @@ class CourseEnrollmentSink(ModelBaseSink):  # pylint: disable=abstract-method
     timestamp_field = "time_last_dumped"
     name = "Course Enrollment"
     serializer_class = CourseEnrollmentSerializer
+    projection = {
+        "id": "id",
+        "course_key": "course_id",
+        "created": "created",
+        "is_active": "is_active",
+        "mode": "mode",
+        "username": "user__username",
+        "user_id": "user_id",
+    }
 
     def get_queryset(self, start_pk=None):
         return super().get_queryset(start_pk).select_related("user")
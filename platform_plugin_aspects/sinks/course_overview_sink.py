@@ -11,16 +11,20 @@ LTI passwords and other secrets. We just take the fields necessary for reporting
 """
 
 import datetime
+import itertools
 import json
 
+import requests
 from opaque_keys.edx.keys import CourseKey
 
 from platform_plugin_aspects.sinks.base_sink import ModelBaseSink
+from platform_plugin_aspects.sinks.course_structure import CourseStructureReader
 from platform_plugin_aspects.sinks.serializers import CourseOverviewSerializer
 from platform_plugin_aspects.utils import (
     get_detached_xblock_types,
     get_modulestore,
-    get_tags_for_block,
+    get_published_course_structure,
+    get_tags_for_blocks,
 )
 
 # Defaults we want to ensure we fail early on bulk inserts
@@ -31,6 +35,9 @@ CLICKHOUSE_BULK_INSERT_PARAMS = {
 
 MODULESTORE_PUBLISHED_ONLY_FLAG = "rev-opt-published-only"
 
+# Number of blocks whose tags are looked up together when serializing a course
+TAGS_LOOKUP_CHUNK_SIZE = 1000
+
 
 class XBlockSink(ModelBaseSink):
     """
@@ -43,93 +50,219 @@ class XBlockSink(ModelBaseSink):
     name = "XBlock"
     nested_sinks = []
 
-    def dump_related(self, serialized_item, dump_id, time_last_dumped):
-        """Dump all XBlocks for a course"""
-        self.dump(
-            serialized_item,
-            many=True,
-            initial={"dump_id": dump_id, "time_last_dumped": time_last_dumped},
-        )
+    def __init__(self, connection_overrides, log):
+        super().__init__(connection_overrides, log)
+        # Structure versions of the last dumped blocks of the courses about to be
+        # dumped, looked up by prefetch_related, None for courses never dumped
+        self._last_dumped_structure_versions = {}
+        # Published structures of the courses being dumped by dump_related, so they
+        # are only read once from the modulestore
+        self._published_structures = {}
 
-    def get_xblocks_recursive(self, parent_block, detached_xblock_types, initial):
+    def prefetch_related(self, items):
+        """
+        Look up the structure versions of the last dumped blocks of a page of courses.
         """
-        Serialize the course tree recursively, return a flattened list of XBlocks.
+        course_keys = [str(item.id) for item in items]
+        versions = self.get_last_dumped_structure_versions(course_keys)
+        for course_key in course_keys:
+            self._last_dumped_structure_versions[course_key] = versions.get(course_key)
 
-        Note that this list will not include detached blocks, those are handled
-        in get_detached_xblocks. This method preserves the course ordering for
-        non-detached blocks.
+    def dump_related(self, serialized_item, dump_id, time_last_dumped):
         """
-        items = [
-            self.serialize_xblock(
-                parent_block,
-                detached_xblock_types,
-                initial["dump_id"],
-                initial["time_last_dumped"],
-            )
-        ]
+        Dump all XBlocks for a course, unless its published structure was dumped.
+
+        Course overviews change for reasons that don't touch the course content,
+        like metadata edits. When the version of the published structure of the
+        course is known and is the one recorded with its last dumped blocks, the
+        blocks are not serialized again.
 
-        for child in parent_block.get_children():
-            items.extend(
-                self.get_xblocks_recursive(child, detached_xblock_types, initial)
+        Changes that don't create a new structure, like tag edits or changes to the
+        serialization of the blocks, are therefore only dumped by forced dumps.
+        """
+        course_key = CourseKey.from_string(serialized_item["course_key"])
+        structure = get_published_course_structure(get_modulestore(), course_key)
+        structure_version = None if structure is None else str(structure["_id"])
+        if (
+            structure_version is not None
+            and not self.force_dump
+            and structure_version == self.get_last_dumped_structure_version(course_key)
+        ):
+            self.log.info(
+                f"Skipping {self.name} of {course_key}, "
+                f"structure {structure_version} was already dumped"
+            )
+            return
+
+        if structure is not None:
+            self._published_structures[course_key] = structure
+        try:
+            self.dump(
+                serialized_item,
+                many=True,
+                initial={
+                    "dump_id": dump_id,
+                    "time_last_dumped": time_last_dumped,
+                    "structure_version": structure_version,
+                },
             )
+        finally:
+            self._published_structures.pop(course_key, None)
+
+    def get_last_dumped_structure_version(self, course_key):
+        """
+        Return the structure version recorded with the last dumped blocks of a course.
 
-        return items
+        Uses the version looked up by prefetch_related when there is one.
+        """
+        course_key = str(course_key)
+        if course_key in self._last_dumped_structure_versions:
+            return self._last_dumped_structure_versions.pop(course_key)
+        return self.get_last_dumped_structure_versions([course_key]).get(course_key)
 
-    def get_detached_xblocks(self, course_blocks, detached_xblock_types, initial):
+    def get_last_dumped_structure_versions(self, course_keys):
         """
-        Spin through the flat list of all blocks in a course and return only
-        the detached blocks. Ordering of non-detached blocks is already
-        guaranteed in get_xblocks_recursive. Order of detached blocks
-        is not guaranteed.
+        Return the structure version recorded with the last dumped blocks of courses.
+
+        All the courses are looked up with a single GROUP BY query. Courses never
+        dumped, or dumped without a structure version, are left out.
         """
-        return [
-            self.serialize_xblock(
-                block,
-                detached_xblock_types,
-                initial["dump_id"],
-                initial["time_last_dumped"],
+        if not course_keys:
+            return {}
+
+        params = {
+            "query": "SELECT course_key, argMax(JSONExtractString(xblock_data_json, "
+            "'structure_version'), time_last_dumped) "
+            f"FROM {self.ch_database}.{self.clickhouse_table_name} "
+            f"WHERE course_key IN ({self.format_clickhouse_strings(course_keys)}) "
+            "GROUP BY course_key FORMAT TabSeparated"
+        }
+
+        request = requests.Request("GET", self.ch_url, params=params, auth=self.ch_auth)
+
+        response = self._send_clickhouse_request(request)
+        response.raise_for_status()
+
+        versions = {}
+        for line in response.text.splitlines():
+            course_key, _, version = line.partition("\t")
+            # Blocks dumped without a structure version return an empty string
+            if version:
+                versions[course_key] = version
+        return versions
+
+    def get_course_xblocks(self, modulestore, course_key, detached_xblock_types):
+        """
+        Yield every published XBlock of the course, in course order.
+
+        The blocks of the course tree come first, in the order learners see them,
+        followed by the detached blocks, which are not part of the tree.
+
+        Blocks are read from the published split structure of the course when
+        available, without building their XBlocks. The structure dump_related already
+        read is reused. Otherwise the published structure
+        is loaded once by the modulestore: the tree is walked from the course block,
+        and only the detached block types are looked up among the other blocks.
+        """
+        structure = self._published_structures.get(course_key)
+        if structure is None:
+            structure = get_published_course_structure(modulestore, course_key)
+        if structure is not None:
+            yield from CourseStructureReader(
+                course_key, structure, detached_xblock_types
+            ).get_blocks()
+            return
+
+        with modulestore.bulk_operations(course_key):
+            course_block = modulestore.get_course(
+                course_key, depth=None, revision=MODULESTORE_PUBLISHED_ONLY_FLAG
             )
-            for block in course_blocks
-            if block.scope_ids.block_type in detached_xblock_types
-        ]
+
+            locations = set()
+            # Depth-first walk of the tree, in the order of each block's children
+            stack = [course_block]
+            while stack:
+                block = stack.pop()
+                if block.location in locations:
+                    continue
+                locations.add(block.location)
+                yield block
+                stack.extend(reversed(block.get_children()))
+
+            # get_items doesn't guarantee any ordering, so the order of detached
+            # blocks is not guaranteed either.
+            detached_blocks = modulestore.get_items(
+                course_key,
+                revision=MODULESTORE_PUBLISHED_ONLY_FLAG,
+                qualifiers={"category": {"$in": sorted(detached_xblock_types)}},
+            )
+            for block in detached_blocks:
+                if (
+                    block.scope_ids.block_type in detached_xblock_types
+                    and block.location not in locations
+                ):
+                    locations.add(block.location)
+                    yield block
 
     def serialize_item(self, item, many=False, initial=None):
         """
-        Serialize an XBlock into a dict
+        Serialize the XBlocks of a course into a list of dicts, in course order.
+        """
+        return list(self.iter_serialize_items(item, initial=initial))
+
+    def iter_serialize_items(self, items, initial=None):
         """
-        course_key = CourseKey.from_string(item["course_key"])
+        Serialize the XBlocks of a course into dicts, yielded in course order.
+
+        items is the serialized course overview of the course. Rows are generated
+        while the insert is streamed to ClickHouse, so only the rows of one chunk of
+        TAGS_LOOKUP_CHUNK_SIZE blocks are in memory at a time.
+        The structure version given in initial, if any, is recorded in the
+        xblock_data_json of every row.
+        """
+        course_key = CourseKey.from_string(items["course_key"])
         modulestore = get_modulestore()
         detached_xblock_types = get_detached_xblock_types()
+        structure_version = initial.get("structure_version")
 
-        location_to_node = {}
-
-        # This call gets the entire course tree in order, because the
-        # get_items call does not guarantee ordering. It does not return
-        # detached blocks, so we gather them separately below.
-        course_block = modulestore.get_course(
-            course_key, revision=MODULESTORE_PUBLISHED_ONLY_FLAG
+        rows = self.iter_numbered_rows(
+            self.serialize_xblock(
+                xblock,
+                detached_xblock_types,
+                initial["dump_id"],
+                initial["time_last_dumped"],
+            )
+            for xblock in self.get_course_xblocks(
+                modulestore, course_key, detached_xblock_types
+            )
         )
 
-        items = self.get_xblocks_recursive(course_block, detached_xblock_types, initial)
+        while True:
+            chunk = list(itertools.islice(rows, TAGS_LOOKUP_CHUNK_SIZE))
+            if not chunk:
+                return
 
-        # Here we fetch the detached blocks and add them to the list.
-        detached = self.get_detached_xblocks(
-            modulestore.get_items(course_key, revision=MODULESTORE_PUBLISHED_ONLY_FLAG),
-            detached_xblock_types,
-            initial,
-        )
+            # Fetch the tags of the whole chunk at once, not one block at a time
+            block_tags = get_tags_for_blocks([block["location"] for block in chunk])
 
-        items.extend(detached)
+            for block in chunk:
+                block["xblock_data_json"]["tags"] = block_tags.get(
+                    block["location"], []
+                )
+                if structure_version:
+                    block["xblock_data_json"]["structure_version"] = structure_version
+                block["xblock_data_json"] = json.dumps(block["xblock_data_json"])
+                yield block
 
-        # Add location and tag data to the dict mappings of the blocks
-        index = 0
+    def iter_numbered_rows(self, rows):
+        """
+        Add the order and the section/subsection/unit numbers of serialized blocks.
+        """
         section_idx = 0
         subsection_idx = 0
         unit_idx = 0
 
-        for block in items:
-            index += 1
-
+        for index, block in enumerate(rows, start=1):
             block["order"] = index
 
             # Ensure that detached types aren't part of the tree
@@ -152,14 +285,7 @@ class XBlockSink(ModelBaseSink):
                 block["xblock_data_json"]["subsection"] = subsection_idx
                 block["xblock_data_json"]["unit"] = unit_idx
 
-            block["xblock_data_json"]["tags"] = get_tags_for_block(
-                block["location"],
-            )
-
-            block["xblock_data_json"] = json.dumps(block["xblock_data_json"])
-            location_to_node[block["location"]] = block
-
-        return list(location_to_node.values())
+            yield block
 
     def serialize_xblock(self, item, detached_xblock_types, dump_id, time_last_dumped):
         """Serialize an XBlock instance into a dict"""
@@ -184,9 +310,6 @@ class XBlockSink(ModelBaseSink):
             "location": str(XBlockSink.strip_branch_and_version(item.location)),
             "display_name": item.display_name_with_default.replace("'", "'"),
             "xblock_data_json": json_data,
-            # We need to add this here so the key will be in the right place
-            # in the generated csv
-            "order": -1,
             "edited_on": str(getattr(item, "edited_on", "")),
             "dump_id": dump_id,
             "time_last_dumped": time_last_dumped,
@@ -229,9 +352,24 @@ class CourseOverviewSink(ModelBaseSink):  # pylint: disable=abstract-method
             - whether this course should be dumped (bool)
             - reason why course needs, or does not need, to be dumped (string)
         """
+        return self.should_dump_course(item, self.get_last_dumped_timestamp(item))
 
-        course_last_dump_time = self.get_last_dumped_timestamp(item)
+    def should_dump_items(self, items):
+        """
+        Decide which courses of a page to dump, with a single ClickHouse query.
+        """
+        last_dump_times = self.get_last_dumped_timestamps(
+            [str(item.id) for item in items]
+        )
+        return [
+            self.should_dump_course(item, last_dump_times.get(str(item.id)))
+            for item in items
+        ]
 
+    def should_dump_course(self, item, course_last_dump_time):
+        """
+        Compare the course's last publish date to the last time it was dumped.
+        """
         # If we don't have a record of the last time this command was run,
         # we should serialize the course and dump it
         if course_last_dump_time is None:
@@ -0,0 +1,130 @@
+"""
+Lightweight reader of published course structures.
+
+XBlockSink only needs a few fields of each block of a course: its location, type,
+display name, graded, completion mode, edit date and children. Reading them from the
+published split structure of the course, instead of from the XBlocks built by the
+modulestore, avoids constructing the XBlock runtime of every block.
+"""
+
+from types import SimpleNamespace
+
+from platform_plugin_aspects.utils import get_xblock_class
+
+# Fields read by XBlockSink that blocks inherit from their parent when they don't
+# set them, like the InheritanceMixin of the platform's modulestore does
+INHERITED_FIELDS = ("graded",)
+
+
+class StructureBlock:
+    """
+    The fields of a course block serialized by XBlockSink, read from its structure.
+
+    Has the same attributes as the XBlocks returned by the modulestore, as far as
+    XBlockSink.serialize_xblock is concerned.
+    """
+
+    def __init__(
+        self, location, display_name_with_default, graded, completion_mode, edited_on
+    ):
+        self.location = location
+        self.scope_ids = SimpleNamespace(
+            block_type=location.block_type, usage_id=location
+        )
+        self.display_name_with_default = display_name_with_default
+        self.graded = graded
+        self.completion_mode = completion_mode
+        self.edited_on = edited_on
+
+    def __repr__(self):
+        return f"StructureBlock({self.location}): {self.display_name_with_default}"
+
+
+def _get_field_value(block_class, fields, name, default):
+    """
+    Return the value of an XBlock field, or its default in the block class.
+    """
+    if name in fields:
+        return fields[name]
+    field = getattr(block_class, "fields", {}).get(name)
+    return default if field is None else field.default
+
+
+class CourseStructureReader:
+    """
+    Reads the blocks of a course from its published split structure.
+    """
+
+    def __init__(self, course_key, structure, detached_xblock_types):
+        self.course_key = course_key
+        self.blocks = structure["blocks"]
+        self.root = structure["root"]
+        self.detached_xblock_types = detached_xblock_types
+        self._block_classes = {}
+
+    def get_block_class(self, block_type):
+        """
+        Return the XBlock class of the block type, loaded once per type.
+        """
+        if block_type not in self._block_classes:
+            self._block_classes[block_type] = get_xblock_class(block_type)
+        return self._block_classes[block_type]
+
+    def make_block(self, block_key, block_data, inherited=None):
+        """
+        Return the StructureBlock of a block of the structure.
+
+        inherited holds the values of INHERITED_FIELDS the block's parent has, which
+        apply unless the block sets them itself.
+        """
+        block_class = self.get_block_class(block_key.type)
+        fields = {**(inherited or {}), **(block_data.fields or {})}
+
+        display_name = _get_field_value(block_class, fields, "display_name", None)
+        if display_name is None:
+            # Same fallback as display_name_with_default in the platform
+            display_name = block_key.id.replace("_", " ")
+
+        return StructureBlock(
+            location=self.course_key.make_usage_key(block_key.type, block_key.id),
+            display_name_with_default=display_name,
+            graded=_get_field_value(block_class, fields, "graded", False),
+            completion_mode=getattr(block_class, "completion_mode", ""),
+            edited_on=getattr(block_data.edit_info, "edited_on", ""),
+        )
+
+    def get_blocks(self):
+        """
+        Yield the blocks of the course tree in course order, then its detached blocks.
+
+        Blocks that are neither in the tree nor of a detached type, like orphans,
+        are left out, as they are when reading XBlocks from the modulestore. Blocks
+        of the tree inherit the INHERITED_FIELDS of their parent.
+        """
+        visited = set()
+
+        # Depth-first walk of the tree, in the order of each block's children
+        stack = [(self.root, {})]
+        while stack:
+            block_key, inherited = stack.pop()
+            block_data = self.blocks.get(block_key)
+            if block_data is None or block_key in visited:
+                continue
+            visited.add(block_key)
+            yield self.make_block(block_key, block_data, inherited)
+
+            fields = block_data.fields or {}
+            inherited = {
+                **inherited,
+                **{name: fields[name] for name in INHERITED_FIELDS if name in fields},
+            }
+            stack.extend(
+                (child, inherited) for child in reversed(fields.get("children", []))
+            )
+
+        for block_key, block_data in self.blocks.items():
+            if (
+                block_key.type in self.detached_xblock_types
+                and block_key not in visited
+            ):
+                yield self.make_block(block_key, block_data)
@@ -0,0 +1,441 @@
+"""
+Encoders that turn serialized sink rows into ClickHouse insert bodies.
+
+``CSVEncoder`` is the default and writes the values of each serialized dict in
+column order. ``RowBinaryEncoder`` writes ClickHouse's RowBinary format from a column /
+type schema, which is cheaper to produce than CSV and keeps types unambiguous
+(datetimes, booleans, UUIDs and NULLs are sent as typed values rather than text).
+"""
+
+import csv
+import datetime
+import io
+import json
+import operator
+import re
+import struct
+import uuid
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+EPOCH_DATE = datetime.date(1970, 1, 1)
+
+
+def get_row_getter(columns):
+    """
+    Return a function building the tuple of a row's values in column order.
+
+    Without columns, values are taken in the key order of the row.
+    """
+    if not columns:
+        return lambda row: tuple(row.values())
+    if len(columns) == 1:
+        return lambda row: (row[columns[0]],)
+    return operator.itemgetter(*columns)
+
+
+class CSVEncoder:
+    """
+    Encode rows as CSV, in the key order of the serialized dicts or in schema order.
+    """
+
+    format = "CSV"
+
+    def __init__(self, schema=None):
+        self.schema = schema
+
+    @property
+    def columns(self):
+        """
+        Return the column names sent in the INSERT statement, None for all of them.
+        """
+        return [name for name, _type in self.schema] if self.schema else None
+
+    def encode(self, rows):
+        """
+        Return the insert body for the given rows.
+        """
+        return b"".join(self.iter_encode(rows))
+
+    def iter_encode(self, rows):
+        """
+        Yield the encoded bytes of each row, so rows can be consumed lazily.
+        """
+        return self.iter_encode_values(map(get_row_getter(self.columns), rows))
+
+    def iter_encode_values(self, value_rows):
+        """
+        Yield the encoded bytes of each tuple of values, already in column order.
+        """
+        output = io.StringIO()
+        writer = csv.writer(output, quoting=csv.QUOTE_NONNUMERIC)
+
+        for values in value_rows:
+            writer.writerow(values)
+            yield output.getvalue().encode("utf-8")
+            output.seek(0)
+            output.truncate()
+
+
+def _write_varint(value, out):
+    """
+    Write an unsigned LEB128 integer, as used for RowBinary lengths.
+    """
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _to_datetime(value):
+    """
+    Return an aware datetime for a datetime or ISO 8601 string, naive values are UTC.
+    """
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    elif isinstance(value, datetime.date) and not isinstance(value, datetime.datetime):
+        value = datetime.datetime.combine(value, datetime.time())
+
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return value
+
+
+def _to_date(value):
+    """
+    Return a date for a date, datetime or ISO 8601 string.
+    """
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    if isinstance(value, datetime.datetime):
+        value = value.date()
+    return value
+
+
+def _to_string(value):
+    """
+    Return the text ClickHouse should store for a String column.
+    """
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return str(value)
+
+
+def _to_bool(value):
+    """
+    Return 1 or 0 for a boolean, also accepting the text forms CSV used to send.
+    """
+    if isinstance(value, str):
+        return 0 if value.strip().lower() in ("", "0", "false", "none") else 1
+    return 1 if value else 0
+
+
+_INTEGER_TYPES = {
+    "Int8": "<b",
+    "Int16": "<h",
+    "Int32": "<i",
+    "Int64": "<q",
+    "UInt8": "<B",
+    "UInt16": "<H",
+    "UInt32": "<I",
+    "UInt64": "<Q",
+}
+
+_FLOAT_TYPES = {
+    "Float32": "<f",
+    "Float64": "<d",
+}
+
+
+def _split_args(args):
+    """
+    Split type arguments on top level commas, e.g. "3, 'UTC'" -> ["3", "'UTC'"].
+    """
+    parts, depth, quoted, current = [], 0, False, ""
+    for char in args:
+        if char == "'":
+            quoted = not quoted
+        elif not quoted and char == "(":
+            depth += 1
+        elif not quoted and char == ")":
+            depth -= 1
+        elif not quoted and char == "," and depth == 0:
+            parts.append(current.strip())
+            current = ""
+            continue
+        current += char
+    parts.append(current.strip())
+    return parts
+
+
+def _struct_writer(fmt, convert):
+    """
+    Return a writer packing values converted by convert() with a struct format.
+    """
+    packer = struct.Struct(fmt)
+
+    def write(value, out):
+        out += packer.pack(convert(value))
+
+    return write
+
+
+def _string_writer(value, out):
+    """
+    Write a value as a length-prefixed UTF-8 string.
+    """
+    data = _to_string(value).encode("utf-8")
+    _write_varint(len(data), out)
+    out += data
+
+
+def _uuid_writer(value, out):
+    """
+    Write a UUID, or the text of one.
+    """
+    if not isinstance(value, uuid.UUID):
+        value = uuid.UUID(str(value))
+    # RowBinary stores UUIDs as two little-endian UInt64, high half first
+    raw = value.bytes
+    out += raw[7::-1] + raw[:7:-1]
+
+
+def _enum_values(args):
+    """
+    Return the {name: number} values of Enum type arguments, e.g. "'a' = 1, 'b' = 2".
+    """
+    values = {}
+    for part in _split_args(args):
+        match = re.fullmatch(r"'((?:[^'\\]|\\.)*)'\s*=\s*(-?\d+)", part)
+        if not match:
+            raise ValueError(f"Unable to parse enum value {part}")
+        values[match.group(1)] = int(match.group(2))
+    return values
+
+
+# Default values of the other types that aren't Nullable
+_TYPE_DEFAULTS = {
+    "Bool": 0,
+    "String": "",
+    "FixedString": "",
+    "UUID": uuid.UUID(int=0),
+    "Date": EPOCH_DATE,
+    "Date32": EPOCH_DATE,
+    "DateTime": EPOCH,
+    "DateTime64": EPOCH,
+    "Array": [],
+}
+
+
+def _parse_type(ch_type):
+    """
+    Split a ClickHouse type into its name and arguments, e.g. "Nullable(String)".
+    """
+    ch_type = ch_type.strip()
+    match = re.fullmatch(r"(\w+)\((.*)\)", ch_type, re.S)
+    return (match.group(1), match.group(2)) if match else (ch_type, None)
+
+
+def get_type_default(ch_type):
+    """
+    Return the value a None is written as in a column of the given ClickHouse type.
+
+    This is the default value of the type, which ClickHouse also stores for the
+    empty CSV fields None values used to be sent as. Nullable types keep None.
+    """
+    name, args = _parse_type(ch_type)
+    if name in _INTEGER_TYPES:
+        return 0
+    if name in _FLOAT_TYPES:
+        return 0.0
+    if name in _TYPE_DEFAULTS:
+        return _TYPE_DEFAULTS[name]
+    if name in ("Enum8", "Enum16"):
+        # The default of an Enum is its first value
+        return next(iter(_enum_values(args).values()))
+    if name == "LowCardinality":
+        return get_type_default(args)
+    return None
+
+
+def get_type_writer(ch_type):
+    """
+    Return a function writing a Python value of the given ClickHouse type.
+
+    The function takes the value and a bytearray to append the RowBinary encoding to.
+    None values of types that aren't Nullable are written as the type's default.
+    """
+    write = _get_value_writer(ch_type)
+    default = get_type_default(ch_type)
+    if default is None:
+        return write
+
+    def write_or_default(value, out):
+        write(default if value is None else value, out)
+
+    return write_or_default
+
+
+def _get_value_writer(ch_type):
+    """
+    Return a function writing a non-None Python value of the given ClickHouse type.
+    """
+    ch_type = ch_type.strip()
+    name, args = _parse_type(ch_type)
+
+    if name in _INTEGER_TYPES:
+        return _struct_writer(_INTEGER_TYPES[name], int)
+
+    if name in _FLOAT_TYPES:
+        return _struct_writer(_FLOAT_TYPES[name], float)
+
+    if name == "Bool":
+        return _struct_writer("<B", _to_bool)
+
+    if name == "String":
+        return _string_writer
+
+    if name == "FixedString":
+        size = int(args)
+
+        def write_fixed_string(value, out):
+            out += _to_string(value).encode("utf-8")[:size].ljust(size, b"\0")
+
+        return write_fixed_string
+
+    if name == "UUID":
+        return _uuid_writer
+
+    if name == "Date":
+        return _struct_writer("<H", lambda value: (_to_date(value) - EPOCH_DATE).days)
+
+    if name == "Date32":
+        return _struct_writer("<i", lambda value: (_to_date(value) - EPOCH_DATE).days)
+
+    if name == "DateTime":
+        return _struct_writer(
+            "<I", lambda value: int((_to_datetime(value) - EPOCH).total_seconds())
+        )
+
+    if name == "DateTime64":
+        precision = int(_split_args(args)[0])
+
+        def to_ticks(value):
+            delta = _to_datetime(value) - EPOCH
+            microseconds = (
+                delta.days * 86_400_000_000 + delta.seconds * 1_000_000
+            ) + delta.microseconds
+            if precision >= 6:
+                return microseconds * 10 ** (precision - 6)
+            return microseconds // 10 ** (6 - precision)
+
+        return _struct_writer("<q", to_ticks)
+
+    if name in ("Enum8", "Enum16"):
+        values = _enum_values(args)
+        packer = struct.Struct("<b" if name == "Enum8" else "<h")
+
+        def write_enum(value, out):
+            out += packer.pack(values[value] if isinstance(value, str) else value)
+
+        return write_enum
+
+    if name == "LowCardinality":
+        return get_type_writer(args)
+
+    if name == "Nullable":
+        inner = get_type_writer(args)
+
+        def write_nullable(value, out):
+            if value is None:
+                out.append(1)
+            else:
+                out.append(0)
+                inner(value, out)
+
+        return write_nullable
+
+    if name == "Array":
+        inner = get_type_writer(args)
+
+        def write_array(value, out):
+            if isinstance(value, str):
+                value = json.loads(value)
+            _write_varint(len(value), out)
+            for element in value:
+                inner(element, out)
+
+        return write_array
+
+    raise ValueError(f"Unsupported ClickHouse type for RowBinary: {ch_type}")
+
+
+class RowBinaryEncoder(CSVEncoder):
+    """
+    Encode rows as ClickHouse RowBinary using a list of (column, type) tuples.
+
+    Values are looked up by column name, so rows may contain extra keys and do not
+    need to be in table order.
+    """
+
+    format = "RowBinary"
+
+    def __init__(self, schema=None):
+        if not schema:
+            raise ValueError("The RowBinary format needs a column schema")
+        super().__init__(schema)
+        self._writers = [(name, get_type_writer(ch_type)) for name, ch_type in schema]
+
+    def iter_encode(self, rows):
+        for row in rows:
+            out = bytearray()
+            for name, write in self._writers:
+                try:
+                    value = row[name]
+                except KeyError as e:
+                    raise ValueError(
+                        f"Serialized row is missing the '{name}' column"
+                    ) from e
+                write(value, out)
+            yield bytes(out)
+
+    def iter_encode_values(self, value_rows):
+        writers = [write for _name, write in self._writers]
+        for values in value_rows:
+            out = bytearray()
+            for write, value in zip(writers, values):
+                write(value, out)
+            yield bytes(out)
+
+
+def iter_chunks(encoded_rows, chunk_size):
+    """
+    Group encoded rows into chunks of at least chunk_size bytes, except the last one.
+    """
+    chunk, size = [], 0
+    for data in encoded_rows:
+        chunk.append(data)
+        size += len(data)
+        if size >= chunk_size:
+            yield b"".join(chunk)
+            chunk, size = [], 0
+
+    if chunk:
+        yield b"".join(chunk)
+
+
+ENCODERS = {encoder.format: encoder for encoder in (CSVEncoder, RowBinaryEncoder)}
+
+
+def get_encoder(insert_format, schema=None):
+    """
+    Return an encoder instance for the given ClickHouse input format.
+    """
+    encoder_class = ENCODERS.get(insert_format)
+    if encoder_class is None:
+        raise ValueError(
+            f"Unsupported ClickHouse insert format '{insert_format}', "
+            f"valid options are: {', '.join(ENCODERS)}"
+        )
+    return encoder_class(schema)
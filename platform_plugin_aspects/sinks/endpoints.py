@@ -0,0 +1,147 @@
+"""
+Selection of ClickHouse endpoints when the sink is configured with several replicas.
+
+Endpoints that fail with a transient error are passively marked unhealthy and are
+skipped until a cool-down has passed. Health and latency are tracked per process
+and shared by every sink using the same set of endpoints.
+"""
+
+import itertools
+import threading
+import time
+
+from platform_plugin_aspects.sinks.config import get_config
+
+# Endpoint settings and their default values, read with get_config()
+ENDPOINT_CONFIG_DEFAULTS = {
+    # "round_robin" or "least_latency"
+    "load_balancing": "round_robin",
+    # Seconds an endpoint is skipped for after a failure
+    "endpoint_cooldown_secs": 30,
+}
+
+ROUND_ROBIN = "round_robin"
+LEAST_LATENCY = "least_latency"
+
+# Weight of the latest request in the moving average of an endpoint's latency
+LATENCY_SMOOTHING = 0.3
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class EndpointPool:
+    """
+    A set of equivalent ClickHouse URLs and their health.
+    """
+
+    def __init__(self, urls, load_balancing=ROUND_ROBIN, endpoint_cooldown_secs=30):
+        if load_balancing not in (ROUND_ROBIN, LEAST_LATENCY):
+            raise ValueError(
+                f"Unknown ClickHouse load balancing strategy '{load_balancing}', "
+                f"valid options are: {ROUND_ROBIN}, {LEAST_LATENCY}"
+            )
+
+        self.urls = list(urls)
+        self.load_balancing = load_balancing
+        self.cooldown_secs = endpoint_cooldown_secs
+        self._unhealthy_until = {}
+        self._latency = {}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def is_healthy(self, url, now=None):
+        """
+        Return True if the endpoint is not cooling down after a failure.
+        """
+        now = time.monotonic() if now is None else now
+        return self._unhealthy_until.get(url, 0) <= now
+
+    def select(self, exclude=()):
+        """
+        Return the URL to send the next request to.
+
+        Endpoints in exclude (already tried for this request) are skipped. If every
+        candidate is unhealthy the one that will recover first is returned, so
+        requests are never refused outright.
+        """
+        with self._lock:
+            now = time.monotonic()
+            candidates = [url for url in self.urls if url not in exclude] or self.urls
+            healthy = [url for url in candidates if self.is_healthy(url, now)]
+
+            if not healthy:
+                return min(candidates, key=lambda url: self._unhealthy_until[url])
+
+            if self.load_balancing == LEAST_LATENCY:
+                # Endpoints without a measurement yet sort first so they get one
+                return min(healthy, key=lambda url: self._latency.get(url, 0))
+
+            return healthy[next(self._counter) % len(healthy)]
+
+    def has_healthy(self, exclude=()):
+        """
+        Return True if a healthy endpoint is left outside of exclude.
+        """
+        now = time.monotonic()
+        return any(self.is_healthy(url, now) for url in self.urls if url not in exclude)
+
+    def mark_success(self, url, latency):
+        """
+        Record a successful request and its latency in seconds.
+        """
+        with self._lock:
+            self._unhealthy_until.pop(url, None)
+            previous = self._latency.get(url)
+            self._latency[url] = (
+                latency
+                if previous is None
+                else previous + LATENCY_SMOOTHING * (latency - previous)
+            )
+
+    def mark_failure(self, url):
+        """
+        Take the endpoint out of rotation for the cool-down period.
+        """
+        with self._lock:
+            self._unhealthy_until[url] = time.monotonic() + self.cooldown_secs
+
+
+def get_endpoint_urls(url):
+    """
+    Return the configured "url" setting as a list of URLs.
+    """
+    if isinstance(url, str):
+        return [url]
+    return list(url)
+
+
+def get_endpoint_config(*configs):
+    """
+    Return the endpoint settings found in the given configuration dicts.
+    """
+    return get_config(ENDPOINT_CONFIG_DEFAULTS, *configs)
+
+
+def get_endpoint_pool(urls, endpoint_config=None):
+    """
+    Return the process-wide EndpointPool for the given URLs and settings.
+    """
+    endpoint_config = get_endpoint_config(endpoint_config)
+    key = (tuple(urls), tuple(sorted(endpoint_config.items())))
+
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = EndpointPool(urls, **endpoint_config)
+            _pools[key] = pool
+
+    return pool
+
+
+def reset_endpoint_pools():
+    """
+    Forget the health of every endpoint in this process.
+    """
+    with _pools_lock:
+        _pools.clear()
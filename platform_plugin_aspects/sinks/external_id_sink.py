@@ -15,6 +15,12 @@ class ExternalIdSink(ModelBaseSink):  # pylint: disable=abstract-method
     timestamp_field = "time_last_dumped"
     name = "External ID"
     serializer_class = UserExternalIDSerializer
+    projection = {
+        "external_user_id": "external_user_id",
+        "external_id_type": "external_id_type__name",
+        "username": "user__username",
+        "user_id": "user_id",
+    }
 
     def get_queryset(self, start_pk=None):
         return super().get_queryset(start_pk).select_related("user", "external_id_type")
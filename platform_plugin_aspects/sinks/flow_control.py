@@ -0,0 +1,172 @@
+"""
+Adaptive flow control of bulk dumps.
+
+A FlowController adjusts the batch size of a dump and the pause between its batches
+to how well ClickHouse keeps up. While inserts are fast, batches grow and pauses
+shrink. When insert latency rises above its target, transient errors (5xx, 429,
+timeouts) are seen, or the table has too many active parts for its merges to keep
+up, batches shrink and pauses grow again.
+"""
+
+import threading
+import time
+
+from platform_plugin_aspects.sinks.config import get_config
+
+# Flow control settings and their default values, read with get_config()
+FLOW_CONTROL_CONFIG_DEFAULTS = {
+    # Insert latency above which dumps back off, they speed up below half of it
+    "flow_target_latency_secs": 5,
+    # Bounds of the adapted batch size
+    "flow_min_batch_size": 100,
+    "flow_max_batch_size": 100000,
+    # Longest pause between two batches
+    "flow_max_sleep_secs": 60,
+    # Active parts in a partition of the table above which dumps back off
+    "flow_max_active_parts": 300,
+    # Minimum number of seconds between two reads of the active part count
+    "flow_parts_check_interval_secs": 30,
+}
+
+# Factors batches grow and shrink by
+GROWTH_FACTOR = 1.5
+BACKOFF_FACTOR = 0.5
+
+# Pause backing off starts from when there was none, in seconds
+MIN_BACKOFF_SLEEP_SECS = 1
+
+
+def get_flow_control_config(*configs):
+    """
+    Return the flow control settings found in the given configuration dicts.
+    """
+    return get_config(FLOW_CONTROL_CONFIG_DEFAULTS, *configs)
+
+
+class FlowController:
+    """
+    Batch size and pause between batches of a dump, adapted to ClickHouse's health.
+
+    Sinks report the latency of each request and their transient failures, which may
+    happen in the event loop thread of an AsyncTransport. The dump calls update()
+    after each batch to adapt batch_size and sleep_time.
+    """
+
+    def __init__(
+        self,
+        batch_size,
+        sleep_time,
+        get_active_parts=None,
+        flow_target_latency_secs=FLOW_CONTROL_CONFIG_DEFAULTS[
+            "flow_target_latency_secs"
+        ],
+        flow_min_batch_size=FLOW_CONTROL_CONFIG_DEFAULTS["flow_min_batch_size"],
+        flow_max_batch_size=FLOW_CONTROL_CONFIG_DEFAULTS["flow_max_batch_size"],
+        flow_max_sleep_secs=FLOW_CONTROL_CONFIG_DEFAULTS["flow_max_sleep_secs"],
+        flow_max_active_parts=FLOW_CONTROL_CONFIG_DEFAULTS["flow_max_active_parts"],
+        flow_parts_check_interval_secs=FLOW_CONTROL_CONFIG_DEFAULTS[
+            "flow_parts_check_interval_secs"
+        ],
+    ):
+        self.min_batch_size = min(flow_min_batch_size, batch_size)
+        self.max_batch_size = max(flow_max_batch_size, batch_size)
+        self.batch_size = batch_size
+        self.sleep_time = sleep_time
+        self.get_active_parts = get_active_parts
+        self.target_latency_secs = flow_target_latency_secs
+        self.max_sleep_secs = max(flow_max_sleep_secs, sleep_time)
+        self.max_active_parts = flow_max_active_parts
+        self.parts_check_interval_secs = flow_parts_check_interval_secs
+
+        self._lock = threading.Lock()
+        self._max_latency = None
+        self._failures = 0
+        self._active_parts = None
+        self._parts_checked_at = None
+
+    def record_latency(self, latency):
+        """
+        Record the latency of a request ClickHouse accepted.
+        """
+        with self._lock:
+            self._max_latency = max(self._max_latency or 0, latency)
+
+    def record_failure(self):
+        """
+        Record a transient failure of a request, like a 5xx or 429 response.
+        """
+        with self._lock:
+            self._failures += 1
+
+    def read_active_parts(self):
+        """
+        Return the active part count of the table, read at most once per interval.
+        """
+        if self.get_active_parts is None:
+            return None
+        now = time.monotonic()
+        if (
+            self._parts_checked_at is None
+            or now - self._parts_checked_at >= self.parts_check_interval_secs
+        ):
+            self._active_parts = self.get_active_parts()
+            self._parts_checked_at = now
+        return self._active_parts
+
+    def update(self):
+        """
+        Adapt the batch size and pause to the requests since the last update.
+
+        Returns a description of the change, or None if nothing changed.
+        """
+        with self._lock:
+            max_latency, self._max_latency = self._max_latency, None
+            failures, self._failures = self._failures, 0
+
+        if failures:
+            return self.back_off(f"{failures} failed requests", shrink=True)
+        if max_latency is not None and max_latency > self.target_latency_secs:
+            return self.back_off(f"insert latency {max_latency:.2f}s", shrink=True)
+
+        active_parts = self.read_active_parts()
+        if active_parts is not None and active_parts > self.max_active_parts:
+            # Smaller batches would only create more parts, just slow down
+            return self.back_off(f"{active_parts} active parts", shrink=False)
+
+        if max_latency is not None and max_latency < self.target_latency_secs / 2:
+            return self.speed_up(f"insert latency {max_latency:.2f}s")
+        return None
+
+    def back_off(self, reason, shrink):
+        """
+        Lengthen the pause between batches and, if shrink is True, halve batches.
+        """
+        batch_size, sleep_time = self.batch_size, self.sleep_time
+        if shrink:
+            self.batch_size = max(
+                self.min_batch_size, int(self.batch_size * BACKOFF_FACTOR)
+            )
+        self.sleep_time = min(
+            self.max_sleep_secs, max(MIN_BACKOFF_SLEEP_SECS, self.sleep_time * 2)
+        )
+        return self._describe_change(reason, batch_size, sleep_time)
+
+    def speed_up(self, reason):
+        """
+        Grow batches and halve the pause between them.
+        """
+        batch_size, sleep_time = self.batch_size, self.sleep_time
+        self.batch_size = min(
+            self.max_batch_size,
+            max(self.batch_size + 1, int(self.batch_size * GROWTH_FACTOR)),
+        )
+        self.sleep_time = self.sleep_time / 2 if self.sleep_time >= 0.1 else 0
+        return self._describe_change(reason, batch_size, sleep_time)
+
+    def _describe_change(self, reason, batch_size, sleep_time):
+        if (batch_size, sleep_time) == (self.batch_size, self.sleep_time):
+            return None
+        return (
+            f"{reason}: batch size {batch_size} -> {self.batch_size}, "
+            f"sleep time {sleep_time:g}s -> {self.sleep_time:g}s"
+        )
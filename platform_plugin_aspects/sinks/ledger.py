@@ -0,0 +1,139 @@
+"""
+Local ledger of the rows bulk dumps last sent to ClickHouse.
+
+For every object dumped by ``dump_data_to_clickhouse``, the ledger records a hash of
+its serialized row and when it was dumped, keyed by ClickHouse cluster and table,
+and primary key. Later
+dumps skip objects whose row hash didn't change, so incremental syncs only send the
+objects that changed since the previous run.
+
+The ledger is a SQLite database file, shared by the worker processes of a dump.
+Columns filled at dump time, like ``dump_id`` and ``time_last_dumped``, are left out
+of the hashes.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from platform_plugin_aspects.sinks.config import get_config
+
+# Ledger settings and their default values, read with get_config()
+LEDGER_CONFIG_DEFAULTS = {
+    # SQLite file recording the rows dumped by bulk dumps, None disables the ledger
+    "ledger_path": None,
+}
+
+# Serialized fields that change on every dump, and so are not hashed
+VOLATILE_FIELDS = {"dump_id", "time_last_dumped"}
+
+# Maximum number of primary keys per SELECT, below SQLite's variable limit
+_LOOKUP_CHUNK_SIZE = 500
+
+
+def get_ledger_config(*configs):
+    """
+    Return the ledger settings found in the given configuration dicts.
+    """
+    return get_config(LEDGER_CONFIG_DEFAULTS, *configs)
+
+
+def get_dump_ledger(*configs):
+    """
+    Return the DumpLedger configured in the given configuration dicts, if any.
+    """
+    ledger_config = get_ledger_config(*configs)
+    if not ledger_config["ledger_path"]:
+        return None
+    return DumpLedger(**ledger_config)
+
+
+def hash_row(row):
+    """
+    Return a stable hash of a serialized row, a dict or a tuple of values.
+    """
+    if isinstance(row, dict):
+        row = {key: value for key, value in row.items() if key not in VOLATILE_FIELDS}
+        data = json.dumps(row, sort_keys=True, default=str)
+    else:
+        data = json.dumps(list(row), default=str)
+    return hashlib.blake2b(data.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class DumpLedger:
+    """
+    Row hashes of the objects last dumped to each table, by primary key.
+    """
+
+    def __init__(self, ledger_path):
+        self.ledger_path = ledger_path
+        self._connection = None
+        self._pid = None
+        # Bulk dumps read the ledger from their prefetch thread
+        self._lock = threading.Lock()
+
+    @property
+    def connection(self):
+        """
+        Return this process' connection to the ledger, creating the file if needed.
+        """
+        # SQLite connections can't be shared with forked worker processes
+        if self._connection is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.ledger_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(
+                self.ledger_path, timeout=30, check_same_thread=False
+            )
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS dumped_rows ("
+                "tbl TEXT NOT NULL, pk TEXT NOT NULL, row_hash TEXT NOT NULL, "
+                "dumped_at REAL NOT NULL, PRIMARY KEY (tbl, pk))"
+            )
+            self._pid = os.getpid()
+        return self._connection
+
+    def get_hashes(self, table, pks):
+        """
+        Return the row hash last dumped for each of the primary keys, if any.
+        """
+        pks = [str(pk) for pk in pks]
+        hashes = {}
+        with self._lock:
+            for start in range(0, len(pks), _LOOKUP_CHUNK_SIZE):
+                end = start + _LOOKUP_CHUNK_SIZE
+                chunk = pks[start:end]
+                placeholders = ", ".join("?" * len(chunk))
+                hashes.update(
+                    self.connection.execute(
+                        "SELECT pk, row_hash FROM dumped_rows "
+                        f"WHERE tbl = ? AND pk IN ({placeholders})",
+                        [table, *chunk],
+                    )
+                )
+        return hashes
+
+    def record(self, table, hashes):
+        """
+        Record that the rows with the given {primary key: row hash} were dumped.
+        """
+        if not hashes:
+            return
+        now = time.time()
+        with self._lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO dumped_rows (tbl, pk, row_hash, dumped_at) "
+                "VALUES (?, ?, ?, ?)",
+                [(table, str(pk), row_hash, now) for pk, row_hash in hashes.items()],
+            )
+
+    def clear(self, table):
+        """
+        Forget every row dumped to the table, so the next dump sends all of them.
+        """
+        with self._lock, self.connection:
+            self.connection.execute("DELETE FROM dumped_rows WHERE tbl = ?", [table])
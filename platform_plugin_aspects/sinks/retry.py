@@ -0,0 +1,122 @@
+"""
+Retrying of transient ClickHouse request failures.
+
+Insert bodies are encoded once. Streamed bodies are teed into a spooled temporary
+file as they are sent, so a retry resends the already encoded bytes instead of
+serializing the rows again, while memory stays bounded.
+"""
+
+import random
+import tempfile
+from collections.abc import Iterator
+
+import requests
+
+from platform_plugin_aspects.sinks.config import get_config
+
+# Retry settings and their default values, read with get_config()
+RETRY_CONFIG_DEFAULTS = {
+    # Number of times a failed request is retried, 0 disables retries
+    "max_retries": 3,
+    # Base delay of the exponential backoff, in seconds
+    "retry_backoff_secs": 0.5,
+    # Maximum delay between two attempts, in seconds
+    "retry_backoff_max_secs": 10,
+}
+
+# HTTP statuses ClickHouse (or a proxy in front of it) returns for transient errors
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter.
+    """
+
+    def __init__(self, max_retries, retry_backoff_secs, retry_backoff_max_secs):
+        self.max_retries = max_retries
+        self.backoff_secs = retry_backoff_secs
+        self.backoff_max_secs = retry_backoff_max_secs
+
+    @classmethod
+    def from_config(cls, *configs):
+        """
+        Build a policy from the retry settings found in the given configuration dicts.
+        """
+        return cls(**get_config(RETRY_CONFIG_DEFAULTS, *configs))
+
+    def get_delay(self, attempt):
+        """
+        Return the number of seconds to wait before retrying after the given attempt.
+        """
+        return random.uniform(
+            0, min(self.backoff_max_secs, self.backoff_secs * 2**attempt)
+        )
+
+    def should_retry(self, attempt, exception):
+        """
+        Return True if the request should be tried again after this exception.
+        """
+        return attempt < self.max_retries and self.is_retryable(exception)
+
+    @staticmethod
+    def is_retryable(exception):
+        """
+        Return True if the exception is a transient failure of the ClickHouse server.
+        """
+        if isinstance(exception, requests.exceptions.HTTPError):
+            return exception.response.status_code in RETRYABLE_STATUS_CODES
+
+        return isinstance(
+            exception,
+            (requests.exceptions.ConnectionError, requests.exceptions.Timeout),
+        )
+
+
+class ReplayableBody:
+    """
+    Wrap a generator request body so it can be iterated more than once.
+
+    Chunks are written to a spooled temporary file before they are handed to
+    requests, which keeps them in memory up to max_memory bytes and on disk after
+    that. Iterating again first replays the saved chunks, then carries on with the
+    rest of the generator if the previous attempt did not consume all of it.
+    """
+
+    read_size = 1024 * 1024
+
+    def __init__(self, chunks, max_memory):
+        self._chunks = chunks
+        self._spool = (
+            tempfile.SpooledTemporaryFile(  # pylint: disable=consider-using-with
+                max_size=max_memory
+            )
+        )
+        self._size = 0
+
+    @staticmethod
+    def is_streamed(data):
+        """
+        Return True if the request body is a one-shot iterator.
+        """
+        return isinstance(data, Iterator)
+
+    def __iter__(self):
+        self._spool.seek(0)
+        remaining = self._size
+        while remaining:
+            data = self._spool.read(min(self.read_size, remaining))
+            remaining -= len(data)
+            yield data
+
+        for chunk in self._chunks:
+            self._spool.seek(self._size)
+            self._spool.write(chunk)
+            self._size += len(chunk)
+            yield chunk
+
+    def close(self):
+        """
+        Release the spooled data.
+        """
+        self._spool.close()
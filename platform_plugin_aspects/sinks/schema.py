@@ -0,0 +1,110 @@
+"""
+Column schemas of the ClickHouse tables sinks insert into.
+
+Sinks insert with an explicit column list built from ``DESCRIBE TABLE``, so rows are
+encoded by column name rather than relying on the key order of serialized dicts.
+Schemas are cached per process for a while to avoid describing the table for every
+insert.
+"""
+
+import json
+import threading
+import time
+
+from platform_plugin_aspects.sinks.config import get_config
+
+# Schema settings and their default values, read with get_config()
+SCHEMA_CONFIG_DEFAULTS = {
+    # Seconds a described table schema is reused for
+    "schema_cache_secs": 300,
+}
+
+# Columns computed by ClickHouse, which can't be inserted into
+NON_INSERTABLE_DEFAULT_TYPES = {"MATERIALIZED", "ALIAS"}
+
+_schemas = {}
+_schemas_lock = threading.Lock()
+
+
+class SchemaMismatchError(ValueError):
+    """
+    Raised when serialized rows don't match the columns of the ClickHouse table.
+    """
+
+
+def get_schema_config(*configs):
+    """
+    Return the schema settings found in the given configuration dicts.
+    """
+    return get_config(SCHEMA_CONFIG_DEFAULTS, *configs)
+
+
+def parse_describe_table(text):
+    """
+    Return (column name, ClickHouse type) tuples from DESCRIBE TABLE ... FORMAT JSONEachRow.
+
+    Columns that can't be inserted into are left out.
+    """
+    schema = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        column = json.loads(line)
+        if column.get("default_type") in NON_INSERTABLE_DEFAULT_TYPES:
+            continue
+        schema.append((column["name"], column["type"]))
+    return schema
+
+
+def get_cached_schema(key, describe, cache_secs):
+    """
+    Return the schema cached for key, calling describe() to fetch it when needed.
+    """
+    now = time.monotonic()
+    with _schemas_lock:
+        cached = _schemas.get(key)
+    if cached and now - cached[0] < cache_secs:
+        return cached[1]
+
+    schema = describe()
+    with _schemas_lock:
+        _schemas[key] = (now, schema)
+    return schema
+
+
+def invalidate_schema(key):
+    """
+    Forget the schema cached for key, so the table is described again.
+    """
+    with _schemas_lock:
+        _schemas.pop(key, None)
+
+
+def reset_schemas():
+    """
+    Forget every schema cached in this process.
+    """
+    with _schemas_lock:
+        _schemas.clear()
+
+
+def check_row_columns(row, columns, excluded_columns, table):
+    """
+    Raise SchemaMismatchError if the row's keys don't match the insert columns.
+
+    Keys of excluded columns are allowed in the row, they are just not sent.
+    """
+    keys = set(row)
+    missing = [name for name in columns if name not in keys]
+    unexpected = sorted(keys - set(columns) - set(excluded_columns))
+    if not missing and not unexpected:
+        return
+
+    problems = []
+    if missing:
+        problems.append(f"missing columns {', '.join(missing)}")
+    if unexpected:
+        problems.append(f"columns not in the table {', '.join(unexpected)}")
+    raise SchemaMismatchError(
+        f"Serialized rows don't match ClickHouse table {table}: {'; '.join(problems)}"
+    )
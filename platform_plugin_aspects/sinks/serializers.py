@@ -35,6 +35,28 @@ class DateTimeJSONEncoder(json.JSONEncoder):
         return super().default(obj)
 
 
+# Fields formatting values the way ModelSerializer fields of the same type do
+_DATETIME_FIELD = serializers.DateTimeField()
+_DATE_FIELD = serializers.DateField()
+
+
+def format_projected_value(value):
+    """
+    Format a value read with values_list() like the serializer field for it would.
+
+    Bulk dumps of a sink projection skip the serializer, this keeps their rows the
+    same as serialized ones: datetimes and dates become ISO strings, and UUIDs, keys
+    and other objects their string representation.
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, datetime):
+        return _DATETIME_FIELD.to_representation(value)
+    if isinstance(value, date):
+        return _DATE_FIELD.to_representation(value)
+    return str(value)
+
+
 class BaseSinkSerializer(serializers.Serializer):  # pylint: disable=abstract-method
     """Base sink serializer for ClickHouse."""
 
@@ -0,0 +1,425 @@
+"""
+Durable local spool for ClickHouse inserts that could not be sent.
+
+When ClickHouse is down or too slow, already encoded insert bodies are appended to
+segment files in a per-table directory instead of failing the task. A drainer later
+replays them, merging many small inserts into large batches.
+
+Layout of the spool directory::
+
+    <spool_dir>/<table>/<pid>.open          segment being appended to
+    <spool_dir>/<table>/<pid>-<ns>.seg      closed segment, ready to drain
+    <spool_dir>/<table>/<pid>-<ns>.draining segment claimed by a drainer
+    <spool_dir>/<table>/<pid>-<ns>.dead     records ClickHouse rejected for good
+
+Each process appends to its own ``.open`` segment under an exclusive file lock and
+rotates it to ``.seg`` once it is too large or too old. Drainers claim segments by
+renaming them, which is atomic, so several workers can write and drain the same
+spool safely. Records that ClickHouse rejects with a non-retryable error are moved
+to dead letter segments, which are kept for inspection but never drained.
+
+Every record in a segment is framed as::
+
+    4 bytes header length | JSON header | 8 bytes body length | body
+"""
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import struct
+import time
+
+import requests
+from edx_django_utils.monitoring import set_custom_attribute
+
+from platform_plugin_aspects.sinks.compression import get_codec
+from platform_plugin_aspects.sinks.config import get_config
+from platform_plugin_aspects.sinks.retry import RetryPolicy
+
+log = logging.getLogger(__name__)
+
+# Spool settings and their default values, read with get_config()
+SPOOL_CONFIG_DEFAULTS = {
+    # Directory to spool failed inserts to, None disables spooling
+    "spool_dir": None,
+    # Total size the spool may grow to before inserts fail again
+    "spool_max_bytes": 1024**3,
+    # Size after which a segment is closed and can be drained
+    "spool_segment_max_bytes": 64 * 1024**2,
+    # Age after which a segment is closed and can be drained
+    "spool_segment_max_age_secs": 60,
+    # Maximum uncompressed size of a merged insert when draining
+    "spool_drain_batch_bytes": 64 * 1024**2,
+}
+
+OPEN_SUFFIX = ".open"
+SEGMENT_SUFFIX = ".seg"
+DRAINING_SUFFIX = ".draining"
+DEAD_LETTER_SUFFIX = ".dead"
+
+_HEADER_LENGTH = struct.Struct(">I")
+_BODY_LENGTH = struct.Struct(">Q")
+
+
+class SpoolFullError(Exception):
+    """
+    Raised when an insert doesn't fit in the spool's size limit.
+    """
+
+
+def get_spool_config(*configs):
+    """
+    Return the spool settings found in the given configuration dicts.
+    """
+    return get_config(SPOOL_CONFIG_DEFAULTS, *configs)
+
+
+def get_spool(*configs):
+    """
+    Return the InsertSpool configured in the given configuration dicts, if any.
+    """
+    spool_config = get_spool_config(*configs)
+    if not spool_config["spool_dir"]:
+        return None
+    return InsertSpool(**spool_config)
+
+
+class InsertSpool:
+    """
+    Append-only segment directory of encoded insert bodies, keyed by table.
+    """
+
+    def __init__(
+        self,
+        spool_dir,
+        spool_max_bytes=SPOOL_CONFIG_DEFAULTS["spool_max_bytes"],
+        spool_segment_max_bytes=SPOOL_CONFIG_DEFAULTS["spool_segment_max_bytes"],
+        spool_segment_max_age_secs=SPOOL_CONFIG_DEFAULTS["spool_segment_max_age_secs"],
+        spool_drain_batch_bytes=SPOOL_CONFIG_DEFAULTS["spool_drain_batch_bytes"],
+    ):
+        self.spool_dir = spool_dir
+        self.max_bytes = spool_max_bytes
+        self.segment_max_bytes = spool_segment_max_bytes
+        self.segment_max_age_secs = spool_segment_max_age_secs
+        self.drain_batch_bytes = spool_drain_batch_bytes
+
+    def _table_dir(self, table):
+        return os.path.join(self.spool_dir, table)
+
+    def _active_path(self, table):
+        return os.path.join(self._table_dir(table), f"{os.getpid()}{OPEN_SUFFIX}")
+
+    def get_stats(self):
+        """
+        Return the number of segments and bytes waiting in the spool, per table.
+
+        Dead letter segments are counted separately, they are never drained.
+        """
+        stats = {}
+        if not os.path.isdir(self.spool_dir):
+            return stats
+
+        for table in sorted(os.listdir(self.spool_dir)):
+            table_dir = self._table_dir(table)
+            if not os.path.isdir(table_dir):
+                continue
+            table_stats = dict.fromkeys(
+                ("segments", "bytes", "dead_letter_segments", "dead_letter_bytes"), 0
+            )
+            with os.scandir(table_dir) as entries:
+                for entry in entries:
+                    prefix = (
+                        "dead_letter_"
+                        if entry.name.endswith(DEAD_LETTER_SUFFIX)
+                        else ""
+                    )
+                    table_stats[f"{prefix}segments"] += 1
+                    table_stats[f"{prefix}bytes"] += entry.stat().st_size
+            stats[table] = table_stats
+        return stats
+
+    def get_depth(self):
+        """
+        Return the total number of bytes waiting in the spool, without dead letters.
+        """
+        return sum(table["bytes"] for table in self.get_stats().values())
+
+    def append(self, table, params, body, content_encoding=None):
+        """
+        Append an insert to the table's active segment.
+
+        body can be bytes or an iterable of bytes chunks, it is written as it is
+        read. Raises SpoolFullError if the spool is already over its size limit.
+        """
+        depth = self.get_depth()
+        if depth >= self.max_bytes:
+            raise SpoolFullError(
+                f"ClickHouse spool {self.spool_dir} is full ({depth} bytes)"
+            )
+
+        os.makedirs(self._table_dir(table), exist_ok=True)
+        header = json.dumps(
+            {
+                "params": params,
+                "content_encoding": content_encoding,
+                "created": time.time(),
+            }
+        ).encode("utf-8")
+
+        active_path = self._active_path(table)
+        with self._open_active_segment(active_path) as segment:
+            try:
+                segment.write(_HEADER_LENGTH.pack(len(header)) + header)
+                length_offset = segment.tell()
+                segment.write(_BODY_LENGTH.pack(0))
+                size = 0
+                for chunk in [body] if isinstance(body, bytes) else body:
+                    segment.write(chunk)
+                    size += len(chunk)
+                segment.flush()
+                # Opened in append mode, so patch the length through a second handle
+                with open(active_path, "r+b") as patch:
+                    patch.seek(length_offset)
+                    patch.write(_BODY_LENGTH.pack(size))
+                os.fsync(segment.fileno())
+
+                if segment.tell() >= self.segment_max_bytes:
+                    self._close_segment(active_path)
+            finally:
+                fcntl.flock(segment, fcntl.LOCK_UN)
+
+        depth += size
+        set_custom_attribute("clickhouse_spool_bytes", depth)
+        log.warning(
+            f"Spooled {size} bytes for ClickHouse table {table}, "
+            f"spool depth is now {depth} bytes"
+        )
+
+    @staticmethod
+    def _open_active_segment(path):
+        """
+        Open and lock the active segment for appending.
+
+        A drainer may close the segment between open() and flock(), in which case
+        the handle points to a closed segment and a new one is opened instead.
+        """
+        while True:
+            segment = open(path, "ab")  # pylint: disable=consider-using-with
+            fcntl.flock(segment, fcntl.LOCK_EX)
+            try:
+                if os.stat(path).st_ino == os.fstat(segment.fileno()).st_ino:
+                    return segment
+            except FileNotFoundError:
+                pass
+            fcntl.flock(segment, fcntl.LOCK_UN)
+            segment.close()
+
+    @staticmethod
+    def _close_segment(path):
+        """
+        Rename an open segment so it can be drained.
+        """
+        os.rename(path, f"{path[:-len(OPEN_SUFFIX)]}-{time.time_ns()}{SEGMENT_SUFFIX}")
+
+    def _claim_segments(self, table):
+        """
+        Claim the table's drainable segments, oldest first.
+
+        Closed segments are always claimed. Open segments are closed first if they
+        are older than the maximum segment age and no process is writing to them.
+        Segments left claimed by a drainer that died are picked up again.
+
+        rename() keeps the modification time, so claimed segments are touched to
+        record when they were claimed, and stale claims are renamed again so only
+        one drainer can take them over.
+        """
+        table_dir = self._table_dir(table)
+        now = time.time()
+        claimed = {}
+
+        for name in os.listdir(table_dir):
+            path = os.path.join(table_dir, name)
+            if name.endswith(OPEN_SUFFIX):
+                if now - os.path.getmtime(path) < self.segment_max_age_secs:
+                    continue
+                try:
+                    with open(path, "ab") as segment:
+                        fcntl.flock(segment, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        try:
+                            self._close_segment(path)
+                        finally:
+                            fcntl.flock(segment, fcntl.LOCK_UN)
+                except (BlockingIOError, FileNotFoundError):
+                    continue
+
+        for name in os.listdir(table_dir):
+            path = os.path.join(table_dir, name)
+            if name.endswith(SEGMENT_SUFFIX):
+                draining_path = path[: -len(SEGMENT_SUFFIX)] + DRAINING_SUFFIX
+            elif name.endswith(DRAINING_SUFFIX):
+                draining_path = (
+                    f"{path[:-len(DRAINING_SUFFIX)]}-{time.time_ns()}{DRAINING_SUFFIX}"
+                )
+            else:
+                continue
+            try:
+                mtime = os.path.getmtime(path)
+                if name.endswith(DRAINING_SUFFIX):
+                    if now - mtime < self.segment_max_age_secs * 10:
+                        continue
+                    mtime = now
+                os.rename(path, draining_path)
+                os.utime(draining_path)
+            except FileNotFoundError:
+                # Claimed by another drainer
+                continue
+            claimed[draining_path] = mtime
+
+        # Oldest first, by the time the segments were last written to
+        return sorted(claimed, key=claimed.get)
+
+    @staticmethod
+    def read_records(path):
+        """
+        Yield (header, body) for every complete record of a segment.
+        """
+        with open(path, "rb") as segment:
+            while True:
+                data = segment.read(_HEADER_LENGTH.size)
+                if len(data) < _HEADER_LENGTH.size:
+                    return
+                header = segment.read(_HEADER_LENGTH.unpack(data)[0])
+                data = segment.read(_BODY_LENGTH.size)
+                if len(data) < _BODY_LENGTH.size:
+                    return
+                size = _BODY_LENGTH.unpack(data)[0]
+                body = segment.read(size)
+                if len(body) < size:
+                    # Truncated by a crash while writing, drop the partial record
+                    return
+                yield json.loads(header), body
+
+    def _merge_records(self, records):
+        """
+        Group consecutive records for the same query into merged inserts.
+
+        Yields (params, body, content_encoding, number of records). Compressed bodies
+        are decompressed before merging and the merged body compressed again.
+        """
+        batch, batch_key, batch_size = [], None, 0
+
+        def flush():
+            header = batch[0][0]
+            codec = get_codec(header["content_encoding"])
+            bodies = [codec.decompress(body) if codec else body for _h, body in batch]
+            body = b"".join(bodies)
+
+            params = dict(header["params"])
+            tokens = [h["params"].get("insert_deduplication_token") for h, _b in batch]
+            params.pop("insert_deduplication_token", None)
+            if all(tokens):
+                # Stable for the same records, so re-draining them is deduplicated
+                params["insert_deduplication_token"] = hashlib.sha256(
+                    "|".join(tokens).encode("utf-8")
+                ).hexdigest()
+
+            body = codec.compress(body) if codec else body
+            return params, body, header["content_encoding"], len(batch)
+
+        for header, body in records:
+            key = (header["params"].get("query"), header["content_encoding"])
+            if batch and (key != batch_key or batch_size >= self.drain_batch_bytes):
+                yield flush()
+                batch, batch_size = [], 0
+            batch.append((header, body))
+            batch_key = key
+            batch_size += len(body)
+
+        if batch:
+            yield flush()
+
+    def drain(self, send, table=None):
+        """
+        Replay spooled inserts through send(params, body, content_encoding).
+
+        Segments are drained oldest first. If ClickHouse rejects a merged insert
+        with a non-retryable error, its records are moved to a dead letter segment
+        and draining carries on. If sending fails otherwise, the records that were
+        not sent yet are written back as a new segment and the exception is raised.
+        Returns the number of records sent.
+        """
+        if not os.path.isdir(self.spool_dir):
+            return 0
+
+        tables = [table] if table else sorted(os.listdir(self.spool_dir))
+        sent = 0
+
+        for table_name in tables:
+            if not os.path.isdir(self._table_dir(table_name)):
+                continue
+            for path in self._claim_segments(table_name):
+                records = list(self.read_records(path))
+                done = 0
+                try:
+                    for params, body, encoding, num_records in self._merge_records(
+                        records
+                    ):
+                        try:
+                            send(params, body, encoding)
+                        except requests.exceptions.HTTPError as e:
+                            if RetryPolicy.is_retryable(e):
+                                raise
+                            self._dead_letter(
+                                table_name, records[done:][:num_records], e
+                            )
+                        else:
+                            sent += num_records
+                        done += num_records
+                except Exception:
+                    self._write_segment(table_name, records[done:])
+                    self._remove_segment(path)
+                    raise
+                self._remove_segment(path)
+                log.info(f"Drained {len(records)} spooled inserts from {path}")
+
+        set_custom_attribute("clickhouse_spool_bytes", self.get_depth())
+        return sent
+
+    def _dead_letter(self, table, records, exception):
+        """
+        Move records that ClickHouse rejected for good out of the drained segments.
+        """
+        self._write_segment(table, records, DEAD_LETTER_SUFFIX)
+        log.error(
+            f"ClickHouse rejected {len(records)} spooled inserts for table {table}, "
+            f"moved them to a dead letter segment: {exception}"
+        )
+
+    @staticmethod
+    def _remove_segment(path):
+        """
+        Remove a drained segment, unless another drainer already did.
+        """
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            log.warning(f"Spooled segment {path} was already removed")
+
+    def _write_segment(self, table, records, suffix=SEGMENT_SUFFIX):
+        """
+        Write records back to the spool as a closed or dead letter segment.
+        """
+        if not records:
+            return
+        path = os.path.join(
+            self._table_dir(table), f"requeued-{os.getpid()}{OPEN_SUFFIX}"
+        )
+        with open(path, "ab") as segment:
+            for header, body in records:
+                header = json.dumps(header).encode("utf-8")
+                segment.write(_HEADER_LENGTH.pack(len(header)) + header)
+                segment.write(_BODY_LENGTH.pack(len(body)) + body)
+            os.fsync(segment.fileno())
+        os.rename(path, f"{path[:-len(OPEN_SUFFIX)]}-{time.time_ns()}{suffix}")
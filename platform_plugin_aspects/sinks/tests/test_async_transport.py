@@ -0,0 +1,233 @@
+"""
+Tests for the asyncio ClickHouse transport.
+"""
+
+import logging
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlparse
+
+import requests
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from platform_plugin_aspects.sinks import circuit_breaker, endpoints
+from platform_plugin_aspects.sinks.async_transport import AsyncTransport
+from platform_plugin_aspects.sinks.base_sink import ModelBaseSink
+
+
+class AsyncChildSink(ModelBaseSink):  # pylint: disable=abstract-method
+    """
+    Demo sink for the asyncio transport.
+    """
+
+    model = "async_child_model"
+    unique_key = "id"
+    clickhouse_table_name = "async_child_model_table"
+    timestamp_field = "time_last_dumped"
+    name = "Async Child Model"
+    clickhouse_schema = [("dump_id", "UInt32"), ("name", "String")]
+
+
+class FakeClickHouse(ThreadingHTTPServer):
+    """
+    HTTP server answering inserts with the queued statuses, 200 once they run out.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, statuses=(), delay=0):
+        self.statuses = list(statuses)
+        self.delay = delay
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        super().__init__(("127.0.0.1", 0), FakeClickHouseHandler)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class FakeClickHouseHandler(BaseHTTPRequestHandler):
+    """
+    Record inserts posted to FakeClickHouse.
+    """
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        server = self.server
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        with server.lock:
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            server.requests.append((parse_qs(urlparse(self.path).query), body))
+            status = server.statuses.pop(0) if server.statuses else 200
+
+        time.sleep(server.delay)
+        with server.lock:
+            server.in_flight -= 1
+
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+@patch("platform_plugin_aspects.sinks.base_sink.asyncio.sleep")
+class TestAsyncTransport(TestCase):
+    """
+    Tests for sending inserts through AsyncTransport.
+    """
+
+    def start_server(self, statuses=(), delay=0):
+        server = FakeClickHouse(statuses, delay)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def make_sink(self, server, **overrides):
+        endpoints.reset_endpoint_pools()
+        circuit_breaker.reset_circuit_breakers()
+        self.addCleanup(endpoints.reset_endpoint_pools)
+        self.addCleanup(circuit_breaker.reset_circuit_breakers)
+        with override_settings(
+            EVENT_SINK_CLICKHOUSE_BACKEND_CONFIG={
+                "url": server.url,
+                "username": "ch_cms",
+                "password": "password",
+                "database": "event_sink",
+                "timeout_secs": 5,
+                "max_retries": 2,
+            }
+        ):
+            return AsyncChildSink(
+                connection_overrides=overrides, log=logging.getLogger()
+            )
+
+    def test_inserts_in_flight(self, _mock_sleep):
+        """
+        Test that inserts are sent concurrently, bounded by the concurrency.
+        """
+        server = self.start_server(delay=0.2)
+        sink = self.make_sink(server)
+
+        with AsyncTransport(concurrency=3) as transport:
+            sink.use_async_transport(transport)
+            for dump_id in range(1, 7):
+                sink.send_item({"dump_id": dump_id, "name": "a"})
+
+        self.assertEqual(len(server.requests), 6)
+        self.assertGreater(server.max_in_flight, 1)
+        self.assertLessEqual(server.max_in_flight, 3)
+        params, body = server.requests[0]
+        self.assertEqual(
+            params["query"],
+            [
+                "INSERT INTO event_sink.async_child_model_table (`dump_id`, `name`) "
+                "FORMAT CSV"
+            ],
+        )
+        self.assertEqual(body.count(b"\r\n"), 1)
+
+    def test_streamed_body_and_retry(self, mock_sleep):
+        """
+        Test that large bodies are sent whole and transient errors are retried.
+        """
+        server = self.start_server(statuses=[503])
+        sink = self.make_sink(server, insert_chunk_size=16, compression="gzip")
+
+        with AsyncTransport(concurrency=2) as transport:
+            sink.use_async_transport(transport)
+            sink.send_item(
+                ({"dump_id": i, "name": "b" * 20} for i in range(1, 4)), many=True
+            )
+
+        self.assertEqual(len(server.requests), 2)
+        self.assertEqual(server.requests[0][1], server.requests[1][1])
+        self.assertEqual(
+            server.requests[1][0]["insert_deduplication_token"],
+            ["async_child_model_table-1"],
+        )
+        self.assertEqual(mock_sleep.call_count, 1)
+
+    def test_error_raised(self, _mock_sleep):
+        """
+        Test that a failed insert is raised when flushing.
+        """
+        server = self.start_server(statuses=[400])
+        sink = self.make_sink(server)
+        transport = AsyncTransport(concurrency=2)
+        sink.use_async_transport(transport)
+
+        sink.send_item({"dump_id": 1, "name": "a"})
+
+        with self.assertRaises(requests.exceptions.HTTPError):
+            transport.close()
+        self.assertEqual(len(server.requests), 1)
+
+    def test_connection_error_spooled(self, _mock_sleep):
+        """
+        Test that inserts ClickHouse can't be reached for are spooled.
+        """
+        server = self.start_server()
+        spool_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(spool_dir.cleanup)
+        sink = self.make_sink(server, spool_dir=spool_dir.name)
+        server.shutdown()
+        server.server_close()
+
+        with AsyncTransport(concurrency=2) as transport:
+            sink.use_async_transport(transport)
+            sink.send_item({"dump_id": 1, "name": "a"})
+
+        stats = sink.ch_spool.get_stats()
+        self.assertEqual(stats["async_child_model_table"]["segments"], 1)
+
+    def test_slow_on_failure(self, _mock_sleep):
+        """
+        Test that a slow on_failure callback doesn't block the other requests.
+        """
+        server = self.start_server(statuses=[400])
+        sink = self.make_sink(server)
+        failure_started = threading.Event()
+        release_failure = threading.Event()
+
+        def on_failure(_error):
+            failure_started.set()
+            release_failure.wait(5)
+
+        def insert(name):
+            return requests.Request(
+                "POST",
+                server.url,
+                params={"query": sink.get_insert_query()},
+                data=f"1,{name}\r\n".encode(),
+                auth=sink.ch_auth,
+            )
+
+        with AsyncTransport(concurrency=2) as transport:
+            failed = transport.submit(sink, insert("a"), on_failure)
+            self.assertTrue(failure_started.wait(5))
+
+            sent = transport.submit(sink, insert("b"))
+            self.assertEqual(sent.result(timeout=2).status_code, 200)
+            self.assertFalse(failed.done())
+            release_failure.set()
+
+        self.assertEqual(len(server.requests), 2)
+
+    def test_invalid_concurrency(self, _mock_sleep):
+        """
+        Test that the concurrency must be positive.
+        """
+        with self.assertRaises(ValueError):
+            AsyncTransport(concurrency=0)
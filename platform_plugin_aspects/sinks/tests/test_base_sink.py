@@ -2,14 +2,31 @@
 Tests for the base sinks.
 """
 
+import csv
+import datetime
+import gzip
+import io
 import logging
+import tempfile
+import uuid
 from unittest.mock import MagicMock, Mock, patch
 
 import ddt
+import requests
+import responses
+from django.conf import settings
 from django.test import TestCase
 from django.test.utils import override_settings
+from django_mock_queries.query import MockModel, MockSet
+from opaque_keys.edx.keys import CourseKey
+from rest_framework import serializers
 
-from platform_plugin_aspects.sinks.base_sink import ModelBaseSink
+from platform_plugin_aspects.sinks import circuit_breaker, endpoints
+from platform_plugin_aspects.sinks.base_sink import ModelBaseSink, ProjectedRow
+from platform_plugin_aspects.sinks.compression import get_codec
+from platform_plugin_aspects.sinks.schema import SchemaMismatchError, reset_schemas
+from platform_plugin_aspects.sinks.serializers import BaseSinkSerializer
+from platform_plugin_aspects.sinks.spool import InsertSpool
 
 
 class ChildSink(ModelBaseSink):  # pylint: disable=abstract-method
@@ -24,6 +41,35 @@ class ChildSink(ModelBaseSink):  # pylint: disable=abstract-method
     timestamp_field = "time_last_dumped"
     name = "Child Model"
     serializer_class = Mock()
+    clickhouse_schema = [("dump_id", "UInt32"), ("time_last_dumped", "String")]
+
+
+class NameSerializer(serializers.Serializer):  # pylint: disable=abstract-method
+    """
+    Demo DRF serializer.
+    """
+
+    id = serializers.IntegerField(source="pk")
+    name = serializers.CharField()
+
+
+LEDGER_KEY = "http://clickhouse:8123/event_sink.child_model_table"
+
+
+class EnrollmentSerializer(BaseSinkSerializer):  # pylint: disable=abstract-method
+    """
+    Demo DRF serializer with fields of the types sink projections read.
+    """
+
+    id = serializers.IntegerField()
+    course_key = serializers.SerializerMethodField()
+    created = serializers.DateTimeField()
+    external_id = serializers.UUIDField()
+    username = serializers.CharField(source="user.username")
+
+    def get_course_key(self, obj):
+        """Return the course key as a string."""
+        return str(obj.course_id)
 
 
 @override_settings(
@@ -61,6 +107,305 @@ class TestBaseSink(TestCase):
         self.assertEqual(child_sink.ch_database, "dummy_database")
         self.assertEqual(child_sink.ch_timeout_secs, 0)
 
+    @patch("platform_plugin_aspects.sinks.base_sink.get_clickhouse_session")
+    def test_send_clickhouse_request_uses_pool(self, mock_get_session):
+        """
+        Test that requests are sent through the shared session for the pool config.
+        """
+        child_sink = ChildSink(
+            connection_overrides={"pool_maxsize": 25},
+            log=logging.getLogger(),
+        )
+        request = Mock()
+
+        child_sink._send_clickhouse_request(request)  # pylint: disable=protected-access
+
+        self.assertEqual(child_sink.ch_pool_config["pool_maxsize"], 25)
+        mock_get_session.assert_called_once_with(child_sink.ch_pool_config)
+        mock_get_session.return_value.send.assert_called_once_with(
+            request.prepare.return_value, timeout=5
+        )
+
+
+@override_settings(
+    EVENT_SINK_CLICKHOUSE_BACKEND_CONFIG={
+        "url": "http://clickhouse:8123",
+        "username": "ch_cms",
+        "password": "password",
+        "database": "event_sink",
+        "timeout_secs": 5,
+        "max_retries": 2,
+    },
+    EVENT_SINK_CLICKHOUSE_MODEL_CONFIG={},
+)
+@patch("platform_plugin_aspects.sinks.base_sink.time.sleep")
+class TestBaseSinkRetries(TestCase):
+    """
+    Tests for retrying ClickHouse requests.
+    """
+
+    def setUp(self):
+        circuit_breaker.reset_circuit_breakers()
+        self.addCleanup(circuit_breaker.reset_circuit_breakers)
+        self.child_sink = ChildSink(connection_overrides={}, log=logging.getLogger())
+
+    def make_spool_dir(self):
+        spool_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(spool_dir.cleanup)
+        return spool_dir.name
+
+    @responses.activate
+    def test_retry_then_succeed(self, mock_sleep):
+        """
+        Test that transient errors are retried with the same encoded body.
+        """
+        bodies = []
+        statuses = iter([503, 502, 200])
+
+        def callback(request):
+            bodies.append(b"".join(request.body))
+            return next(statuses), {}, ""
+
+        responses.add_callback(responses.POST, "http://clickhouse:8123/", callback)
+        self.child_sink.ch_insert_chunk_size = 16
+        rows = ({"dump_id": i, "time_last_dumped": "x" * 10} for i in range(1, 6))
+
+        self.child_sink.send_item(rows, many=True)
+
+        self.assertEqual(len(responses.calls), 3)
+        self.assertEqual(mock_sleep.call_count, 2)
+        self.assertEqual(bodies[0], bodies[2])
+        self.assertEqual(bodies[2].count(b"\r\n"), 5)
+        for call in responses.calls:
+            self.assertEqual(
+                call.request.params["insert_deduplication_token"],
+                "child_model_table-1",
+            )
+
+    @responses.activate
+    def test_report_to_flow_controller(self, _mock_sleep):
+        """
+        Test that insert latencies and transient failures reach the flow controller.
+        """
+        responses.post("http://clickhouse:8123/", status=429)
+        responses.post("http://clickhouse:8123/", status=200)
+        flow_controller = Mock()
+        self.child_sink.use_flow_controller(flow_controller)
+
+        self.child_sink.send_item({"dump_id": 1, "time_last_dumped": "a"})
+
+        flow_controller.record_failure.assert_called_once_with()
+        flow_controller.record_latency.assert_called_once()
+
+        # Other queries don't reflect how fast inserts are taken in
+        responses.post("http://clickhouse:8123/", status=429)
+        responses.post("http://clickhouse:8123/", status=200)
+        self.child_sink.post_query({"query": "SELECT 1"})
+        flow_controller.record_failure.assert_called_once_with()
+        flow_controller.record_latency.assert_called_once()
+        self.child_sink._nested_sinks[  # pylint: disable=protected-access
+            0
+        ].use_flow_controller.assert_called_once_with(flow_controller)
+
+    @responses.activate
+    def test_get_active_parts(self, _mock_sleep):
+        """
+        Test that the active parts of the sink's table are read from system.parts.
+        """
+        parts = responses.get("http://clickhouse:8123/", body="42\n")
+
+        self.assertEqual(self.child_sink.get_active_parts(), 42)
+        query = parts.calls[0].request.params["query"]
+        self.assertIn("FROM system.parts WHERE active", query)
+        self.assertIn("table = 'child_model_table'", query)
+
+    @responses.activate
+    def test_failover_to_replica(self, mock_sleep):
+        """
+        Test that a failing replica is skipped without waiting for a backoff.
+        """
+        endpoints.reset_endpoint_pools()
+        self.addCleanup(endpoints.reset_endpoint_pools)
+        sink = ChildSink(
+            connection_overrides={"url": ["http://ch1:8123", "http://ch2:8123"]},
+            log=logging.getLogger(),
+        )
+        responses.post("http://ch1:8123/", status=503)
+        responses.post("http://ch2:8123/", status=200)
+
+        sink.send_item({"dump_id": 1, "time_last_dumped": "a"})
+        sink.send_item({"dump_id": 2, "time_last_dumped": "a"})
+
+        self.assertEqual(sink.ch_url, "http://ch1:8123")
+        self.assertEqual(
+            [call.request.url.split("?")[0] for call in responses.calls],
+            ["http://ch1:8123/", "http://ch2:8123/", "http://ch2:8123/"],
+        )
+        mock_sleep.assert_not_called()
+
+    @responses.activate
+    def test_retries_exhausted(self, mock_sleep):
+        """
+        Test that the error is raised once all retries failed.
+        """
+        responses.post("http://clickhouse:8123/", status=500)
+
+        with self.assertRaises(requests.exceptions.HTTPError):
+            self.child_sink.send_item({"dump_id": 1, "time_last_dumped": "a"})
+
+        self.assertEqual(len(responses.calls), 3)
+        self.assertEqual(mock_sleep.call_count, 2)
+
+    @responses.activate
+    def test_client_error_not_retried(self, mock_sleep):
+        """
+        Test that client errors fail straight away.
+        """
+        responses.post("http://clickhouse:8123/", status=400)
+
+        with self.assertRaises(requests.exceptions.HTTPError):
+            self.child_sink.send_item({"dump_id": 1, "time_last_dumped": "a"})
+
+        self.assertEqual(len(responses.calls), 1)
+        mock_sleep.assert_not_called()
+
+    @responses.activate
+    def test_spooled_when_unavailable(self, _mock_sleep):
+        """
+        Test that inserts are spooled when ClickHouse is down, and drained later.
+        """
+        spool_dir = self.make_spool_dir()
+        sink = ChildSink(
+            connection_overrides={
+                "spool_dir": spool_dir,
+                "spool_segment_max_age_secs": 0,
+                "compression": "gzip",
+                "insert_chunk_size": 16,
+            },
+            log=logging.getLogger(),
+        )
+        responses.post("http://clickhouse:8123/", status=503)
+
+        sink.send_item({"dump_id": 1, "time_last_dumped": "a"})
+        sink.send_item(
+            ({"dump_id": i, "time_last_dumped": "b" * 20} for i in [2, 3]), many=True
+        )
+
+        self.assertEqual(len(responses.calls), 6)
+        self.assertEqual(sink.ch_spool.get_stats()["child_model_table"]["segments"], 1)
+
+        bodies = []
+
+        def callback(request):
+            bodies.append(gzip.decompress(request.body))
+            return 200, {}, ""
+
+        responses.reset()
+        responses.add_callback(responses.POST, "http://clickhouse:8123/", callback)
+
+        self.assertEqual(sink.drain_spool(), 2)
+
+        # Both spooled inserts are merged into one
+        self.assertEqual(len(responses.calls), 1)
+        self.assertEqual(bodies[0].count(b"\r\n"), 3)
+        self.assertEqual(
+            sink.ch_spool.get_stats(),
+            {
+                "child_model_table": {
+                    "segments": 0,
+                    "bytes": 0,
+                    "dead_letter_segments": 0,
+                    "dead_letter_bytes": 0,
+                }
+            },
+        )
+        request = responses.calls[0].request
+        self.assertEqual(request.headers["Content-Encoding"], "gzip")
+        self.assertEqual(
+            request.params["query"],
+            "INSERT INTO event_sink.child_model_table (`dump_id`, `time_last_dumped`) "
+            "FORMAT CSV",
+        )
+        self.assertEqual(len(request.params["insert_deduplication_token"]), 64)
+
+    @responses.activate
+    def test_client_error_not_spooled(self, _mock_sleep):
+        """
+        Test that inserts ClickHouse rejected are not spooled.
+        """
+        spool_dir = self.make_spool_dir()
+        sink = ChildSink(
+            connection_overrides={"spool_dir": spool_dir}, log=logging.getLogger()
+        )
+        responses.post("http://clickhouse:8123/", status=400)
+
+        with self.assertRaises(requests.exceptions.HTTPError):
+            sink.send_item({"dump_id": 1, "time_last_dumped": "a"})
+
+        self.assertEqual(sink.ch_spool.get_stats(), {})
+
+    @responses.activate
+    def test_spool_full(self, mock_sleep):  # pylint: disable=unused-argument
+        """
+        Test that the original error is raised when the spool is full.
+        """
+        spool_dir = self.make_spool_dir()
+        sink = ChildSink(
+            connection_overrides={"spool_dir": spool_dir, "spool_max_bytes": 0},
+            log=logging.getLogger(),
+        )
+        responses.post("http://clickhouse:8123/", status=503)
+
+        with self.assertRaises(requests.exceptions.HTTPError):
+            sink.send_item({"dump_id": 1, "time_last_dumped": "a"})
+
+    @responses.activate
+    def test_circuit_breaker(self, mock_sleep):  # pylint: disable=unused-argument
+        """
+        Test that the breaker fails fast once open, and inserts go to the spool.
+        """
+        sink = ChildSink(
+            connection_overrides={
+                "max_retries": 0,
+                "breaker_enabled": True,
+                "breaker_min_requests": 2,
+                "spool_dir": self.make_spool_dir(),
+                "spool_segment_max_age_secs": 0,
+            },
+            log=logging.getLogger(),
+        )
+        responses.post("http://clickhouse:8123/", status=503)
+
+        for dump_id in range(1, 4):
+            sink.send_item({"dump_id": dump_id, "time_last_dumped": "a"})
+
+        # The third insert was spooled without being sent
+        self.assertEqual(len(responses.calls), 2)
+        self.assertEqual(sink.ch_breaker.state, circuit_breaker.OPEN)
+        with self.assertRaises(circuit_breaker.CircuitOpenError):
+            sink.drain_spool()
+
+    @responses.activate
+    def test_circuit_breaker_disabled(self, _mock_sleep):
+        """
+        Test that the breaker is disabled by default.
+        """
+        sink = ChildSink(connection_overrides={}, log=logging.getLogger())
+
+        self.assertIsNone(sink.ch_breaker)
+        responses.post("http://clickhouse:8123/")
+        sink.send_item({"dump_id": 1, "time_last_dumped": "a"})
+        self.assertEqual(len(responses.calls), 1)
+
+    @responses.activate
+    def test_empty_batch_not_sent(self, mock_sleep):  # pylint: disable=unused-argument
+        """
+        Test that an empty batch doesn't make a request.
+        """
+        self.child_sink.send_item(iter([]), many=True)
+
+        self.assertEqual(len(responses.calls), 0)
+
 
 @override_settings(
     EVENT_SINK_CLICKHOUSE_BACKEND_CONFIG={
@@ -105,15 +450,22 @@ class TestModelBaseSink(TestCase):
         """
         self.child_sink.send_item_and_log = Mock()
         self.child_sink.serialize_item = Mock(return_value=serialized_items)
+        self.child_sink.iter_serialize_items = Mock(return_value=serialized_items)
         self.child_sink.get_object = Mock(return_value=items_id)
 
         self.child_sink.dump(items_id, many=many)
 
-        self.child_sink.serialize_item.assert_called_once_with(
-            items_id, many=many, initial=None
-        )
+        if many:
+            self.child_sink.iter_serialize_items.assert_called_once_with(
+                items_id, initial=None
+            )
+            self.child_sink.serialize_item.assert_not_called()
+        else:
+            self.child_sink.serialize_item.assert_called_once_with(
+                items_id, many=many, initial=None
+            )
         self.child_sink.send_item_and_log.assert_called_once_with(
-            items_id, self.child_sink.serialize_item.return_value, many
+            items_id, serialized_items, many
         )
 
     def test_send_item_and_log(self):
@@ -149,7 +501,479 @@ class TestModelBaseSink(TestCase):
             self.child_sink.get_serializer.return_value.return_value.data,
         )
 
-    @patch("platform_plugin_aspects.sinks.base_sink.io")
+    def test_iter_serialize_items_is_lazy(self):
+        """
+        Test that serializing many items yields one row at a time from the child serializer.
+        """
+        items = [Mock(id=1), Mock(id=2)]
+        child = Mock()
+        child.to_representation.side_effect = lambda item: {"id": item.id}
+        self.child_sink.get_serializer = Mock()
+        self.child_sink.get_serializer.return_value.return_value.child = child
+
+        serialized_items = self.child_sink.iter_serialize_items(items)
+
+        child.to_representation.assert_not_called()
+        self.assertEqual(list(serialized_items), [{"id": 1}, {"id": 2}])
+
+    def test_serialize_many_with_list_serializer(self):
+        """
+        Test both ways of serializing many items with a real DRF ListSerializer.
+
+        serialize_item returns rows that can be read more than once, as the
+        compression benchmark does, while iter_serialize_items streams the same rows.
+        """
+        items = [
+            MockModel(pk=1, name="one"),
+            MockModel(pk=2, name="two"),
+        ]
+        self.child_sink.get_serializer = Mock(return_value=NameSerializer)
+
+        serialized_items = self.child_sink.serialize_item(items, many=True)
+
+        expected = [
+            {"id": 1, "name": "one"},
+            {"id": 2, "name": "two"},
+        ]
+        self.assertEqual([dict(row) for row in serialized_items], expected)
+        self.assertEqual([dict(row) for row in serialized_items], expected)
+        self.assertEqual(
+            [dict(row) for row in self.child_sink.iter_serialize_items(items)],
+            expected,
+        )
+
+    def test_dump_many_with_nested_sinks(self):
+        """
+        Test that lazily serialized rows are kept for the nested sinks.
+        """
+        rows = [
+            {"dump_id": 1, "time_last_dumped": "2020-01-01 00:00:00"},
+            {"dump_id": 2, "time_last_dumped": "2020-01-01 00:00:00"},
+        ]
+        self.child_sink.iter_serialize_items = Mock(return_value=iter(rows))
+        self.child_sink.send_item = Mock(side_effect=lambda items, many: list(items))
+        nested_sink = self.child_sink._nested_sinks[  # pylint: disable=protected-access
+            0
+        ]
+        nested_sink.reset_mock()
+
+        self.child_sink.dump([Mock(), Mock()], many=True)
+
+        self.assertEqual(nested_sink.dump_related.call_count, 2)
+        nested_sink.dump_related.assert_called_with(rows[1], 2, "2020-01-01 00:00:00")
+
+    def test_dump_many_streamed_from_one_item(self):
+        """
+        Test that rows streamed from a single item are counted once they are sent.
+        """
+        rows = [{"dump_id": 1}, {"dump_id": 2}, {"dump_id": 3}]
+        self.child_sink.iter_serialize_items = Mock(return_value=iter(rows))
+        self.child_sink.send_item = Mock(side_effect=lambda items, many: list(items))
+        self.child_sink._nested_sinks = []  # pylint: disable=protected-access
+
+        with self.assertLogs() as logs:
+            self.child_sink.dump({"course_key": "course"}, many=True)
+
+        self.assertIn("Now dumping Child Model to ClickHouse", logs.output[0])
+        self.assertIn("Completed dumping 3 Child Model to ClickHouse", logs.output[-1])
+
+    @patch.object(ChildSink, "projection", {"username": "user__username"})
+    @patch.object(
+        ChildSink,
+        "clickhouse_schema",
+        [("username", "String"), ("dump_id", "UUID"), ("time_last_dumped", "String")],
+    )
+    def test_dump_projected(self):
+        """
+        Test that bulk dumps of a projection read tuples and skip the serializer.
+        """
+        users = [MockModel(username=f"user{pk}") for pk in range(3)]
+        queryset = MockSet(
+            *[MockModel(mock_name=str(pk), pk=pk, user=users[pk]) for pk in range(3)]
+        )
+        self.child_sink.get_queryset = Mock(return_value=queryset)
+        self.child_sink.serialize_item = Mock()
+        self.child_sink._send_clickhouse_request = (  # pylint: disable=protected-access
+            Mock()
+        )
+
+        rows = [row for row, _, _ in self.child_sink.fetch_target_items(batch_size=2)]
+        self.child_sink.dump(rows, many=True)
+
+        self.assertEqual(rows, [(0, "user0"), (1, "user1"), (2, "user2")])
+        self.assertEqual(rows[-1].pk, 2)
+        self.child_sink.serialize_item.assert_not_called()
+        request = self.child_sink._send_clickhouse_request.call_args.args[  # pylint: disable=protected-access
+            0
+        ]
+        sent = list(csv.reader(io.StringIO(request.data.decode("utf-8"))))
+        self.assertEqual([row[0] for row in sent], ["user0", "user1", "user2"])
+        self.assertEqual(
+            request.params["insert_deduplication_token"],
+            f"child_model_table-{sent[0][1]}",
+        )
+
+    @patch.object(ChildSink, "projection", {"username": "user__username"})
+    @patch.object(
+        ChildSink,
+        "clickhouse_schema",
+        [("username", "String"), ("dump_id", "UUID"), ("time_last_dumped", "String")],
+    )
+    def test_dump_ledger(self):
+        """
+        Test that objects whose row didn't change since the last dump are skipped.
+        """
+        ledger_dir = (
+            tempfile.TemporaryDirectory()
+        )  # pylint: disable=consider-using-with
+        self.addCleanup(ledger_dir.cleanup)
+        sink = ChildSink(
+            connection_overrides={"ledger_path": f"{ledger_dir.name}/ledger.db"},
+            log=logging.getLogger(),
+        )
+        sink._send_clickhouse_request = Mock()  # pylint: disable=protected-access
+        users = [MockModel(username=f"user{pk}") for pk in range(3)]
+        sink.get_queryset = Mock(
+            return_value=MockSet(
+                *[
+                    MockModel(mock_name=str(pk), pk=pk, user=users[pk])
+                    for pk in range(3)
+                ]
+            )
+        )
+
+        def dump_changes():
+            items = list(sink.fetch_target_items(batch_size=2))
+            rows = [row for row, should_be_dumped, _ in items if should_be_dumped]
+            if rows:
+                sink.dump(rows, many=True)
+            return [row.pk for row in rows], [reason for _, _, reason in items]
+
+        self.assertEqual(dump_changes(), ([0, 1, 2], ["No reason"] * 3))
+
+        users[1].username = "renamed"
+        self.assertEqual(
+            dump_changes(),
+            (
+                [1],
+                [
+                    "Unchanged since last dump",
+                    "No reason",
+                    "Unchanged since last dump",
+                ],
+            ),
+        )
+        self.assertEqual(dump_changes()[1], ["Unchanged since last dump"] * 3)
+
+    @patch.object(ChildSink, "projection", {"username": "user__username"})
+    @patch.object(
+        ChildSink,
+        "clickhouse_schema",
+        [("username", "String"), ("dump_id", "UUID"), ("time_last_dumped", "String")],
+    )
+    def test_dump_ledger_per_cluster(self):
+        """
+        Test that rows dumped to one ClickHouse cluster are not skipped on another.
+        """
+        ledger_dir = (
+            tempfile.TemporaryDirectory()
+        )  # pylint: disable=consider-using-with
+        self.addCleanup(ledger_dir.cleanup)
+        queryset = MockSet(
+            MockModel(mock_name="0", pk=0, user=MockModel(username="user0"))
+        )
+
+        def dump_to(url):
+            sink = ChildSink(
+                connection_overrides={
+                    "url": url,
+                    "ledger_path": f"{ledger_dir.name}/ledger.db",
+                },
+                log=logging.getLogger(),
+            )
+            sink._send_clickhouse_request = Mock()  # pylint: disable=protected-access
+            sink.get_queryset = Mock(return_value=queryset)
+            items = list(sink.fetch_target_items())
+            sink.dump([row for row, _, _ in items], many=True)
+            return [should_be_dumped for _, should_be_dumped, _ in items]
+
+        self.assertEqual(dump_to("http://clickhouse:8123"), [True])
+        self.assertEqual(dump_to("http://clickhouse:8123"), [False])
+        self.assertEqual(dump_to("http://new-clickhouse:8123"), [True])
+
+    @patch.object(ChildSink, "serializer_class", NameSerializer)
+    @patch.object(ChildSink, "clickhouse_schema", [("id", "Int32"), ("name", "String")])
+    def test_dump_ledger_serializes_once(self):
+        """
+        Test that rows serialized to check the ledger are the ones inserted.
+        """
+        ledger_dir = (
+            tempfile.TemporaryDirectory()
+        )  # pylint: disable=consider-using-with
+        self.addCleanup(ledger_dir.cleanup)
+        sink = ChildSink(
+            connection_overrides={"ledger_path": f"{ledger_dir.name}/ledger.db"},
+            log=logging.getLogger(),
+        )
+        sink._send_clickhouse_request = Mock()  # pylint: disable=protected-access
+        sink._nested_sinks = []  # pylint: disable=protected-access
+        sink.get_queryset = Mock(
+            return_value=MockSet(
+                *[
+                    MockModel(mock_name=str(pk), pk=pk, name=f"name{pk}")
+                    for pk in range(3)
+                ]
+            )
+        )
+
+        with patch.object(
+            NameSerializer,
+            "to_representation",
+            autospec=True,
+            side_effect=serializers.Serializer.to_representation,
+        ) as mock_to_representation:
+            items = [item for item, _, _ in sink.fetch_target_items()]
+            sink.dump(items, many=True)
+
+        self.assertEqual(mock_to_representation.call_count, 3)
+        request = sink._send_clickhouse_request.call_args.args[  # pylint: disable=protected-access
+            0
+        ]
+        self.assertEqual(request.data, b'0,"name0"\r\n1,"name1"\r\n2,"name2"\r\n')
+        self.assertEqual(
+            list(sink.ch_ledger.get_hashes(LEDGER_KEY, [0, 1, 2])), ["0", "1", "2"]
+        )
+
+    @patch.object(ChildSink, "projection", {"username": "user__username"})
+    @patch.object(
+        ChildSink,
+        "clickhouse_schema",
+        [("username", "String"), ("dump_id", "UUID"), ("time_last_dumped", "String")],
+    )
+    def test_dump_ledger_force(self):
+        """
+        Test that rows sent by forced dumps are recorded, so the next dump skips them.
+        """
+        ledger_dir = (
+            tempfile.TemporaryDirectory()
+        )  # pylint: disable=consider-using-with
+        self.addCleanup(ledger_dir.cleanup)
+        sink = ChildSink(
+            connection_overrides={"ledger_path": f"{ledger_dir.name}/ledger.db"},
+            log=logging.getLogger(),
+        )
+        sink._send_clickhouse_request = Mock()  # pylint: disable=protected-access
+        sink.get_queryset = Mock(
+            return_value=MockSet(
+                MockModel(mock_name="0", pk=0, user=MockModel(username="user0"))
+            )
+        )
+
+        rows = [row for row, _, _ in sink.fetch_target_items(force_dump=True)]
+        sink.dump(rows, many=True)
+
+        self.assertEqual(list(sink.ch_ledger.get_hashes(LEDGER_KEY, [0])), ["0"])
+        self.assertEqual(
+            [should_be_dumped for _, should_be_dumped, _ in sink.fetch_target_items()],
+            [False],
+        )
+
+    @patch.object(ChildSink, "serializer_class", NameSerializer)
+    def test_discard_ledger(self):
+        """
+        Test that the hashes and rows kept for items that are not dumped are dropped.
+        """
+        ledger_dir = (
+            tempfile.TemporaryDirectory()
+        )  # pylint: disable=consider-using-with
+        self.addCleanup(ledger_dir.cleanup)
+        sink = ChildSink(
+            connection_overrides={"ledger_path": f"{ledger_dir.name}/ledger.db"},
+            log=logging.getLogger(),
+        )
+        items = [
+            MockModel(mock_name=str(pk), pk=pk, name=f"name{pk}") for pk in range(3)
+        ]
+        sink.get_queryset = Mock(return_value=MockSet(*items))
+        # pylint: disable=protected-access
+
+        list(sink.fetch_target_items())
+        self.assertEqual(set(sink._ledger_pending), {0, 1, 2})
+        self.assertEqual(set(sink._ledger_rows), {0, 1, 2})
+
+        sink.discard_ledger(items[1:])
+        self.assertEqual(set(sink._ledger_pending), {0})
+        self.assertEqual(set(sink._ledger_rows), {0})
+
+        sink.discard_ledger()
+        self.assertFalse(sink._ledger_pending)
+        self.assertFalse(sink._ledger_rows)
+
+    @patch.object(ChildSink, "projection", {"username": "user__username"})
+    @patch.object(
+        ChildSink,
+        "clickhouse_schema",
+        [("username", "String"), ("dump_id", "UUID"), ("time_last_dumped", "String")],
+    )
+    def test_dump_ledger_async_transport(self):
+        """
+        Test that rows sent through an AsyncTransport are recorded once committed.
+        """
+        ledger_dir = (
+            tempfile.TemporaryDirectory()
+        )  # pylint: disable=consider-using-with
+        self.addCleanup(ledger_dir.cleanup)
+        sink = ChildSink(
+            connection_overrides={"ledger_path": f"{ledger_dir.name}/ledger.db"},
+            log=logging.getLogger(),
+        )
+        sink.use_async_transport(Mock())
+        sink.get_queryset = Mock(
+            return_value=MockSet(
+                MockModel(mock_name="0", pk=0, user=MockModel(username="user0"))
+            )
+        )
+
+        rows = [row for row, _, _ in sink.fetch_target_items()]
+        sink.dump(rows, many=True)
+
+        sink.ch_transport.submit.assert_called_once()
+        self.assertEqual(sink.ch_ledger.get_hashes(LEDGER_KEY, [0]), {})
+        sink.commit_ledger()
+        self.assertEqual(list(sink.ch_ledger.get_hashes(LEDGER_KEY, [0])), ["0"])
+
+    @patch.object(ChildSink, "projection", {"username": "user__username"})
+    @patch.object(
+        ChildSink,
+        "clickhouse_schema",
+        [("username", "String"), ("dump_id", "UUID"), ("time_last_dumped", "String")],
+    )
+    def test_dump_ledger_failed_insert(self):
+        """
+        Test that rows are not recorded in the ledger when their insert fails.
+        """
+        ledger_dir = (
+            tempfile.TemporaryDirectory()
+        )  # pylint: disable=consider-using-with
+        self.addCleanup(ledger_dir.cleanup)
+        sink = ChildSink(
+            connection_overrides={"ledger_path": f"{ledger_dir.name}/ledger.db"},
+            log=logging.getLogger(),
+        )
+        sink.send_projected_values = Mock(side_effect=ValueError("Insert failed"))
+        sink.get_queryset = Mock(
+            return_value=MockSet(
+                MockModel(mock_name="0", pk=0, user=MockModel(username="user0"))
+            )
+        )
+
+        rows = [row for row, _, _ in sink.fetch_target_items()]
+        with self.assertRaises(ValueError):
+            sink.dump(rows, many=True)
+
+        self.assertEqual(sink.ch_ledger.get_hashes(LEDGER_KEY, [0]), {})
+        self.assertEqual(
+            [should_be_dumped for _, should_be_dumped, _ in sink.fetch_target_items()],
+            [True],
+        )
+
+    @patch.object(
+        ChildSink,
+        "projection",
+        {
+            "id": "id",
+            "course_key": "course_id",
+            "created": "created",
+            "external_id": "external_id",
+            "username": "user__username",
+        },
+    )
+    @patch.object(
+        ChildSink,
+        "clickhouse_schema",
+        [
+            ("id", "Int32"),
+            ("course_key", "String"),
+            ("created", "DateTime"),
+            ("external_id", "UUID"),
+            ("username", "String"),
+            ("dump_id", "UUID"),
+            ("time_last_dumped", "String"),
+        ],
+    )
+    def test_projected_values_match_serializer(self):
+        """
+        Test that projected rows hold the same values as serialized ones.
+        """
+        enrollments = [
+            MockModel(
+                mock_name=str(pk),
+                pk=pk,
+                id=pk,
+                course_id=CourseKey.from_string(f"course-v1:org+course+run{pk}"),
+                created=datetime.datetime(
+                    2024, 1, 2, 3, 4, pk, tzinfo=datetime.timezone.utc
+                ),
+                external_id=uuid.UUID(int=pk),
+                user=MockModel(username=f"user{pk}"),
+            )
+            for pk in range(1, 3)
+        ]
+        self.child_sink.get_queryset = Mock(return_value=MockSet(*enrollments))
+        self.child_sink.get_serializer = Mock(return_value=EnrollmentSerializer)
+
+        rows = [row for row, _, _ in self.child_sink.fetch_target_items()]
+        columns = self.child_sink.ch_encoder.columns
+        projected = [
+            dict(zip(columns, values))
+            for values in self.child_sink.iter_projected_values(rows)
+        ]
+        serialized = [
+            dict(row) for row in self.child_sink.serialize_item(enrollments, many=True)
+        ]
+
+        for row in projected + serialized:
+            self.assertIsInstance(row.pop("dump_id"), uuid.UUID)
+            self.assertIsInstance(row.pop("time_last_dumped"), datetime.datetime)
+        self.assertEqual(projected, serialized)
+        self.assertEqual(projected[0]["course_key"], "course-v1:org+course+run1")
+        self.assertEqual(projected[0]["external_id"], str(uuid.UUID(int=1)))
+        self.assertIsInstance(projected[0]["created"], str)
+
+    @patch.object(ChildSink, "projection", {"username": "user__username"})
+    @patch.object(
+        ChildSink,
+        "clickhouse_schema",
+        [("username", "String"), ("dump_id", "UUID"), ("time_last_dumped", "String")],
+    )
+    def test_projected_values_share_dump_id(self):
+        """
+        Test that a projected batch has a single dump_id, as its deduplication token.
+        """
+        rows = [ProjectedRow((pk, f"user{pk}")) for pk in range(3)]
+
+        values = list(self.child_sink.iter_projected_values(rows))
+
+        self.assertEqual(len({dump_id for _username, dump_id, _time in values}), 1)
+        self.assertNotEqual(
+            values[0][1], next(self.child_sink.iter_projected_values(rows))[1]
+        )
+
+    @patch.object(ChildSink, "projection", {"username": "user__username"})
+    @patch.object(
+        ChildSink, "clickhouse_schema", [("username", "String"), ("email", "String")]
+    )
+    def test_dump_projected_missing_column(self):
+        """
+        Test that table columns the projection doesn't cover are an explicit error.
+        """
+        self.child_sink._send_clickhouse_request = (  # pylint: disable=protected-access
+            Mock()
+        )
+
+        with self.assertRaises(SchemaMismatchError):
+            self.child_sink.dump([ProjectedRow((1, "user1"))], many=True)
+
     @patch("platform_plugin_aspects.sinks.base_sink.requests")
     @ddt.data(
         ({"dump_id": 1, "time_last_dumped": "2020-01-01 00:00:00"}, False),
@@ -162,17 +986,22 @@ class TestModelBaseSink(TestCase):
         ),
     )
     @ddt.unpack
-    def test_send_items(self, serialized_items, many, mock_requests, mock_io):
+    def test_send_items(self, serialized_items, many, mock_requests):
         """
         Test that send_item() calls the correct requests.
         """
         params = self.child_sink.CLICKHOUSE_BULK_INSERT_PARAMS.copy()
-        params["query"] = "INSERT INTO event_sink.child_model_table FORMAT CSV"
+        params["query"] = (
+            "INSERT INTO event_sink.child_model_table (`dump_id`, `time_last_dumped`) "
+            "FORMAT CSV"
+        )
+        params["insert_deduplication_token"] = "child_model_table-1"
         self.child_sink._send_clickhouse_request = (  # pylint: disable=protected-access
             Mock()
         )
-        data = "1,2020-01-01 00:00:00\n2,2020-01-01 00:00:00\n"
-        mock_io.StringIO.return_value.getvalue.return_value.encode.return_value = data
+        data = b'1,"2020-01-01 00:00:00"\r\n'
+        if many:
+            data += b'2,"2020-01-01 00:00:00"\r\n'
 
         self.child_sink.send_item(serialized_items, many=many)
 
@@ -181,12 +1010,191 @@ class TestModelBaseSink(TestCase):
             self.child_sink.ch_url,
             data=data,
             params=params,
+            headers={},
             auth=self.child_sink.ch_auth,
         )
-        self.child_sink._send_clickhouse_request(  # pylint: disable=protected-access
-            mock_requests.Request.return_value
+        self.child_sink._send_clickhouse_request.assert_called_once_with(  # pylint: disable=protected-access
+            mock_requests.Request.return_value, is_insert=True
+        )
+
+    @ddt.data(None, "gzip")
+    def test_send_items_streamed(self, compression):
+        """
+        Test that bodies larger than a chunk are sent as a generator of chunks.
+        """
+        self.child_sink.ch_compression = get_codec(compression)
+        self.child_sink.ch_insert_chunk_size = 64
+        sent = []
+        self.child_sink._send_clickhouse_request = (  # pylint: disable=protected-access
+            # The body is released once sent, so consume it during the call
+            Mock(
+                side_effect=lambda request, is_insert: sent.append(
+                    (request, list(request.data))
+                )
+            )
+        )
+        serialized_items = (
+            {"dump_id": i, "time_last_dumped": "2020-01-01 00:00:00"} for i in range(10)
         )
 
+        self.child_sink.send_item(serialized_items, many=True)
+
+        ((request, chunks),) = sent
+        self.assertNotIsInstance(request.data, bytes)
+        body = b"".join(chunks)
+        if compression:
+            self.assertEqual(request.headers, {"Content-Encoding": "gzip"})
+            body = gzip.decompress(body)
+        else:
+            self.assertGreater(len(chunks), 1)
+            self.assertTrue(all(len(chunk) >= 64 for chunk in chunks[:-1]))
+        self.assertEqual(
+            body,
+            b"".join(
+                f'{i},"2020-01-01 00:00:00"\r\n'.encode("utf-8") for i in range(10)
+            ),
+        )
+
+    def test_send_items_compressed(self):
+        """
+        Test that send_item() compresses the body and sets Content-Encoding.
+        """
+        self.child_sink.ch_compression = get_codec("gzip")
+        self.child_sink._send_clickhouse_request = (  # pylint: disable=protected-access
+            Mock()
+        )
+
+        self.child_sink.send_item({"dump_id": 1, "time_last_dumped": "foo"})
+
+        request = self.child_sink._send_clickhouse_request.call_args.args[  # pylint: disable=protected-access
+            0
+        ]
+        self.assertEqual(request.headers, {"Content-Encoding": "gzip"})
+        self.assertEqual(gzip.decompress(request.data), b'1,"foo"\r\n')
+
+    @ddt.data(
+        ({}, {}, None),
+        ({"compression": "gzip"}, {}, "gzip"),
+        ({"compression": "gzip"}, {"compression": None}, None),
+        ({}, {"compression": "zstd"}, "zstd"),
+    )
+    @ddt.unpack
+    def test_get_compression(self, backend_config, overrides, expected):
+        """
+        Test the precedence of the compression settings.
+        """
+        config = {**settings.EVENT_SINK_CLICKHOUSE_BACKEND_CONFIG, **backend_config}
+        with override_settings(EVENT_SINK_CLICKHOUSE_BACKEND_CONFIG=config):
+            sink = ChildSink(connection_overrides=overrides, log=logging.getLogger())
+            self.assertEqual(sink.get_compression(), expected)
+
+    @override_settings(EVENT_SINK_CLICKHOUSE_CHILD_MODEL_TABLE_COMPRESSION="lz4")
+    def test_get_compression_per_sink(self):
+        """
+        Test that the per table setting overrides the backend config.
+        """
+        sink = ChildSink(connection_overrides={}, log=logging.getLogger())
+
+        self.assertEqual(sink.ch_compression.name, "lz4")
+
+    @override_settings(
+        EVENT_SINK_CLICKHOUSE_CHILD_MODEL_TABLE_INSERT_FORMAT="RowBinary"
+    )
+    def test_send_items_row_binary(self):
+        """
+        Test that a RowBinary sink sends the column list and the binary body.
+        """
+        sink = ChildSink(connection_overrides={}, log=logging.getLogger())
+        sink._send_clickhouse_request = Mock()  # pylint: disable=protected-access
+
+        sink.send_item({"time_last_dumped": "x", "dump_id": 1})
+
+        request = sink._send_clickhouse_request.call_args.args[  # pylint: disable=protected-access
+            0
+        ]
+        self.assertEqual(
+            request.params["query"],
+            "INSERT INTO event_sink.child_model_table (`dump_id`, `time_last_dumped`) "
+            "FORMAT RowBinary",
+        )
+        self.assertEqual(request.data, b"\x01\x00\x00\x00\x01x")
+
+    @responses.activate
+    @patch.object(ChildSink, "clickhouse_schema", None)
+    def test_schema_described(self):
+        """
+        Test that a sink without a declared schema describes the table once.
+        """
+        reset_schemas()
+        self.addCleanup(reset_schemas)
+        responses.get(
+            "http://clickhouse:8123",
+            body=(
+                '{"name": "dump_id", "type": "UInt32", "default_type": ""}\n'
+                '{"name": "time_last_dumped", "type": "String", "default_type": ""}\n'
+                '{"name": "day", "type": "Date", "default_type": "MATERIALIZED"}\n'
+            ),
+            match=[
+                responses.matchers.query_param_matcher(
+                    {
+                        "query": "DESCRIBE TABLE event_sink.child_model_table "
+                        "FORMAT JSONEachRow"
+                    }
+                )
+            ],
+        )
+        insert = responses.post("http://clickhouse:8123")
+        sink = ChildSink(connection_overrides={}, log=logging.getLogger())
+
+        sink.send_item({"time_last_dumped": "x", "dump_id": 1})
+        sink.send_item({"time_last_dumped": "y", "dump_id": 2})
+
+        self.assertEqual(len(responses.calls), 3)
+        self.assertEqual(
+            insert.calls[1].request.params["query"],
+            "INSERT INTO event_sink.child_model_table (`dump_id`, `time_last_dumped`) "
+            "FORMAT CSV",
+        )
+        self.assertEqual(insert.calls[1].request.body, b'2,"y"\r\n')
+
+    @override_settings(
+        EVENT_SINK_CLICKHOUSE_CHILD_MODEL_TABLE_EXCLUDED_COLUMNS=["time_last_dumped"]
+    )
+    def test_excluded_columns(self):
+        """
+        Test that excluded columns are neither listed in the insert nor sent.
+        """
+        sink = ChildSink(connection_overrides={}, log=logging.getLogger())
+        sink._send_clickhouse_request = Mock()  # pylint: disable=protected-access
+
+        sink.send_item({"dump_id": 1, "time_last_dumped": "x"})
+
+        request = sink._send_clickhouse_request.call_args.args[  # pylint: disable=protected-access
+            0
+        ]
+        self.assertEqual(
+            request.params["query"],
+            "INSERT INTO event_sink.child_model_table (`dump_id`) FORMAT CSV",
+        )
+        self.assertEqual(request.data, b"1\r\n")
+
+    @ddt.data(
+        {"dump_id": 1},
+        {"dump_id": 1, "time_last_dumped": "x", "extra": "y"},
+    )
+    def test_schema_mismatch(self, row):
+        """
+        Test that rows not matching the table columns are rejected before sending.
+        """
+        self.child_sink._send_clickhouse_request = (  # pylint: disable=protected-access
+            Mock()
+        )
+
+        with self.assertRaises(SchemaMismatchError):
+            self.child_sink.send_item(row)
+
+        self.child_sink._send_clickhouse_request.assert_not_called()  # pylint: disable=protected-access
+
     def test_init(self):
         # Mock the required fields
         connection_overrides = {}
@@ -202,11 +1210,75 @@ class TestModelBaseSink(TestCase):
         Test that fetch_target_items() returns the correct data.
         """
 
+    @ddt.data(
+        (range(1, 8), 3),
+        (range(1, 7), 3),
+        (["course-v1:b", "course-v1:c", "course-v1:a"], 2),
+        (range(1, 4), None),
+    )
+    @ddt.unpack
+    def test_fetch_target_items_keyset(self, pks, batch_size):
+        """
+        Test that items are fetched in pk order by seeking past the previous page.
+        """
+        queryset = MockSet(*[MockModel(mock_name=str(pk), pk=pk) for pk in pks])
+        self.child_sink.get_queryset = Mock(return_value=queryset)
+
+        with patch.object(
+            MockSet, "count", side_effect=AssertionError("COUNT(*) was run")
+        ):
+            items = list(
+                self.child_sink.fetch_target_items(
+                    force_dump=True, batch_size=batch_size
+                )
+            )
+
+        self.assertEqual([item.pk for item, _, _ in items], sorted(pks))
+        self.assertTrue(all(should_dump for _, should_dump, _ in items))
+
     def test_get_last_dumped_timestamp(self):
         """
         Test that get_last_dumped_timestamp() returns the correct data.
         """
 
+    def test_fetch_target_items_should_dump_per_page(self):
+        """
+        Test that non-forced dumps decide which items to dump a page at a time.
+        """
+        self.child_sink._nested_sinks[  # pylint: disable=protected-access
+            0
+        ].reset_mock()
+        queryset = MockSet(*[MockModel(mock_name=str(pk), pk=pk) for pk in range(5)])
+        self.child_sink.get_queryset = Mock(return_value=queryset)
+        self.child_sink.should_dump_items = Mock(
+            side_effect=lambda page: [(item.pk % 2 == 0, "Even") for item in page]
+        )
+
+        items = list(self.child_sink.fetch_target_items(batch_size=2))
+
+        self.assertEqual(
+            [(item.pk, should_dump) for item, should_dump, _ in items],
+            [(0, True), (1, False), (2, True), (3, False), (4, True)],
+        )
+        self.assertEqual(
+            [
+                [item.pk for item in call.args[0]]
+                for call in self.child_sink.should_dump_items.call_args_list
+            ],
+            [[0, 1], [2, 3], [4]],
+        )
+        # Nested sinks look up what they need for the items of each page to dump
+        nested_sink = self.child_sink._nested_sinks[  # pylint: disable=protected-access
+            0
+        ]
+        self.assertEqual(
+            [
+                [item.pk for item in call.args[0]]
+                for call in nested_sink.prefetch_related.call_args_list
+            ],
+            [[0], [2], [4]],
+        )
+
     @override_settings(
         EVENT_SINK_CLICKHOUSE_MODEL_CONFIG={
             "child_model": {
@@ -261,6 +1333,10 @@ class TestModelBaseSink(TestCase):
         Test that should_dump_item() returns the correct data.
         """
         self.assertEqual(self.child_sink.should_dump_item(1), (True, "No reason"))
+        self.assertEqual(
+            self.child_sink.should_dump_items([1, 2]),
+            [(True, "No reason"), (True, "No reason")],
+        )
 
     @patch("platform_plugin_aspects.sinks.base_sink.WaffleFlag.is_enabled")
     def test_is_not_enabled_waffle(self, mock_waffle_flag_is_enabled):
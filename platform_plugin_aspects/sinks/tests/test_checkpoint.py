@@ -0,0 +1,94 @@
+"""
+Tests for the bulk dump checkpoints.
+"""
+
+import os
+import tempfile
+from unittest.mock import patch
+
+from django.test import TestCase
+
+from platform_plugin_aspects.sinks.checkpoint import (
+    CheckpointStore,
+    get_checkpoint_store,
+)
+
+
+class TestCheckpointStore(TestCase):
+    """
+    Tests for CheckpointStore and RangeCheckpoint.
+    """
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(tmp_dir.cleanup)
+        self.checkpoint_dir = os.path.join(tmp_dir.name, "checkpoints")
+        self.store = CheckpointStore(self.checkpoint_dir, checkpoint_interval_secs=60)
+
+    def test_get_checkpoint_store(self):
+        """
+        Test that checkpoints are disabled without a checkpoint directory.
+        """
+        self.assertIsNone(get_checkpoint_store({"url": "http://clickhouse:8123"}))
+        store = get_checkpoint_store(
+            {"checkpoint_dir": "/tmp/a"}, {"checkpoint_interval_secs": 5}
+        )
+        self.assertEqual(store.checkpoint_dir, "/tmp/a")
+        self.assertEqual(store.interval_secs, 5)
+
+    def test_run_key(self):
+        """
+        Test that the run key only depends on the selection options.
+        """
+        self.assertEqual(
+            CheckpointStore.get_run_key(model="a", ids=["1"]),
+            CheckpointStore.get_run_key(ids=["1"], model="a"),
+        )
+        self.assertNotEqual(
+            CheckpointStore.get_run_key(model="a", ids=["1"]),
+            CheckpointStore.get_run_key(model="a", ids=["2"]),
+        )
+
+    def test_save_and_load(self):
+        """
+        Test that the progress of each range is saved and loaded back in order.
+        """
+        checkpoints = self.store.start(
+            "user_profile", "run", [(None, 10), (10, 20), (20, None)]
+        )
+        checkpoints[2].advance(25, 3)
+        checkpoints[2].save()
+        checkpoints[0].finish()
+
+        loaded = self.store.load("user_profile", "run")
+
+        self.assertEqual(
+            [(c.resume_pk, c.end_pk, c.dumped, c.done) for c in loaded],
+            [(None, 10, 0, True), (10, 20, 0, False), (25, None, 3, False)],
+        )
+        self.assertEqual(self.store.load("user_profile", "other"), [])
+
+    def test_start_replaces_run(self):
+        """
+        Test that starting a run again forgets its previous checkpoints.
+        """
+        self.store.start("user_profile", "run", [(None, 10), (10, None)])
+
+        self.store.start("user_profile", "run", [(None, None)])
+
+        self.assertEqual(len(self.store.load("user_profile", "run")), 1)
+        self.store.clear("user_profile", "run")
+        self.assertEqual(os.listdir(self.checkpoint_dir), [])
+
+    @patch("platform_plugin_aspects.sinks.checkpoint.time.monotonic")
+    def test_is_due(self, mock_monotonic):
+        """
+        Test that checkpoints are only due once the interval has passed.
+        """
+        mock_monotonic.return_value = 100
+        (checkpoint,) = self.store.start("user_profile", "run", [(None, None)])
+
+        mock_monotonic.return_value = 159
+        self.assertFalse(checkpoint.is_due())
+        mock_monotonic.return_value = 160
+        self.assertTrue(checkpoint.is_due())
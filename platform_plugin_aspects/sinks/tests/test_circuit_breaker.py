@@ -0,0 +1,156 @@
+"""
+Tests for the ClickHouse circuit breaker.
+"""
+
+from unittest.mock import patch
+
+from django.test import TestCase
+
+from platform_plugin_aspects.sinks.circuit_breaker import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    CircuitOpenError,
+    get_circuit_breaker,
+    reset_circuit_breakers,
+)
+
+
+@patch("platform_plugin_aspects.sinks.circuit_breaker.time.monotonic")
+class TestCircuitBreaker(TestCase):
+    """
+    Tests for CircuitBreaker.
+    """
+
+    def setUp(self):
+        self.breaker = CircuitBreaker(
+            "http://clickhouse:8123",
+            breaker_error_rate=0.5,
+            breaker_slow_request_secs=5,
+            breaker_window_size=4,
+            breaker_min_requests=4,
+            breaker_open_secs=30,
+        )
+
+    def test_opens_on_error_rate(self, mock_monotonic):
+        """
+        Test that the breaker only opens once enough requests failed.
+        """
+        mock_monotonic.return_value = 100
+        self.breaker.record_success(0.1)
+        self.breaker.record_failure()
+        self.breaker.record_success(0.1)
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.breaker.before_request()
+
+        with self.assertLogs("platform_plugin_aspects.sinks.circuit_breaker") as logs:
+            self.breaker.record_failure()
+
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertIn("closed -> open", logs.output[0])
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_request()
+
+    def test_slow_requests_count_as_failures(self, mock_monotonic):
+        """
+        Test that requests over the latency threshold open the breaker.
+        """
+        mock_monotonic.return_value = 100
+        for _ in range(4):
+            self.breaker.record_success(6)
+
+        self.assertEqual(self.breaker.state, OPEN)
+
+    def test_half_open_probe_succeeds(self, mock_monotonic):
+        """
+        Test that a single probe is let through after the cool-down and closes it.
+        """
+        mock_monotonic.return_value = 100
+        for _ in range(4):
+            self.breaker.record_failure()
+
+        mock_monotonic.return_value = 131
+        self.breaker.before_request()
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_request()
+
+        self.breaker.record_success(0.1)
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.breaker.before_request()
+
+    def test_half_open_probe_fails(self, mock_monotonic):
+        """
+        Test that a failed probe opens the breaker for another cool-down.
+        """
+        mock_monotonic.return_value = 100
+        for _ in range(4):
+            self.breaker.record_failure()
+
+        mock_monotonic.return_value = 131
+        self.breaker.before_request()
+        self.breaker.record_failure()
+
+        self.assertEqual(self.breaker.state, OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_request()
+
+    def test_lost_probe_expires(self, mock_monotonic):
+        """
+        Test that another probe is allowed if the first one never reported back.
+        """
+        mock_monotonic.return_value = 100
+        for _ in range(4):
+            self.breaker.record_failure()
+
+        mock_monotonic.return_value = 131
+        self.breaker.before_request()
+        mock_monotonic.return_value = 162
+        self.breaker.before_request()
+
+    def test_get_circuit_breaker(self, _mock_monotonic):
+        """
+        Test that breakers are shared per URLs and settings, and can be disabled.
+        """
+        reset_circuit_breakers()
+        self.addCleanup(reset_circuit_breakers)
+        urls = ["http://clickhouse:8123"]
+
+        config = {"breaker_enabled": True, "breaker_open_secs": 5}
+
+        breaker = get_circuit_breaker(urls, config)
+
+        self.assertEqual(breaker.open_secs, 5)
+        self.assertIsNone(breaker.slow_request_secs)
+        self.assertIs(get_circuit_breaker(urls, dict(config)), breaker)
+        self.assertIsNot(get_circuit_breaker(urls, {"breaker_enabled": True}), breaker)
+        self.assertIsNone(get_circuit_breaker(urls))
+        self.assertIsNone(get_circuit_breaker(urls, {"breaker_enabled": False}))
+
+    def test_slow_requests_ignored_by_default(self, _mock_monotonic):
+        """
+        Test that long requests don't open a breaker without a latency threshold.
+        """
+        breaker = CircuitBreaker("http://clickhouse:8123", breaker_min_requests=1)
+
+        for _ in range(5):
+            breaker.record_success(600)
+
+        self.assertEqual(breaker.state, CLOSED)
+
+    def test_invalid_config(self, _mock_monotonic):
+        """
+        Test that settings the breaker can't work with are rejected.
+        """
+        for config in (
+            {"breaker_half_open_probes": 0},
+            {"breaker_window_size": 0},
+            {"breaker_min_requests": 0},
+            {"breaker_error_rate": 0},
+            {"breaker_error_rate": 1.5},
+        ):
+            with self.assertRaises(ValueError):
+                get_circuit_breaker(
+                    ["http://clickhouse:8123"], dict(config, breaker_enabled=True)
+                )
@@ -0,0 +1,90 @@
+"""
+Tests for the ClickHouse request body compression codecs.
+"""
+
+import gzip
+from unittest.mock import patch
+
+import ddt
+import lz4.frame
+import zstandard
+from django.test import TestCase
+
+from platform_plugin_aspects.sinks import compression
+
+DECOMPRESSORS = {
+    "gzip": gzip.decompress,
+    "zstd": lambda data: zstandard.ZstdDecompressor().decompressobj().decompress(data),
+    "lz4": lz4.frame.decompress,
+}
+
+
+@ddt.ddt
+class TestCompression(TestCase):
+    """
+    Tests for the compression codecs.
+    """
+
+    @ddt.data("gzip", "zstd", "lz4")
+    def test_round_trip(self, name):
+        """
+        Test that every codec produces a body its library can decompress.
+        """
+        codec = compression.get_codec(name)
+        data = b'1,"course-v1:edX+DemoX+Demo_Course","audit"\r\n' * 1000
+
+        compressed = codec.compress(data)
+
+        self.assertLess(len(compressed), len(data))
+        self.assertEqual(DECOMPRESSORS[name](compressed), data)
+        self.assertEqual(codec.decompress(compressed), data)
+
+    @ddt.data("gzip", "zstd", "lz4")
+    def test_streaming(self, name):
+        """
+        Test that streaming chunks through compressobj matches the data.
+        """
+        compressor = compression.get_codec(name).compressobj()
+        chunks = [b"a,b,c\r\n" * 10, b"", b"d,e,f\r\n" * 10]
+
+        compressed = b"".join(compressor.compress(chunk) for chunk in chunks)
+        compressed += compressor.flush()
+
+        self.assertEqual(DECOMPRESSORS[name](compressed), b"".join(chunks))
+
+    @ddt.data("gzip", "zstd", "lz4")
+    def test_decompress_frames(self, name):
+        """
+        Test that every frame of concatenated bodies is decompressed.
+        """
+        codec = compression.get_codec(name)
+
+        compressed = codec.compress(b"1\r\n") + codec.compress(b"2\r\n")
+
+        self.assertEqual(codec.decompress(compressed), b"1\r\n2\r\n")
+
+    @ddt.data(None, "")
+    def test_no_compression(self, name):
+        """
+        Test that an empty codec name disables compression.
+        """
+        self.assertIsNone(compression.get_codec(name))
+
+    def test_unknown_codec(self):
+        """
+        Test that an unknown codec raises.
+        """
+        with self.assertRaises(ValueError):
+            compression.get_codec("snappy")
+
+    @patch("platform_plugin_aspects.sinks.compression.zstandard", None)
+    def test_unavailable_codec(self):
+        """
+        Test that a codec without its library raises and is not listed.
+        """
+        with self.assertRaises(ValueError):
+            compression.get_codec("zstd")
+
+        self.assertNotIn(
+            "zstd", [codec.name for codec in compression.get_available_codecs()]
+        )
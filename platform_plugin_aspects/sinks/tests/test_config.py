@@ -0,0 +1,24 @@
+"""
+Tests for the sink settings helpers.
+"""
+
+from django.test import TestCase
+
+from platform_plugin_aspects.sinks.config import get_config
+
+
+class TestGetConfig(TestCase):
+    """
+    Tests for get_config.
+    """
+
+    def test_get_config(self):
+        """
+        Test that later configs override earlier ones and defaults fill the rest.
+        """
+        defaults = {"a": 1, "b": 2, "c": 3}
+
+        config = get_config(defaults, {"a": 10, "b": 20, "other": 0}, None, {"b": 200})
+
+        self.assertEqual(config, {"a": 10, "b": 200, "c": 3})
+        self.assertEqual(defaults, {"a": 1, "b": 2, "c": 3})
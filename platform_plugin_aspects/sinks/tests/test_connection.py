@@ -0,0 +1,97 @@
+"""
+Tests for the shared ClickHouse connection pool.
+"""
+
+import socket
+from unittest.mock import patch
+
+from django.test import TestCase
+
+from platform_plugin_aspects.sinks import connection
+
+
+class TestClickHouseSession(TestCase):
+    """
+    Tests for get_clickhouse_session and friends.
+    """
+
+    def setUp(self):
+        connection.reset_clickhouse_sessions()
+        self.addCleanup(connection.reset_clickhouse_sessions)
+
+    def test_get_pool_config(self):
+        """
+        Test that later configs override earlier ones and unknown keys are ignored.
+        """
+        pool_config = connection.get_pool_config(
+            {"url": "http://clickhouse:8123", "pool_maxsize": 20},
+            None,
+            {"pool_maxsize": 30, "pool_block": True},
+        )
+
+        self.assertEqual(pool_config["pool_maxsize"], 30)
+        self.assertTrue(pool_config["pool_block"])
+        self.assertEqual(
+            pool_config["pool_connections"],
+            connection.POOL_CONFIG_DEFAULTS["pool_connections"],
+        )
+        self.assertNotIn("url", pool_config)
+
+    def test_session_is_shared(self):
+        """
+        Test that the same pool configuration always returns the same session.
+        """
+        session = connection.get_clickhouse_session({"pool_maxsize": 5})
+
+        self.assertIs(session, connection.get_clickhouse_session({"pool_maxsize": 5}))
+        self.assertIsNot(session, connection.get_clickhouse_session())
+
+        adapter = session.get_adapter("https://clickhouse:8443")
+        self.assertIsInstance(adapter, connection.ClickHouseHTTPAdapter)
+        self.assertEqual(adapter._pool_maxsize, 5)  # pylint: disable=protected-access
+
+    def test_tcp_keepalive(self):
+        """
+        Test that keep-alive socket options are only set when enabled.
+        """
+        keepalive = (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+        adapter = connection.ClickHouseHTTPAdapter(tcp_keepalive=True)
+        self.assertIn(
+            keepalive, adapter.poolmanager.connection_pool_kw["socket_options"]
+        )
+
+        adapter = connection.ClickHouseHTTPAdapter(tcp_keepalive=False)
+        self.assertNotIn("socket_options", adapter.poolmanager.connection_pool_kw)
+
+    def test_session_rebuilt_after_fork(self):
+        """
+        Test that a child process never reuses the parent's session.
+        """
+        session = connection.get_clickhouse_session()
+
+        with patch("platform_plugin_aspects.sinks.connection.os.getpid") as getpid:
+            getpid.return_value = -1
+            self.assertIsNot(session, connection.get_clickhouse_session())
+
+    def test_worker_process_init(self):
+        """
+        Test that the Celery worker_process_init handler drops inherited sessions.
+        """
+        session = connection.get_clickhouse_session()
+
+        connection.worker_process_init.send(sender=None)
+
+        self.assertIsNot(session, connection.get_clickhouse_session())
+
+    def test_reset_closes_sessions(self):
+        """
+        Test that reset_clickhouse_sessions closes the pooled sessions.
+        """
+        session = connection.get_clickhouse_session()
+
+        with patch.object(session, "close") as mock_close:
+            connection.reset_clickhouse_sessions()
+
+        mock_close.assert_called_once()
+        self.assertIsNot(session, connection.get_clickhouse_session())
@@ -5,6 +5,7 @@ Test the course enrollment sink module.
 from unittest.mock import patch
 
 from platform_plugin_aspects.sinks import CourseEnrollmentSink
+from platform_plugin_aspects.sinks.serializers import CourseEnrollmentSerializer
 
 
 @patch("platform_plugin_aspects.sinks.ModelBaseSink.get_queryset")
@@ -18,3 +19,15 @@ def test_get_queryset(mock_get_queryset):
 
     mock_get_queryset.assert_called_once_with(None)
     mock_get_queryset.return_value.select_related.assert_called_once_with("user")
+
+
+def test_projection_matches_serializer():
+    """
+    Test that the bulk projection covers the same columns as the serializer.
+    """
+    assert set(CourseEnrollmentSink.projection) == set(
+        CourseEnrollmentSerializer.Meta.fields
+    ) - {
+        "dump_id",
+        "time_last_dumped",
+    }
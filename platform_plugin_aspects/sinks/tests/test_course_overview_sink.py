@@ -11,20 +11,26 @@ import pytest
 import requests
 import responses
 from django.test.utils import override_settings
+from opaque_keys.edx.keys import CourseKey
 from responses import matchers
 from responses.registries import OrderedRegistry
 
 from platform_plugin_aspects.sinks import CourseOverviewSink, XBlockSink
+from platform_plugin_aspects.sinks.schema import reset_schemas
 from platform_plugin_aspects.tasks import dump_course_to_clickhouse
 from test_utils.helpers import (
+    COURSE_BLOCK_COLUMNS,
+    COURSE_OVERVIEW_COLUMNS,
     check_block_csv_matcher,
     check_overview_csv_matcher,
     course_factory,
     course_str_factory,
+    describe_table_body,
     detached_xblock_factory,
     fake_course_overview_factory,
     fake_serialize_fake_course_overview,
     get_all_course_blocks_list,
+    get_clickhouse_describe_params,
     get_clickhouse_http_params,
     mock_detached_xblock_types,
 )
@@ -35,7 +41,7 @@ from test_utils.helpers import (
 )
 @override_settings(EVENT_SINK_CLICKHOUSE_COURSE_OVERVIEW_ENABLED=True)
 @patch("platform_plugin_aspects.sinks.base_sink.get_model")
-@patch("platform_plugin_aspects.sinks.course_overview_sink.get_tags_for_block")
+@patch("platform_plugin_aspects.sinks.course_overview_sink.get_tags_for_blocks")
 @patch("platform_plugin_aspects.sinks.CourseOverviewSink.serialize_item")
 @patch("platform_plugin_aspects.sinks.CourseOverviewSink.get_model")
 @patch("platform_plugin_aspects.sinks.course_overview_sink.get_detached_xblock_types")
@@ -70,14 +76,24 @@ def test_course_publish_success(
     mock_overview.return_value.get_from_id.return_value = course_overview
     mock_get_ccx_courses.return_value = []
 
-    # Fake the "get_tags_for_block" api since we can't import it here
+    # Fake the "get_tags_for_blocks" api since we can't import it here
     mock_get_tags.return_value = {}
 
     # Use the responses library to catch the POSTs to ClickHouse
     # and match them against the expected values, including CSV
     # content
     course_overview_params, blocks_params = get_clickhouse_http_params()
+    reset_schemas()
 
+    responses.get(
+        "https://foo.bar/",
+        body=describe_table_body(COURSE_OVERVIEW_COLUMNS),
+        match=[
+            matchers.query_param_matcher(
+                get_clickhouse_describe_params("course_overviews")
+            )
+        ],
+    )
     responses.post(
         "https://foo.bar/",
         match=[
@@ -85,6 +101,15 @@ def test_course_publish_success(
             check_overview_csv_matcher(course_overview),
         ],
     )
+    responses.get(
+        "https://foo.bar/",
+        body=describe_table_body(COURSE_BLOCK_COLUMNS),
+        match=[
+            matchers.query_param_matcher(
+                get_clickhouse_describe_params("course_blocks")
+            )
+        ],
+    )
     responses.post(
         "https://foo.bar/",
         match=[
@@ -99,12 +124,14 @@ def test_course_publish_success(
     dump_course_to_clickhouse(course_key)
 
     # Just to make sure we're not calling things more than we need to
-    assert mock_modulestore.call_count == 1
+    # Once for the structure version, once to serialize the blocks
+    assert mock_modulestore.call_count == 2
     assert mock_modulestore.return_value.get_course.call_count == 1
     assert mock_modulestore.return_value.get_items.call_count == 1
     assert mock_detached.call_count == 1
     mock_get_ccx_courses.assert_called_once_with(course_overview.id)
-    assert mock_get_tags.call_count == len(
+    mock_get_tags.assert_called_once()
+    assert len(mock_get_tags.call_args.args[0]) == len(
         get_all_course_blocks_list(course, detached_blocks)
     )
 
@@ -141,6 +168,8 @@ def test_course_publish_clickhouse_error(
     )
 
     # This will raise an exception when we try to post to ClickHouse
+    reset_schemas()
+    responses.get("https://foo.bar/", body=describe_table_body(COURSE_OVERVIEW_COLUMNS))
     responses.post("https://foo.bar/", body="Test Bad Request error", status=400)
 
     course = course_str_factory()
@@ -256,6 +285,51 @@ def test_should_dump_item_no_needs_dump():
     assert "Course has NOT been published since last dump time - " in reason
 
 
+@responses.activate(  # pylint: disable=unexpected-keyword-arg,no-value-for-parameter
+    registry=OrderedRegistry
+)
+def test_should_dump_items():
+    """
+    Test that a page of courses is checked against ClickHouse with a single query.
+    """
+    modified = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f+00:00")
+    published, unchanged, new = [
+        fake_course_overview_factory(modified=modified)._replace(
+            id=CourseKey.from_string(course_str_factory(course_id))
+        )
+        for course_id in ("published", "unchanged", "new")
+    ]
+
+    lookup = responses.get(
+        "https://foo.bar/",
+        body=(
+            f"{published.id}\t2023-05-03 15:47:39.331024+00:00\n"
+            f"{unchanged.id}\t{modified}\n"
+        ),
+    )
+
+    sink = CourseOverviewSink(connection_overrides={}, log=logging.getLogger())
+    results = sink.should_dump_items([published, unchanged, new])
+
+    assert [should_dump for should_dump, _ in results] == [True, False, True]
+    assert "Course has been published since last dump time - " in results[0][1]
+    assert "Course has NOT been published since last dump time - " in results[1][1]
+    assert results[2][1] == "Course is not present in ClickHouse"
+
+    assert lookup.call_count == 1
+    query = lookup.calls[0].request.params["query"]
+    assert "GROUP BY course_key" in query
+    assert f"IN ('{published.id}', '{unchanged.id}', '{new.id}')" in query
+
+
+def test_should_dump_items_empty_page():
+    """
+    Test that an empty page doesn't query ClickHouse.
+    """
+    sink = CourseOverviewSink(connection_overrides={}, log=logging.getLogger())
+    assert not sink.get_last_dumped_timestamps([])
+
+
 @responses.activate(  # pylint: disable=unexpected-keyword-arg,no-value-for-parameter
     registry=OrderedRegistry
 )
@@ -295,7 +369,7 @@ def test_get_last_dump_time():
     assert dt
 
 
-@patch("platform_plugin_aspects.sinks.course_overview_sink.get_tags_for_block")
+@patch("platform_plugin_aspects.sinks.course_overview_sink.get_tags_for_blocks")
 @patch("platform_plugin_aspects.sinks.course_overview_sink.get_detached_xblock_types")
 @patch("platform_plugin_aspects.sinks.course_overview_sink.get_modulestore")
 # pytest:disable=unused-argument
@@ -315,13 +389,15 @@ def test_xblock_tree_structure(mock_modulestore, mock_detached, mock_get_tags):
         course_overview
     )
 
-    # Fake the "get_tags_for_course" api since we can't import it here
+    # Fake the "get_tags_for_blocks" api since we can't import it here
     mock_get_tags.return_value = {}
 
     sink = XBlockSink(connection_overrides={}, log=MagicMock())
 
     initial_data = {"dump_id": "xyz", "time_last_dumped": "2023-09-05"}
-    results = sink.serialize_item(fake_serialized_course_overview, initial=initial_data)
+    results = list(
+        sink.serialize_item(fake_serialized_course_overview, initial=initial_data)
+    )
 
     def _check_tree_location(
         block, expected_section=0, expected_subsection=0, expected_unit=0
@@ -360,7 +436,7 @@ def test_xblock_tree_structure(mock_modulestore, mock_detached, mock_get_tags):
     _check_tree_location(results[27], 3, 3, 3)
 
 
-@patch("platform_plugin_aspects.sinks.course_overview_sink.get_tags_for_block")
+@patch("platform_plugin_aspects.sinks.course_overview_sink.get_tags_for_blocks")
 @patch("platform_plugin_aspects.sinks.course_overview_sink.get_detached_xblock_types")
 @patch("platform_plugin_aspects.sinks.course_overview_sink.get_modulestore")
 def test_xblock_graded_completable_mode(mock_modulestore, mock_detached, mock_get_tags):
@@ -376,7 +452,9 @@ def test_xblock_graded_completable_mode(mock_modulestore, mock_detached, mock_ge
     mock_detached.return_value = mock_detached_xblock_types()
 
     expected_tags = ["TAX1=tag1", "TAX1=tag2", "TAX1=tag3"]
-    mock_get_tags.return_value = expected_tags
+    mock_get_tags.side_effect = lambda usage_keys: {
+        str(usage_key): expected_tags for usage_key in usage_keys
+    }
 
     fake_serialized_course_overview = fake_serialize_fake_course_overview(
         course_overview
@@ -384,7 +462,9 @@ def test_xblock_graded_completable_mode(mock_modulestore, mock_detached, mock_ge
     sink = XBlockSink(connection_overrides={}, log=MagicMock())
 
     initial_data = {"dump_id": "xyz", "time_last_dumped": "2023-09-05"}
-    results = sink.serialize_item(fake_serialized_course_overview, initial=initial_data)
+    results = list(
+        sink.serialize_item(fake_serialized_course_overview, initial=initial_data)
+    )
 
     def _check_item_serialized_location(
         block,
@@ -413,3 +493,196 @@ def test_xblock_graded_completable_mode(mock_modulestore, mock_detached, mock_ge
     _check_item_serialized_location(results[31], 0, "completable")
     _check_item_serialized_location(results[32], 0, "aggregator")
     _check_item_serialized_location(results[33], 0, "excluded")
+
+
+def test_get_course_xblocks():
+    """
+    Test that the course tree comes in order, followed by the detached blocks only.
+    """
+    course = course_factory()
+    detached_blocks = detached_xblock_factory()
+    modulestore = MagicMock()
+    modulestore.get_course.return_value = course
+    # Some modulestores could return more than the detached types asked for
+    modulestore.get_items.return_value = (
+        detached_blocks + course.get_children()[:1] + [course]
+    )
+    detached_types = mock_detached_xblock_types()
+    course_key = CourseKey.from_string(course_str_factory())
+
+    sink = XBlockSink(connection_overrides={}, log=MagicMock())
+    xblocks = list(sink.get_course_xblocks(modulestore, course_key, detached_types))
+
+    assert xblocks == get_all_course_blocks_list(course, detached_blocks)
+    modulestore.bulk_operations.assert_called_once_with(course_key)
+    modulestore.get_course.assert_called_once_with(
+        course_key, depth=None, revision="rev-opt-published-only"
+    )
+    modulestore.get_items.assert_called_once_with(
+        course_key,
+        revision="rev-opt-published-only",
+        qualifiers={"category": {"$in": sorted(detached_types)}},
+    )
+
+
+@patch("platform_plugin_aspects.sinks.course_overview_sink.TAGS_LOOKUP_CHUNK_SIZE", 10)
+@patch("platform_plugin_aspects.sinks.course_overview_sink.get_tags_for_blocks")
+@patch("platform_plugin_aspects.sinks.course_overview_sink.get_detached_xblock_types")
+@patch("platform_plugin_aspects.sinks.course_overview_sink.get_modulestore")
+def test_xblock_serialization_streamed(mock_modulestore, mock_detached, mock_get_tags):
+    """
+    Test that blocks are serialized lazily, looking up tags one chunk at a time.
+    """
+    course = course_factory()
+    detached_blocks = detached_xblock_factory()
+    mock_modulestore.return_value.get_course.return_value = course
+    mock_modulestore.return_value.get_items.return_value = detached_blocks
+    mock_detached.return_value = mock_detached_xblock_types()
+    mock_get_tags.side_effect = lambda usage_keys: {
+        usage_key: [len(usage_keys)] for usage_key in usage_keys
+    }
+    all_blocks = get_all_course_blocks_list(course, detached_blocks)
+
+    sink = XBlockSink(connection_overrides={}, log=MagicMock())
+    rows = sink.iter_serialize_items(
+        {"course_key": course_str_factory()},
+        initial={"dump_id": "xyz", "time_last_dumped": "2023-09-05"},
+    )
+
+    # Nothing is read until the first row is needed
+    mock_modulestore.return_value.get_course.assert_not_called()
+    first_row = next(rows)
+    assert first_row["order"] == 1
+    assert mock_get_tags.call_count == 1
+
+    rows = [first_row, *rows]
+    assert [row["location"] for row in rows] == [
+        str(block.location) for block in all_blocks
+    ]
+    assert [row["order"] for row in rows] == list(range(1, len(all_blocks) + 1))
+    assert mock_get_tags.call_count == (len(all_blocks) + 9) // 10
+    assert json.loads(rows[-1]["xblock_data_json"])["tags"] == [len(all_blocks) % 10]
+
+
+@responses.activate(  # pylint: disable=unexpected-keyword-arg,no-value-for-parameter
+    registry=OrderedRegistry
+)
+@patch("platform_plugin_aspects.sinks.course_overview_sink.get_tags_for_blocks")
+@patch("platform_plugin_aspects.sinks.course_overview_sink.get_detached_xblock_types")
+@patch("platform_plugin_aspects.sinks.course_overview_sink.get_modulestore")
+@patch(
+    "platform_plugin_aspects.sinks.course_overview_sink.get_published_course_structure"
+)
+def test_dump_related_skips_dumped_structure(
+    mock_get_structure, mock_modulestore, mock_detached, mock_get_tags
+):
+    """
+    Test that blocks are only dumped again when the published structure changed.
+    """
+    course_key = course_str_factory()
+    mock_get_structure.side_effect = lambda _modulestore, _course_key: {
+        "_id": "version-1",
+        "root": None,
+        "blocks": {},
+    }
+    mock_detached.return_value = mock_detached_xblock_types()
+    mock_get_tags.return_value = {}
+    sink = XBlockSink(connection_overrides={}, log=MagicMock())
+    sink.dump = MagicMock()
+
+    # The last dumped blocks have the same structure version
+    responses.get("https://foo.bar/", body=f"{course_key}\tversion-1\n")
+    sink.dump_related({"course_key": course_key}, "xyz", "2023-09-05")
+    sink.dump.assert_not_called()
+    assert "structure_version" in responses.calls[0].request.params["query"]
+
+    # They have another one
+    responses.get("https://foo.bar/", body=f"{course_key}\tversion-0\n")
+    sink.dump_related({"course_key": course_key}, "xyz", "2023-09-05")
+    sink.dump.assert_called_once_with(
+        {"course_key": course_key},
+        many=True,
+        initial={
+            "dump_id": "xyz",
+            "time_last_dumped": "2023-09-05",
+            "structure_version": "version-1",
+        },
+    )
+
+    # Forced dumps don't look the last structure version up
+    sink.use_force_dump(True)
+    sink.dump_related({"course_key": course_key}, "xyz", "2023-09-05")
+    assert sink.dump.call_count == 2
+    assert len(responses.calls) == 2
+
+    # The last dumped versions of a page of courses are looked up at once
+    sink.use_force_dump(False)
+    other_course_key = course_str_factory("other")
+    responses.get("https://foo.bar/", body=f"{course_key}\tversion-1\n")
+    sink.prefetch_related(
+        [
+            fake_course_overview_factory(modified=None)._replace(
+                id=CourseKey.from_string(key)
+            )
+            for key in (course_key, other_course_key)
+        ]
+    )
+    assert len(responses.calls) == 3
+    assert other_course_key in responses.calls[2].request.params["query"]
+    sink.dump_related({"course_key": course_key}, "xyz", "2023-09-05")
+    sink.dump_related({"course_key": other_course_key}, "xyz", "2023-09-05")
+    assert sink.dump.call_count == 3
+    assert len(responses.calls) == 3
+
+    # The structure version is recorded with every block
+    mock_get_structure.side_effect = None
+    mock_get_structure.return_value = None
+    mock_modulestore.return_value.get_course.return_value = course_factory()
+    rows = list(
+        XBlockSink(connection_overrides={}, log=MagicMock()).serialize_item(
+            {"course_key": course_key},
+            initial={
+                "dump_id": "xyz",
+                "time_last_dumped": "2023-09-05",
+                "structure_version": "version-1",
+            },
+        )
+    )
+    assert rows
+    assert all(
+        json.loads(row["xblock_data_json"])["structure_version"] == "version-1"
+        for row in rows
+    )
+
+
+@responses.activate(  # pylint: disable=unexpected-keyword-arg,no-value-for-parameter
+    registry=OrderedRegistry
+)
+@patch("platform_plugin_aspects.sinks.course_overview_sink.get_tags_for_blocks")
+@patch("platform_plugin_aspects.sinks.course_overview_sink.get_detached_xblock_types")
+@patch("platform_plugin_aspects.sinks.course_overview_sink.get_modulestore")
+@patch(
+    "platform_plugin_aspects.sinks.course_overview_sink.get_published_course_structure"
+)
+def test_dump_related_reads_structure_once(
+    mock_get_structure, mock_modulestore, mock_detached, mock_get_tags
+):
+    """
+    Test that the structure read to check its version is the one blocks are read from.
+    """
+    course_key = course_str_factory()
+    mock_get_structure.return_value = {"_id": "version-2", "root": None, "blocks": {}}
+    mock_detached.return_value = mock_detached_xblock_types()
+    mock_get_tags.return_value = {}
+    sink = XBlockSink(connection_overrides={}, log=MagicMock())
+    sink.send_item_and_log = MagicMock(
+        side_effect=lambda _item_id, serialized_item, _many: list(serialized_item)
+    )
+
+    responses.get("https://foo.bar/", body=f"{course_key}\tversion-1\n")
+    sink.dump_related({"course_key": course_key}, "xyz", "2023-09-05")
+
+    sink.send_item_and_log.assert_called_once()
+    mock_get_structure.assert_called_once()
+    mock_modulestore.return_value.get_course.assert_not_called()
+    assert not sink._published_structures  # pylint: disable=protected-access
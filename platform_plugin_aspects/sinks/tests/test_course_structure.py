@@ -0,0 +1,263 @@
+"""
+Tests for the course structure reader.
+"""
+
+from collections import namedtuple
+from datetime import datetime
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+from django.test import TestCase
+from opaque_keys.edx.keys import CourseKey
+
+from platform_plugin_aspects.sinks import XBlockSink
+from platform_plugin_aspects.sinks.course_structure import CourseStructureReader
+from test_utils.helpers import (
+    FakeXBlock,
+    course_str_factory,
+    mock_detached_xblock_types,
+)
+
+# Same shape as the BlockKey of the split modulestore
+BlockKey = namedtuple("BlockKey", ["type", "id"])
+
+EDITED_ON = datetime(2024, 1, 2, 3, 4, 5)
+
+
+def block_data(children=(), **fields):
+    """
+    Return a fake BlockData of a split structure.
+    """
+    if children:
+        fields["children"] = list(children)
+    return SimpleNamespace(
+        fields=fields, edit_info=SimpleNamespace(edited_on=EDITED_ON)
+    )
+
+
+def fake_structure():
+    """
+    Return a fake split structure with a small tree, a detached block and an orphan.
+
+    The graded sequential is inherited by its descendants, except the html block,
+    which sets graded itself.
+    """
+    course = BlockKey("course", "course")
+    chapter = BlockKey("chapter", "chapter_1")
+    sequential = BlockKey("sequential", "sequential_1")
+    vertical = BlockKey("vertical", "vertical_1")
+    problem = BlockKey("problem", "problem_1")
+    html = BlockKey("html", "html_1")
+    about = BlockKey("about", "overview")
+    orphan = BlockKey("problem", "orphan")
+    missing = BlockKey("problem", "missing")
+
+    return {
+        "root": course,
+        "blocks": {
+            about: block_data(),
+            orphan: block_data(display_name="Orphan"),
+            html: block_data(graded=False),
+            problem: block_data(),
+            vertical: block_data([problem, html, missing], display_name="Unit"),
+            sequential: block_data([vertical], display_name="Sub", graded=True),
+            chapter: block_data([sequential], display_name="Section"),
+            course: block_data([chapter], display_name="Course"),
+        },
+    }
+
+
+class FakeProblemBlock:
+    """
+    Fakes the class attributes of an XBlock class that we care about.
+    """
+
+    fields = {
+        "display_name": SimpleNamespace(default="Blank Problem"),
+        "graded": SimpleNamespace(default=False),
+    }
+    completion_mode = "completable"
+
+
+def modulestore_block(course_key, block_type, block_id, display_name, **kwargs):
+    """
+    Return a fake XBlock at the given location, as the modulestore would build it.
+    """
+    block = FakeXBlock(block_id, block_type=block_type, **kwargs)
+    block.location = course_key.make_usage_key(block_type, block_id)
+    block.scope_ids.usage_id = block.location
+    block.display_name_with_default = display_name
+    block.edited_on = EDITED_ON
+    return block
+
+
+def fake_modulestore_course(course_key):
+    """
+    Return the XBlocks the modulestore builds for fake_structure().
+
+    That is its course block and its detached blocks, with the values of graded
+    inherited by the platform.
+    """
+    course = modulestore_block(course_key, "course", "course", "Course")
+    chapter = modulestore_block(course_key, "chapter", "chapter_1", "Section")
+    sequential = modulestore_block(
+        course_key, "sequential", "sequential_1", "Sub", graded=True
+    )
+    vertical = modulestore_block(
+        course_key, "vertical", "vertical_1", "Unit", graded=True
+    )
+    problem = modulestore_block(
+        course_key,
+        "problem",
+        "problem_1",
+        "Blank Problem",
+        graded=True,
+        completion_mode="completable",
+    )
+    html = modulestore_block(course_key, "html", "html_1", "html 1", completion_mode="")
+    about = modulestore_block(course_key, "about", "overview", "overview")
+
+    course.children = [chapter]
+    chapter.children = [sequential]
+    sequential.children = [vertical]
+    vertical.children = [problem, html]
+    for block in (course, chapter, sequential, vertical, about):
+        block.completion_mode = ""
+    return course, [about]
+
+
+def fake_get_xblock_class(block_type):
+    """
+    Return a fake XBlock class for problems, and no class for other block types.
+    """
+    return FakeProblemBlock if block_type == "problem" else None
+
+
+@patch(
+    "platform_plugin_aspects.sinks.course_structure.get_xblock_class",
+    side_effect=fake_get_xblock_class,
+)
+class TestCourseStructureReader(TestCase):
+    """
+    Tests for CourseStructureReader.
+    """
+
+    def setUp(self):
+        self.course_key = CourseKey.from_string(course_str_factory())
+
+    def test_get_blocks(self, mock_get_xblock_class):
+        """
+        Test that the tree comes in order, followed by detached blocks only.
+        """
+        reader = CourseStructureReader(
+            self.course_key, fake_structure(), mock_detached_xblock_types()
+        )
+
+        blocks = list(reader.get_blocks())
+
+        self.assertEqual(
+            [(b.scope_ids.block_type, b.display_name_with_default) for b in blocks],
+            [
+                ("course", "Course"),
+                ("chapter", "Section"),
+                ("sequential", "Sub"),
+                ("vertical", "Unit"),
+                ("problem", "Blank Problem"),
+                ("html", "html 1"),
+                ("about", "overview"),
+            ],
+        )
+        self.assertEqual(
+            [b.graded for b in blocks], [False, False, True, True, True, False, False]
+        )
+        self.assertEqual(blocks[4].completion_mode, "completable")
+        self.assertEqual(blocks[5].completion_mode, "")
+        self.assertEqual(blocks[4].edited_on, EDITED_ON)
+        self.assertEqual(
+            blocks[4].location,
+            self.course_key.make_usage_key("problem", "problem_1"),
+        )
+        self.assertEqual(blocks[4].scope_ids.usage_id.course_key, self.course_key)
+        # Block classes are loaded once per type
+        self.assertEqual(mock_get_xblock_class.call_count, 7)
+
+    @patch(
+        "platform_plugin_aspects.sinks.course_overview_sink.get_tags_for_blocks",
+        return_value={},
+    )
+    @patch(
+        "platform_plugin_aspects.sinks.course_overview_sink.get_detached_xblock_types",
+        return_value=mock_detached_xblock_types(),
+    )
+    @patch("platform_plugin_aspects.sinks.course_overview_sink.get_modulestore")
+    @patch(
+        "platform_plugin_aspects.sinks.course_overview_sink.get_published_course_structure"
+    )
+    def test_xblock_sink_reads_structure(
+        self, mock_get_structure, mock_modulestore, *_mocks
+    ):
+        """
+        Test that XBlockSink serializes blocks from the structure when available.
+        """
+        mock_get_structure.return_value = fake_structure()
+        sink = XBlockSink(connection_overrides={}, log=MagicMock())
+
+        rows = list(
+            sink.serialize_item(
+                {"course_key": str(self.course_key)},
+                initial={"dump_id": "xyz", "time_last_dumped": "2023-09-05"},
+            )
+        )
+
+        self.assertEqual(len(rows), 7)
+        self.assertEqual(rows[4]["display_name"], "Blank Problem")
+        self.assertEqual(rows[4]["edited_on"], str(EDITED_ON))
+        self.assertEqual(
+            rows[4]["location"],
+            str(self.course_key.make_usage_key("problem", "problem_1")),
+        )
+        self.assertIn('"unit": 1', rows[4]["xblock_data_json"])
+        mock_get_structure.assert_called_once_with(
+            mock_modulestore.return_value, self.course_key
+        )
+        mock_modulestore.return_value.get_course.assert_not_called()
+        mock_modulestore.return_value.get_items.assert_not_called()
+
+    @patch(
+        "platform_plugin_aspects.sinks.course_overview_sink.get_tags_for_blocks",
+        return_value={},
+    )
+    @patch(
+        "platform_plugin_aspects.sinks.course_overview_sink.get_detached_xblock_types",
+        return_value=mock_detached_xblock_types(),
+    )
+    @patch("platform_plugin_aspects.sinks.course_overview_sink.get_modulestore")
+    @patch(
+        "platform_plugin_aspects.sinks.course_overview_sink.get_published_course_structure"
+    )
+    def test_structure_matches_modulestore(
+        self, mock_get_structure, mock_modulestore, *_mocks
+    ):
+        """
+        Test that the structure and the modulestore serialize the same course alike.
+        """
+        course_block, detached_blocks = fake_modulestore_course(self.course_key)
+        mock_modulestore.return_value.get_course.return_value = course_block
+        mock_modulestore.return_value.get_items.return_value = detached_blocks
+        sink = XBlockSink(connection_overrides={}, log=MagicMock())
+
+        def serialize():
+            return list(
+                sink.serialize_item(
+                    {"course_key": str(self.course_key)},
+                    initial={"dump_id": "xyz", "time_last_dumped": "2023-09-05"},
+                )
+            )
+
+        mock_get_structure.return_value = fake_structure()
+        structure_rows = serialize()
+        mock_get_structure.return_value = None
+        modulestore_rows = serialize()
+
+        self.assertEqual(len(structure_rows), 7)
+        self.assertEqual(structure_rows, modulestore_rows)
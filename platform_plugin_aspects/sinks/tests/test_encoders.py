@@ -0,0 +1,221 @@
+"""
+Tests for the ClickHouse insert encoders.
+"""
+
+import datetime
+import struct
+import uuid
+
+import ddt
+from django.test import TestCase
+
+from platform_plugin_aspects.sinks import encoders
+
+
+@ddt.ddt
+class TestRowBinaryEncoder(TestCase):
+    """
+    Tests for the RowBinary encoder and its type writers.
+    """
+
+    def _encode(self, ch_type, value):
+        out = bytearray()
+        encoders.get_type_writer(ch_type)(value, out)
+        return bytes(out)
+
+    @ddt.data(
+        ("UInt8", 1, b"\x01"),
+        ("Int16", -2, struct.pack("<h", -2)),
+        ("UInt64", "42", struct.pack("<Q", 42)),
+        ("Float64", 0.5, struct.pack("<d", 0.5)),
+        ("Bool", True, b"\x01"),
+        ("Bool", "False", b"\x00"),
+        ("String", "abc", b"\x03abc"),
+        ("String", 12, b"\x0212"),
+        ("String", {"a": 1}, b'\x08{"a": 1}'),
+        ("FixedString(4)", "ab", b"ab\x00\x00"),
+        ("LowCardinality(String)", "audit", b"\x05audit"),
+        ("Nullable(String)", None, b"\x01"),
+        ("Nullable(UInt8)", 3, b"\x00\x03"),
+        ("Array(UInt8)", [1, 2], b"\x02\x01\x02"),
+        ("Array(UInt8)", "[1, 2]", b"\x02\x01\x02"),
+        ("Enum8('audit' = 1, 'verified' = 2)", "verified", b"\x02"),
+        ("Date", "1970-01-03", struct.pack("<H", 2)),
+        ("DateTime", "1970-01-01 00:01:00+00:00", struct.pack("<I", 60)),
+        (
+            "DateTime64(6)",
+            datetime.datetime(1970, 1, 1, 0, 0, 1, 5),
+            struct.pack("<q", 1_000_005),
+        ),
+        (
+            "DateTime64(3, 'UTC')",
+            "1970-01-01T00:00:01.500+00:00",
+            struct.pack("<q", 1500),
+        ),
+    )
+    @ddt.unpack
+    def test_type_writers(self, ch_type, value, expected):
+        """
+        Test the RowBinary encoding of each supported type.
+        """
+        self.assertEqual(self._encode(ch_type, value), expected)
+
+    @ddt.data(
+        ("UInt32", struct.pack("<I", 0)),
+        ("Int8", b"\x00"),
+        ("Float32", struct.pack("<f", 0)),
+        ("Bool", b"\x00"),
+        ("String", b"\x00"),
+        ("FixedString(2)", b"\x00\x00"),
+        ("LowCardinality(String)", b"\x00"),
+        ("LowCardinality(Nullable(String))", b"\x01"),
+        ("UUID", bytes(16)),
+        ("Date", struct.pack("<H", 0)),
+        ("Date32", struct.pack("<i", 0)),
+        ("DateTime", struct.pack("<I", 0)),
+        ("DateTime64(6)", struct.pack("<q", 0)),
+        ("Enum8('audit' = 1, 'verified' = 2)", b"\x01"),
+        ("Array(String)", b"\x00"),
+        ("Nullable(DateTime)", b"\x01"),
+    )
+    @ddt.unpack
+    def test_none_values(self, ch_type, expected):
+        """
+        Test that None is written as the type's default unless the type is Nullable.
+
+        An empty CSV field, as None used to be sent, is read as the default too.
+        """
+        self.assertEqual(self._encode(ch_type, None), expected)
+
+    def test_none_in_array(self):
+        """
+        Test that None elements of arrays are written as the element type's default.
+        """
+        self.assertEqual(self._encode("Array(String)", ["a", None]), b"\x02\x01a\x00")
+
+    def test_uuid(self):
+        """
+        Test that UUIDs are written as two little-endian UInt64.
+        """
+        value = uuid.UUID("61f0c404-5cb3-11e7-907b-a6006ad3dba0")
+        expected = bytes.fromhex("e711b35c04c4f061a0dbd36a00a67b90")
+
+        self.assertEqual(self._encode("UUID", value), expected)
+        self.assertEqual(self._encode("UUID", str(value)), expected)
+
+    def test_long_string_varint(self):
+        """
+        Test that string lengths over 127 bytes use a multi-byte varint.
+        """
+        self.assertEqual(self._encode("String", "a" * 300)[:2], b"\xac\x02")
+
+    @ddt.data("Decimal(10, 2)", "Map(String, String)")
+    def test_unsupported_type(self, ch_type):
+        """
+        Test that unsupported types fail when the encoder is built.
+        """
+        with self.assertRaises(ValueError):
+            encoders.RowBinaryEncoder([("value", ch_type)])
+
+    def test_encode_rows(self):
+        """
+        Test that rows are written in schema order, ignoring extra keys.
+        """
+        encoder = encoders.RowBinaryEncoder([("id", "UInt32"), ("name", "String")])
+        rows = [
+            {"name": "a", "id": 1, "extra": "ignored"},
+            {"name": "bc", "id": 2},
+        ]
+
+        self.assertEqual(encoder.columns, ["id", "name"])
+        self.assertEqual(
+            encoder.encode(rows),
+            struct.pack("<I", 1) + b"\x01a" + struct.pack("<I", 2) + b"\x02bc",
+        )
+
+    def test_iter_encode_values(self):
+        """
+        Test that tuples already in column order are written as is.
+        """
+        encoder = encoders.RowBinaryEncoder([("id", "UInt32"), ("name", "String")])
+
+        self.assertEqual(
+            b"".join(encoder.iter_encode_values([(1, "a")])),
+            struct.pack("<I", 1) + b"\x01a",
+        )
+
+    def test_encode_missing_column(self):
+        """
+        Test that a row missing a schema column is an explicit error.
+        """
+        encoder = encoders.RowBinaryEncoder([("id", "UInt32"), ("name", "String")])
+
+        with self.assertRaises(ValueError):
+            encoder.encode([{"id": 1}])
+
+    def test_schema_required(self):
+        """
+        Test that RowBinary can't be used without a schema.
+        """
+        with self.assertRaises(ValueError):
+            encoders.get_encoder("RowBinary")
+
+
+class TestCSVEncoder(TestCase):
+    """
+    Tests for the CSV encoder.
+    """
+
+    def test_encode_in_dict_order(self):
+        """
+        Test that without a schema the dict values are written in order.
+        """
+        encoder = encoders.get_encoder("CSV")
+
+        self.assertIsNone(encoder.columns)
+        self.assertEqual(
+            encoder.encode([{"name": "a", "id": 1}]),
+            b'"a",1\r\n',
+        )
+
+    def test_encode_in_schema_order(self):
+        """
+        Test that with a schema the values are written in schema order.
+        """
+        encoder = encoders.get_encoder("CSV", [("id", "UInt32"), ("name", "String")])
+
+        self.assertEqual(encoder.encode([{"name": "a", "id": 1}]), b'1,"a"\r\n')
+
+    def test_iter_encode(self):
+        """
+        Test that rows are encoded one at a time.
+        """
+        encoder = encoders.get_encoder("CSV")
+
+        self.assertEqual(
+            list(encoder.iter_encode(iter([{"id": 1}, {"id": 2}]))),
+            [b"1\r\n", b"2\r\n"],
+        )
+
+    def test_iter_encode_values(self):
+        """
+        Test that tuples already in column order are written as is.
+        """
+        encoder = encoders.get_encoder("CSV", [("id", "UInt32"), ("name", "String")])
+
+        self.assertEqual(list(encoder.iter_encode_values([(1, "a")])), [b'1,"a"\r\n'])
+
+    def test_iter_chunks(self):
+        """
+        Test that encoded rows are grouped into chunks of at least the chunk size.
+        """
+        chunks = list(encoders.iter_chunks([b"ab", b"cd", b"e", b"fgh", b"i"], 3))
+
+        self.assertEqual(chunks, [b"abcd", b"efgh", b"i"])
+
+    def test_unknown_format(self):
+        """
+        Test that an unknown format raises.
+        """
+        with self.assertRaises(ValueError):
+            encoders.get_encoder("Parquet")
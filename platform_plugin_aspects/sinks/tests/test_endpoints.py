@@ -0,0 +1,127 @@
+"""
+Tests for the ClickHouse endpoint pool.
+"""
+
+from unittest.mock import patch
+
+from django.test import TestCase
+
+from platform_plugin_aspects.sinks import endpoints
+
+URLS = ["http://ch1:8123", "http://ch2:8123", "http://ch3:8123"]
+
+
+@patch("platform_plugin_aspects.sinks.endpoints.time.monotonic", return_value=100)
+class TestEndpointPool(TestCase):
+    """
+    Tests for EndpointPool.
+    """
+
+    def test_round_robin(self, mock_monotonic):  # pylint: disable=unused-argument
+        """
+        Test that requests are spread over every endpoint in turn.
+        """
+        pool = endpoints.EndpointPool(URLS)
+
+        self.assertEqual([pool.select() for _ in range(6)], URLS + URLS)
+
+    def test_unhealthy_skipped_until_cooldown(self, mock_monotonic):
+        """
+        Test that a failed endpoint is skipped until its cool-down has passed.
+        """
+        pool = endpoints.EndpointPool(URLS, endpoint_cooldown_secs=10)
+
+        pool.mark_failure(URLS[0])
+
+        self.assertNotIn(URLS[0], [pool.select() for _ in range(6)])
+
+        mock_monotonic.return_value = 111
+        self.assertIn(URLS[0], [pool.select() for _ in range(6)])
+
+    def test_all_unhealthy(self, mock_monotonic):
+        """
+        Test that the endpoint recovering first is used when all are unhealthy.
+        """
+        pool = endpoints.EndpointPool(URLS, endpoint_cooldown_secs=10)
+
+        pool.mark_failure(URLS[1])
+        mock_monotonic.return_value = 101
+        pool.mark_failure(URLS[0])
+        pool.mark_failure(URLS[2])
+
+        self.assertEqual(pool.select(), URLS[1])
+        self.assertFalse(pool.has_healthy())
+
+    def test_exclude(self, mock_monotonic):  # pylint: disable=unused-argument
+        """
+        Test that endpoints already tried for a request are skipped.
+        """
+        pool = endpoints.EndpointPool(URLS)
+
+        self.assertEqual(pool.select(exclude={URLS[0], URLS[1]}), URLS[2])
+        self.assertTrue(pool.has_healthy(exclude={URLS[0]}))
+        self.assertFalse(pool.has_healthy(exclude=set(URLS)))
+
+    def test_least_latency(self, mock_monotonic):  # pylint: disable=unused-argument
+        """
+        Test that the endpoint with the lowest average latency is preferred.
+        """
+        pool = endpoints.EndpointPool(URLS, load_balancing="least_latency")
+
+        pool.mark_success(URLS[0], 0.5)
+        pool.mark_success(URLS[1], 0.1)
+        pool.mark_success(URLS[2], 0.3)
+        self.assertEqual(pool.select(), URLS[1])
+
+        # One slow request moves the average, but doesn't replace it
+        pool.mark_success(URLS[1], 1.1)
+        self.assertEqual(pool.select(), URLS[2])
+
+    def test_success_marks_healthy(
+        self, mock_monotonic
+    ):  # pylint: disable=unused-argument
+        """
+        Test that a successful request brings an endpoint back straight away.
+        """
+        pool = endpoints.EndpointPool(URLS)
+
+        pool.mark_failure(URLS[0])
+        pool.mark_success(URLS[0], 0.1)
+
+        self.assertTrue(pool.is_healthy(URLS[0]))
+
+    def test_invalid_strategy(self, mock_monotonic):  # pylint: disable=unused-argument
+        """
+        Test that an unknown load balancing strategy raises.
+        """
+        with self.assertRaises(ValueError):
+            endpoints.EndpointPool(URLS, load_balancing="random")
+
+
+class TestEndpointHelpers(TestCase):
+    """
+    Tests for the endpoint configuration helpers.
+    """
+
+    def setUp(self):
+        endpoints.reset_endpoint_pools()
+        self.addCleanup(endpoints.reset_endpoint_pools)
+
+    def test_get_endpoint_urls(self):
+        """
+        Test that a single URL or a list of URLs are both accepted.
+        """
+        self.assertEqual(endpoints.get_endpoint_urls(URLS[0]), [URLS[0]])
+        self.assertEqual(endpoints.get_endpoint_urls(tuple(URLS)), URLS)
+
+    def test_get_endpoint_pool_is_shared(self):
+        """
+        Test that sinks with the same endpoints share their health.
+        """
+        pool = endpoints.get_endpoint_pool(URLS, {"endpoint_cooldown_secs": 5})
+
+        self.assertIs(
+            pool, endpoints.get_endpoint_pool(URLS, {"endpoint_cooldown_secs": 5})
+        )
+        self.assertIsNot(pool, endpoints.get_endpoint_pool(URLS))
+        self.assertEqual(pool.cooldown_secs, 5)
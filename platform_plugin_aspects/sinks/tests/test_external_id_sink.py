@@ -5,6 +5,7 @@ Test the external_id_sink module.
 from unittest.mock import patch
 
 from platform_plugin_aspects.sinks import ExternalIdSink
+from platform_plugin_aspects.sinks.serializers import UserExternalIDSerializer
 
 
 @patch("platform_plugin_aspects.sinks.ModelBaseSink.get_queryset")
@@ -20,3 +21,15 @@ def test_get_queryset(mock_get_queryset):
     mock_get_queryset.return_value.select_related.assert_called_once_with(
         "user", "external_id_type"
     )
+
+
+def test_projection_matches_serializer():
+    """
+    Test that the bulk projection covers the same columns as the serializer.
+    """
+    assert set(ExternalIdSink.projection) == set(
+        UserExternalIDSerializer.Meta.fields
+    ) - {
+        "dump_id",
+        "time_last_dumped",
+    }
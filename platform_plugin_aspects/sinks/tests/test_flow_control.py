@@ -0,0 +1,129 @@
+"""
+Tests for the adaptive flow control of bulk dumps.
+"""
+
+from unittest.mock import Mock, patch
+
+from django.test import TestCase
+
+from platform_plugin_aspects.sinks.flow_control import (
+    FlowController,
+    get_flow_control_config,
+)
+
+
+class TestFlowController(TestCase):
+    """
+    Tests for FlowController.
+    """
+
+    def get_controller(
+        self, batch_size=1000, sleep_time=4, get_active_parts=None, **config
+    ):
+        config = get_flow_control_config(
+            {"flow_target_latency_secs": 2, "flow_max_batch_size": 2000}, config
+        )
+        return FlowController(batch_size, sleep_time, get_active_parts, **config)
+
+    def test_get_flow_control_config(self):
+        """
+        Test that later configs take precedence over earlier ones and the defaults.
+        """
+        config = get_flow_control_config(
+            {"flow_max_active_parts": 10, "url": "http://clickhouse:8123"},
+            {"flow_max_active_parts": 20},
+        )
+        self.assertEqual(config["flow_max_active_parts"], 20)
+        self.assertEqual(config["flow_target_latency_secs"], 5)
+        self.assertNotIn("url", config)
+
+    def test_speed_up(self):
+        """
+        Test that fast inserts grow batches and shrink pauses, up to their bounds.
+        """
+        controller = self.get_controller()
+
+        controller.record_latency(0.5)
+        self.assertIn("batch size 1000 -> 1500", controller.update())
+        self.assertEqual(controller.sleep_time, 2)
+
+        for _ in range(10):
+            controller.record_latency(0.5)
+            controller.update()
+        self.assertEqual((controller.batch_size, controller.sleep_time), (2000, 0))
+
+        controller.record_latency(0.5)
+        self.assertIsNone(controller.update())
+
+    def test_no_change(self):
+        """
+        Test that nothing changes without requests, or with latency near the target.
+        """
+        controller = self.get_controller()
+
+        self.assertIsNone(controller.update())
+        controller.record_latency(1.5)
+        self.assertIsNone(controller.update())
+        self.assertEqual((controller.batch_size, controller.sleep_time), (1000, 4))
+
+    def test_back_off_latency(self):
+        """
+        Test that slow inserts halve batches and double pauses.
+        """
+        controller = self.get_controller(sleep_time=0)
+
+        controller.record_latency(0.1)
+        controller.record_latency(3)
+        self.assertEqual(
+            controller.update(),
+            "insert latency 3.00s: batch size 1000 -> 500, sleep time 0s -> 1s",
+        )
+        controller.record_latency(3)
+        controller.update()
+        self.assertEqual((controller.batch_size, controller.sleep_time), (250, 2))
+
+    def test_back_off_failures(self):
+        """
+        Test that transient failures back off, down to the minimum batch size.
+        """
+        controller = self.get_controller(
+            batch_size=300, flow_min_batch_size=200, flow_max_sleep_secs=5
+        )
+
+        controller.record_failure()
+        controller.record_latency(0.1)
+        self.assertEqual(
+            controller.update(),
+            "1 failed requests: batch size 300 -> 200, sleep time 4s -> 5s",
+        )
+
+        controller.record_failure()
+        self.assertIsNone(controller.update())
+        self.assertEqual((controller.batch_size, controller.sleep_time), (200, 5))
+
+    @patch("platform_plugin_aspects.sinks.flow_control.time.monotonic")
+    def test_back_off_active_parts(self, mock_monotonic):
+        """
+        Test that too many active parts slow dumps down, read once per interval.
+        """
+        mock_monotonic.return_value = 100
+        get_active_parts = Mock(return_value=500)
+        controller = self.get_controller(
+            get_active_parts=get_active_parts, flow_max_active_parts=300
+        )
+
+        controller.record_latency(0.5)
+        self.assertEqual(
+            controller.update(),
+            "500 active parts: batch size 1000 -> 1000, sleep time 4s -> 8s",
+        )
+
+        get_active_parts.return_value = 10
+        mock_monotonic.return_value = 129
+        controller.update()
+        self.assertEqual(controller.sleep_time, 16)
+
+        mock_monotonic.return_value = 130
+        controller.record_latency(0.5)
+        self.assertIn("batch size 1000 -> 1500", controller.update())
+        self.assertEqual(get_active_parts.call_count, 2)
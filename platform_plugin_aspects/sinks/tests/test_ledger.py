@@ -0,0 +1,78 @@
+"""
+Tests for the dump ledger.
+"""
+
+import os
+import tempfile
+
+from django.test import TestCase
+
+from platform_plugin_aspects.sinks.ledger import DumpLedger, get_dump_ledger, hash_row
+
+
+class TestDumpLedger(TestCase):
+    """
+    Tests for DumpLedger and the row hashes.
+    """
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(tmp_dir.cleanup)
+        self.ledger_path = os.path.join(tmp_dir.name, "ledger", "dumps.db")
+        self.ledger = DumpLedger(self.ledger_path)
+
+    def test_get_dump_ledger(self):
+        """
+        Test that the ledger is disabled without a ledger path.
+        """
+        self.assertIsNone(get_dump_ledger({"url": "http://clickhouse:8123"}))
+        ledger = get_dump_ledger({"ledger_path": "/tmp/a.db"}, {"ledger_path": "/b.db"})
+        self.assertEqual(ledger.ledger_path, "/b.db")
+
+    def test_hash_row(self):
+        """
+        Test that fields filled at dump time don't change the hash of a row.
+        """
+        row = {"id": 1, "name": "a", "dump_id": "x", "time_last_dumped": "now"}
+
+        self.assertEqual(
+            hash_row(row),
+            hash_row(
+                {"name": "a", "id": 1, "dump_id": "y", "time_last_dumped": "later"}
+            ),
+        )
+        self.assertNotEqual(hash_row(row), hash_row({**row, "name": "b"}))
+        self.assertEqual(hash_row((1, "a")), hash_row([1, "a"]))
+        self.assertNotEqual(hash_row((1, "a")), hash_row((1, "b")))
+
+    def test_record_and_get_hashes(self):
+        """
+        Test that the last hash recorded for each pk is returned, per table.
+        """
+        self.ledger.record("db.a", {1: "h1", 2: "h2"})
+        self.ledger.record("db.a", {2: "h2b"})
+        self.ledger.record("db.b", {1: "other"})
+
+        self.assertEqual(
+            self.ledger.get_hashes("db.a", [1, 2, 3]), {"1": "h1", "2": "h2b"}
+        )
+        # A new ledger on the same file sees the same rows
+        self.assertEqual(
+            DumpLedger(self.ledger_path).get_hashes("db.b", [1]), {"1": "other"}
+        )
+
+        self.ledger.clear("db.a")
+        self.assertEqual(self.ledger.get_hashes("db.a", [1, 2]), {})
+        self.assertEqual(self.ledger.get_hashes("db.b", [1]), {"1": "other"})
+
+    def test_get_many_hashes(self):
+        """
+        Test that pages larger than one lookup are read in several queries.
+        """
+        hashes = {pk: f"h{pk}" for pk in range(1200)}
+        self.ledger.record("db.a", hashes)
+
+        self.assertEqual(
+            self.ledger.get_hashes("db.a", list(hashes)),
+            {str(pk): row_hash for pk, row_hash in hashes.items()},
+        )
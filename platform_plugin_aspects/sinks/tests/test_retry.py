@@ -0,0 +1,102 @@
+"""
+Tests for the ClickHouse retry helpers.
+"""
+
+from unittest.mock import Mock
+
+import ddt
+import requests
+from django.test import TestCase
+
+from platform_plugin_aspects.sinks.retry import ReplayableBody, RetryPolicy
+
+
+def _http_error(status_code):
+    return requests.exceptions.HTTPError(response=Mock(status_code=status_code))
+
+
+@ddt.ddt
+class TestRetryPolicy(TestCase):
+    """
+    Tests for RetryPolicy.
+    """
+
+    def test_from_config(self):
+        """
+        Test that later configs override earlier ones and defaults fill the rest.
+        """
+        policy = RetryPolicy.from_config(
+            {"url": "http://clickhouse:8123", "max_retries": 5},
+            None,
+            {"retry_backoff_secs": 2},
+        )
+
+        self.assertEqual(policy.max_retries, 5)
+        self.assertEqual(policy.backoff_secs, 2)
+        self.assertEqual(policy.backoff_max_secs, 10)
+
+    def test_get_delay(self):
+        """
+        Test that the delay grows exponentially, is jittered and capped.
+        """
+        policy = RetryPolicy(5, 1, 3)
+
+        for attempt, cap in [(0, 1), (1, 2), (2, 3), (4, 3)]:
+            for _ in range(20):
+                self.assertTrue(0 <= policy.get_delay(attempt) <= cap)
+
+    @ddt.data(
+        (requests.exceptions.ConnectionError(), 0, True),
+        (requests.exceptions.ReadTimeout(), 0, True),
+        (_http_error(503), 1, True),
+        (_http_error(429), 0, True),
+        (_http_error(400), 0, False),
+        (_http_error(500), 2, False),
+        (requests.exceptions.InvalidURL(), 0, False),
+    )
+    @ddt.unpack
+    def test_should_retry(self, exception, attempt, expected):
+        """
+        Test which failures are retried.
+        """
+        self.assertEqual(
+            RetryPolicy(2, 1, 1).should_retry(attempt, exception), expected
+        )
+
+
+class TestReplayableBody(TestCase):
+    """
+    Tests for ReplayableBody.
+    """
+
+    def test_replay(self):
+        """
+        Test that a fully consumed body is replayed from the spool.
+        """
+        body = ReplayableBody(iter([b"abc", b"def"]), max_memory=2)
+
+        self.assertEqual(b"".join(body), b"abcdef")
+        self.assertEqual(b"".join(body), b"abcdef")
+        body.close()
+
+    def test_replay_partially_consumed(self):
+        """
+        Test that a body interrupted mid-stream is replayed and then completed.
+        """
+        body = ReplayableBody(iter([b"abc", b"def", b"ghi"]), max_memory=1024)
+
+        first_attempt = iter(body)
+        self.assertEqual(next(first_attempt), b"abc")
+
+        self.assertEqual(b"".join(body), b"abcdefghi")
+        self.assertEqual(b"".join(body), b"abcdefghi")
+        body.close()
+
+    def test_is_streamed(self):
+        """
+        Test that only one-shot iterators need to be made replayable.
+        """
+        self.assertTrue(ReplayableBody.is_streamed(iter([b"a"])))
+        self.assertTrue(ReplayableBody.is_streamed(x for x in [b"a"]))
+        self.assertFalse(ReplayableBody.is_streamed(b"a"))
+        self.assertFalse(ReplayableBody.is_streamed(None))
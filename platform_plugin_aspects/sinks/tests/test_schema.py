@@ -0,0 +1,74 @@
+"""
+Tests for the ClickHouse table schemas.
+"""
+
+from unittest.mock import Mock, patch
+
+from django.test import TestCase
+
+from platform_plugin_aspects.sinks.schema import (
+    SchemaMismatchError,
+    check_row_columns,
+    get_cached_schema,
+    invalidate_schema,
+    parse_describe_table,
+    reset_schemas,
+)
+
+
+class TestSchema(TestCase):
+    """
+    Tests for the schema helpers.
+    """
+
+    def setUp(self):
+        reset_schemas()
+        self.addCleanup(reset_schemas)
+
+    def test_parse_describe_table(self):
+        """
+        Test that computed columns are left out of the schema.
+        """
+        text = (
+            '{"name": "id", "type": "UInt32", "default_type": ""}\n'
+            '{"name": "day", "type": "Date", "default_type": "MATERIALIZED"}\n'
+            '{"name": "label", "type": "String", "default_type": "ALIAS"}\n'
+            "\n"
+            '{"name": "created", "type": "DateTime", "default_type": "DEFAULT"}\n'
+        )
+
+        self.assertEqual(
+            parse_describe_table(text), [("id", "UInt32"), ("created", "DateTime")]
+        )
+
+    @patch("platform_plugin_aspects.sinks.schema.time.monotonic")
+    def test_get_cached_schema(self, mock_monotonic):
+        """
+        Test that schemas are described again once the cache expires or is invalidated.
+        """
+        describe = Mock(return_value=[("id", "UInt32")])
+        mock_monotonic.return_value = 100
+
+        get_cached_schema("table", describe, 300)
+        mock_monotonic.return_value = 399
+        get_cached_schema("table", describe, 300)
+        self.assertEqual(describe.call_count, 1)
+
+        mock_monotonic.return_value = 400
+        get_cached_schema("table", describe, 300)
+        self.assertEqual(describe.call_count, 2)
+
+        invalidate_schema("table")
+        self.assertEqual(get_cached_schema("table", describe, 300), [("id", "UInt32")])
+        self.assertEqual(describe.call_count, 3)
+
+    def test_check_row_columns(self):
+        """
+        Test that missing and unknown columns are reported, excluded ones allowed.
+        """
+        check_row_columns({"id": 1, "name": "a"}, ["id"], {"name"}, "db.t")
+
+        with self.assertRaisesRegex(SchemaMismatchError, "missing columns name"):
+            check_row_columns({"id": 1}, ["id", "name"], set(), "db.t")
+        with self.assertRaisesRegex(SchemaMismatchError, "not in the table extra"):
+            check_row_columns({"id": 1, "extra": 2}, ["id"], set(), "db.t")
@@ -0,0 +1,271 @@
+"""
+Tests for the ClickHouse insert spool.
+"""
+
+import gzip
+import os
+import tempfile
+import time
+from unittest.mock import Mock
+
+import requests
+from django.test import TestCase
+
+from platform_plugin_aspects.sinks.compression import get_codec
+from platform_plugin_aspects.sinks.spool import (
+    InsertSpool,
+    SpoolFullError,
+    get_spool,
+    get_spool_config,
+)
+
+
+class TestInsertSpool(TestCase):
+    """
+    Tests for InsertSpool.
+    """
+
+    def setUp(self):
+        spool_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(spool_dir.cleanup)
+        self.spool_dir = spool_dir.name
+        self.spool = InsertSpool(self.spool_dir, spool_segment_max_age_secs=0)
+
+    def test_get_spool(self):
+        """
+        Test that the spool is only built when spool_dir is configured.
+        """
+        self.assertIsNone(get_spool({"url": "http://clickhouse:8123"}, None))
+
+        config = get_spool_config({"spool_dir": "/tmp"}, {"spool_max_bytes": 10})
+        self.assertEqual(config["spool_max_bytes"], 10)
+        self.assertEqual(config["spool_segment_max_age_secs"], 60)
+
+        spool = get_spool({"spool_dir": self.spool_dir})
+        self.assertEqual(spool.spool_dir, self.spool_dir)
+
+    def test_append_and_drain(self):
+        """
+        Test that consecutive inserts of the same query are merged when drained.
+        """
+        params = {"query": "INSERT INTO db.table FORMAT CSV"}
+        self.spool.append("table", dict(params, insert_deduplication_token="a"), b"1\n")
+        self.spool.append(
+            "table",
+            dict(params, insert_deduplication_token="b"),
+            iter([b"2\n", b"3\n"]),
+        )
+        self.spool.append("other", params, b"4\n")
+        send = Mock()
+
+        self.assertEqual(self.spool.drain(send, table="table"), 2)
+
+        send.assert_called_once()
+        sent_params, body, encoding = send.call_args[0]
+        self.assertEqual(body, b"1\n2\n3\n")
+        self.assertIsNone(encoding)
+        self.assertEqual(sent_params["query"], params["query"])
+        self.assertEqual(len(sent_params["insert_deduplication_token"]), 64)
+        self.assertEqual(self.spool.get_stats()["table"]["bytes"], 0)
+        self.assertGreater(self.spool.get_stats()["other"]["bytes"], 0)
+
+    def test_drain_compressed(self):
+        """
+        Test that compressed bodies are merged and compressed again.
+        """
+        params = {"query": "INSERT INTO db.table FORMAT CSV"}
+        self.spool.append("table", params, gzip.compress(b"1\n"), "gzip")
+        self.spool.append("table", params, gzip.compress(b"2\n"), "gzip")
+        send = Mock()
+
+        self.spool.drain(send)
+
+        sent_params, body, encoding = send.call_args[0]
+        self.assertEqual(gzip.decompress(body), b"1\n2\n")
+        self.assertEqual(encoding, "gzip")
+        # Not every insert had a token, so the merged insert can't have one
+        self.assertNotIn("insert_deduplication_token", sent_params)
+
+    def test_drain_zstd_frames(self):
+        """
+        Test that spooled bodies made of several zstd frames are drained whole.
+        """
+        codec = get_codec("zstd")
+        params = {"query": "INSERT INTO db.table FORMAT CSV"}
+        self.spool.append(
+            "table", params, codec.compress(b"1\n") + codec.compress(b"2\n"), "zstd"
+        )
+        self.spool.append("table", params, codec.compress(b"3\n"), "zstd")
+        send = Mock()
+
+        self.spool.drain(send)
+
+        _sent_params, body, encoding = send.call_args[0]
+        self.assertEqual(codec.decompress(body), b"1\n2\n3\n")
+        self.assertEqual(encoding, "zstd")
+
+    def test_drain_batch_size(self):
+        """
+        Test that merged inserts are split at the drain batch size.
+        """
+        spool = InsertSpool(
+            self.spool_dir, spool_segment_max_age_secs=0, spool_drain_batch_bytes=4
+        )
+        params = {"query": "INSERT INTO db.table FORMAT CSV"}
+        for i in range(5):
+            spool.append("table", params, f"{i}\n".encode())
+        send = Mock()
+
+        self.assertEqual(spool.drain(send), 5)
+
+        self.assertEqual(
+            [call[0][1] for call in send.call_args_list],
+            [b"0\n1\n", b"2\n3\n", b"4\n"],
+        )
+
+    def test_drain_failure_requeues(self):
+        """
+        Test that inserts that were not sent stay in the spool when sending fails.
+        """
+        spool = InsertSpool(
+            self.spool_dir, spool_segment_max_age_secs=0, spool_drain_batch_bytes=1
+        )
+        params = {"query": "INSERT INTO db.table FORMAT CSV"}
+        for i in range(3):
+            spool.append("table", params, f"{i}\n".encode())
+        send = Mock(side_effect=[None, ConnectionError()])
+
+        with self.assertRaises(ConnectionError):
+            spool.drain(send)
+
+        send = Mock()
+        self.assertEqual(spool.drain(send), 2)
+        self.assertEqual([call[0][1] for call in send.call_args_list], [b"1\n", b"2\n"])
+
+    def test_drain_rejected_dead_letter(self):
+        """
+        Test that inserts ClickHouse rejects for good don't block the rest of the spool.
+        """
+        spool = InsertSpool(
+            self.spool_dir, spool_segment_max_age_secs=0, spool_drain_batch_bytes=1
+        )
+        params = {"query": "INSERT INTO db.table FORMAT CSV"}
+        for i in range(3):
+            spool.append("table", params, f"{i}\n".encode())
+        rejected = requests.Response()
+        rejected.status_code = 400
+        send = Mock(side_effect=[None, requests.HTTPError(response=rejected), None])
+
+        self.assertEqual(spool.drain(send), 2)
+
+        stats = spool.get_stats()["table"]
+        self.assertEqual(stats["segments"], 0)
+        self.assertEqual(stats["bytes"], 0)
+        self.assertEqual(stats["dead_letter_segments"], 1)
+        self.assertGreater(stats["dead_letter_bytes"], 0)
+        self.assertEqual(spool.get_depth(), 0)
+        (dead_letter,) = [
+            os.path.join(self.spool_dir, "table", name)
+            for name in os.listdir(os.path.join(self.spool_dir, "table"))
+        ]
+        self.assertEqual(
+            [body for _header, body in spool.read_records(dead_letter)], [b"1\n"]
+        )
+
+        # Dead letters are never drained again
+        send = Mock()
+        self.assertEqual(spool.drain(send), 0)
+        send.assert_not_called()
+
+    def test_drain_retryable_error_requeues(self):
+        """
+        Test that inserts failing with a retryable HTTP error are requeued.
+        """
+        self.spool.append("table", {"query": "INSERT"}, b"1\n")
+        unavailable = requests.Response()
+        unavailable.status_code = 503
+        send = Mock(side_effect=requests.HTTPError(response=unavailable))
+
+        with self.assertRaises(requests.HTTPError):
+            self.spool.drain(send)
+
+        self.assertEqual(self.spool.get_stats()["table"]["dead_letter_segments"], 0)
+        self.assertEqual(self.spool.drain(Mock()), 1)
+
+    def test_claim_records_claim_time(self):
+        """
+        Test that an old segment just claimed by a drainer is not claimed again.
+        """
+        # pylint: disable=protected-access
+        spool = InsertSpool(self.spool_dir, spool_segment_max_age_secs=1)
+        spool.append("table", {"query": "INSERT"}, b"1\n")
+        table_dir = os.path.join(self.spool_dir, "table")
+        (segment,) = os.listdir(table_dir)
+        old = time.time() - 3600
+        os.utime(os.path.join(table_dir, segment), (old, old))
+
+        claimed = spool._claim_segments("table")
+
+        self.assertEqual(len(claimed), 1)
+        self.assertEqual(spool._claim_segments("table"), [])
+
+        # Once the claim itself is stale, exactly one drainer takes it over
+        os.utime(claimed[0], (old, old))
+        reclaimed = spool._claim_segments("table")
+        self.assertEqual(len(reclaimed), 1)
+        self.assertNotEqual(reclaimed, claimed)
+        self.assertEqual(spool._claim_segments("table"), [])
+
+    def test_segment_rotation(self):
+        """
+        Test that segments are closed once they reach their maximum size.
+        """
+        spool = InsertSpool(self.spool_dir, spool_segment_max_bytes=200)
+        params = {"query": "INSERT INTO db.table FORMAT CSV"}
+        spool.append("table", params, b"x" * 200)
+        spool.append("table", params, b"y")
+
+        names = os.listdir(os.path.join(self.spool_dir, "table"))
+        self.assertEqual(
+            sorted(os.path.splitext(name)[1] for name in names), [".open", ".seg"]
+        )
+
+        # The open segment is too recent to be drained yet
+        send = Mock()
+        self.assertEqual(spool.drain(send), 1)
+        self.assertEqual(send.call_args[0][1], b"x" * 200)
+
+    def test_truncated_record_dropped(self):
+        """
+        Test that a record cut short by a crash is skipped.
+        """
+        params = {"query": "INSERT INTO db.table FORMAT CSV"}
+        self.spool.append("table", params, b"1\n")
+        self.spool.append("table", params, b"2\n")
+        (name,) = os.listdir(os.path.join(self.spool_dir, "table"))
+        path = os.path.join(self.spool_dir, "table", name)
+        os.truncate(path, os.path.getsize(path) - 1)
+
+        send = Mock()
+        self.spool.drain(send)
+
+        self.assertEqual(send.call_args[0][1], b"1\n")
+
+    def test_spool_full(self):
+        """
+        Test that appends fail once the spool reaches its size limit.
+        """
+        spool = InsertSpool(self.spool_dir, spool_max_bytes=10)
+        spool.append("table", {"query": "INSERT"}, b"1\n")
+
+        with self.assertRaises(SpoolFullError):
+            spool.append("table", {"query": "INSERT"}, b"2\n")
+
+    def test_drain_missing_dir(self):
+        """
+        Test that draining a spool that was never written to does nothing.
+        """
+        spool = InsertSpool(os.path.join(self.spool_dir, "missing"))
+
+        self.assertEqual(spool.drain(Mock()), 0)
+        self.assertEqual(spool.get_stats(), {})
@@ -4,6 +4,7 @@ Test the external_id_sink module.
 
 from unittest.mock import patch
 
+from platform_plugin_aspects.sinks.serializers import UserProfileSerializer
 from platform_plugin_aspects.sinks.user_profile_sink import UserProfileSink
 
 
@@ -18,3 +19,13 @@ def test_get_queryset(mock_get_queryset):
 
     mock_get_queryset.assert_called_once_with(None)
     mock_get_queryset.return_value.select_related.assert_called_once_with("user")
+
+
+def test_projection_matches_serializer():
+    """
+    Test that the bulk projection covers the same columns as the serializer.
+    """
+    assert set(UserProfileSink.projection) == set(UserProfileSerializer.Meta.fields) - {
+        "dump_id",
+        "time_last_dumped",
+    }
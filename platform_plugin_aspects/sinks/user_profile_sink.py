@@ -15,6 +15,28 @@ class UserProfileSink(ModelBaseSink):  # pylint: disable=abstract-method
     timestamp_field = "time_last_dumped"
     name = "User Profile"
     serializer_class = UserProfileSerializer
+    projection = {
+        "id": "id",
+        "user_id": "user_id",
+        "name": "name",
+        "username": "user__username",
+        "email": "user__email",
+        "meta": "meta",
+        "courseware": "courseware",
+        "language": "language",
+        "location": "location",
+        "year_of_birth": "year_of_birth",
+        "gender": "gender",
+        "level_of_education": "level_of_education",
+        "mailing_address": "mailing_address",
+        "city": "city",
+        "country": "country",
+        "state": "state",
+        "goals": "goals",
+        "bio": "bio",
+        "profile_image_uploaded_at": "profile_image_uploaded_at",
+        "phone_number": "phone_number",
+    }
 
     def get_queryset(self, start_pk=None):
         return super().get_queryset(start_pk).select_related("user")
@@ -20,6 +20,14 @@ class UserRetirementSink(ModelBaseSink):  # pylint: disable=abstract-method
     timestamp_field = "modified"
     name = "User Retirement"
     serializer_class = UserRetirementSerializer
+    # Deletes the PII of retired users, there is no table to resync
+    include_in_resync = False
+
+    def iter_serialize_items(self, items, initial=None):
+        """
+        Serialize the users to retire, items being a single user id.
+        """
+        return iter(self.serialize_item(items, many=True, initial=initial))
 
     def send_item(self, serialized_item, many=False):
         """
@@ -10,6 +10,7 @@ from edx_django_utils.monitoring import set_code_owner_attribute
 from opaque_keys.edx.keys import CourseKey
 
 from platform_plugin_aspects.sinks import CourseOverviewSink
+from platform_plugin_aspects.sinks.base_sink import BaseSink
 from platform_plugin_aspects.utils import get_ccx_courses
 
 log = logging.getLogger(__name__)
@@ -62,3 +63,17 @@ def dump_data_to_clickhouse(
         return "Dumped"
 
     return "Disabled"
+
+
+@shared_task
+@set_code_owner_attribute
+def drain_clickhouse_spool(table=None, connection_overrides=None):
+    """
+    Send the inserts waiting in the local ClickHouse spool.
+
+    Arguments:
+        table: only drain the spooled inserts of this ClickHouse table
+        connection_overrides (dict):  overrides to ClickHouse connection
+    """
+    sink = BaseSink(connection_overrides=connection_overrides, log=celery_log)
+    return sink.drain_spool(table=table)
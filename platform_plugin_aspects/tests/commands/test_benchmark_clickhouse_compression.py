@@ -0,0 +1,139 @@
+"""
+Tests for the benchmark_clickhouse_compression management command.
+"""
+
+from unittest.mock import patch
+
+import django.core.management.base
+import pytest
+from django.core.management import call_command
+from django_mock_queries.query import MockModel, MockSet
+from rest_framework import serializers
+
+from platform_plugin_aspects.sinks.base_sink import ModelBaseSink
+from platform_plugin_aspects.sinks.compression import get_codec
+from platform_plugin_aspects.sinks.serializers import BaseSinkSerializer
+
+
+class BenchmarkSerializer(BaseSinkSerializer):  # pylint: disable=abstract-method
+    """
+    Dummy DRF serializer for testing, with a new dump_id per serialization.
+    """
+
+    id = serializers.IntegerField(source="pk")
+    name = serializers.CharField(source="mock_name")
+    email = serializers.CharField()
+
+
+class BenchmarkDummySink(ModelBaseSink):
+    """
+    Dummy sink for testing.
+    """
+
+    name = "Benchmark Dummy"
+    model = "benchmark_dummy"
+    unique_key = "id"
+    serializer_class = BenchmarkSerializer
+    timestamp_field = "created"
+    clickhouse_table_name = "benchmark_dummy_table"
+    clickhouse_schema = [
+        ("id", "UInt32"),
+        ("name", "String"),
+        ("email", "String"),
+        ("dump_id", "UUID"),
+        ("time_last_dumped", "String"),
+    ]
+
+    def get_queryset(self, start_pk=None):
+        return MockSet(
+            *[
+                MockModel(mock_name=f"user {i}", email=f"user{i}@test.invalid", pk=i)
+                for i in range(1, 101)
+            ]
+        )
+
+
+def test_benchmark_compression(caplog):
+    """
+    Test that every codec is reported with its size, and compression shrinks the body.
+    """
+    call_command(
+        "benchmark_clickhouse_compression", object="benchmark_dummy", num_rows=50
+    )
+
+    rows = {
+        line.split()[0]: line.split()
+        for line in caplog.messages
+        if line.split()[0] in ("none", "gzip", "zstd", "lz4")
+    }
+    assert set(rows) == {"none", "gzip", "zstd", "lz4"}
+    for codec in ("gzip", "zstd", "lz4"):
+        assert rows[codec][1] == "50"
+        assert int(rows[codec][2]) < int(rows["none"][2])
+        # Nothing was sent
+        assert rows[codec][-1] == "-"
+
+
+@patch.object(BenchmarkDummySink, "_send_clickhouse_request")
+def test_benchmark_compression_send(mock_send, caplog):
+    """
+    Test that --send inserts new rows into a scratch table once per codec.
+    """
+    call_command(
+        "benchmark_clickhouse_compression",
+        object="benchmark_dummy",
+        num_rows=10,
+        send=True,
+    )
+
+    requests = [call.args[0] for call in mock_send.call_args_list]
+    create, *inserts, drop = requests
+    assert create.params["query"].startswith(
+        "CREATE TABLE IF NOT EXISTS cool_data.benchmark_dummy_table_compression_benchmark "
+        "AS cool_data.benchmark_dummy_table"
+    )
+    assert drop.params["query"] == (
+        "DROP TABLE IF EXISTS cool_data.benchmark_dummy_table_compression_benchmark"
+    )
+
+    encodings = [insert.headers.get("Content-Encoding") for insert in inserts]
+    assert encodings == [None, "gzip", "zstd", "lz4"]
+
+    bodies = []
+    for insert, encoding in zip(inserts, encodings):
+        assert insert.params["query"].startswith(
+            "INSERT INTO cool_data.benchmark_dummy_table_compression_benchmark "
+        )
+        body = get_codec(encoding).decompress(insert.data) if encoding else insert.data
+        bodies.append(body)
+    # Every insert has the 10 rows, with their own dump_ids
+    assert all(body.count(b"@test.invalid") == 10 for body in bodies)
+    assert len(set(bodies)) == len(bodies)
+    assert "insert ms" in caplog.text
+
+
+@patch.object(BenchmarkDummySink, "_send_clickhouse_request")
+@patch(
+    "platform_plugin_aspects.management.commands.benchmark_clickhouse_compression"
+    ".time_insert",
+    side_effect=RuntimeError("insert failed"),
+)
+def test_benchmark_compression_send_failure(_mock_time_insert, mock_send):
+    """
+    Test that the scratch table is dropped even if an insert fails.
+    """
+    with pytest.raises(RuntimeError):
+        call_command(
+            "benchmark_clickhouse_compression", object="benchmark_dummy", send=True
+        )
+
+    assert mock_send.call_args_list[-1].args[0].params["query"].startswith("DROP TABLE")
+
+
+@pytest.mark.parametrize("options", [{}, {"object": "not_a_sink"}])
+def test_benchmark_compression_invalid(options):
+    """
+    Test that a missing or unknown object type is an error.
+    """
+    with pytest.raises(django.core.management.base.CommandError):
+        call_command("benchmark_clickhouse_compression", **options)
@@ -0,0 +1,66 @@
+"""
+Tests for the drain_clickhouse_spool management command.
+"""
+
+import django.core.management.base
+import pytest
+import responses
+from django.core.management import call_command
+from django.test.utils import override_settings
+
+from platform_plugin_aspects.sinks.spool import InsertSpool
+
+
+def _backend_config(spool_dir):
+    return {
+        "url": "http://clickhouse:8123",
+        "username": "ch_cms",
+        "password": "password",
+        "database": "event_sink",
+        "timeout_secs": 5,
+        "spool_dir": spool_dir,
+        "spool_segment_max_age_secs": 0,
+    }
+
+
+@responses.activate
+def test_drain(tmp_path, caplog):
+    """
+    Test that spooled inserts are sent to ClickHouse.
+    """
+    spool = InsertSpool(str(tmp_path))
+    spool.append("table", {"query": "INSERT INTO event_sink.table FORMAT CSV"}, b"1\n")
+    responses.post("http://clickhouse:8123/")
+
+    with override_settings(
+        EVENT_SINK_CLICKHOUSE_BACKEND_CONFIG=_backend_config(str(tmp_path))
+    ):
+        call_command("drain_clickhouse_spool")
+
+    assert len(responses.calls) == 1
+    assert responses.calls[0].request.body == b"1\n"
+    assert "Sent 1 spooled inserts to ClickHouse." in caplog.text
+
+
+def test_stats(tmp_path, caplog):
+    """
+    Test that --stats reports the spool size without sending anything.
+    """
+    with override_settings(
+        EVENT_SINK_CLICKHOUSE_BACKEND_CONFIG=_backend_config(str(tmp_path))
+    ):
+        call_command("drain_clickhouse_spool", stats=True)
+        assert "The ClickHouse spool is empty." in caplog.text
+
+        InsertSpool(str(tmp_path)).append("table", {"query": "INSERT"}, b"1\n")
+        call_command("drain_clickhouse_spool", stats=True)
+
+    assert "table: 1 segments" in caplog.text
+
+
+def test_not_configured():
+    """
+    Test that the command fails when the spool is not configured.
+    """
+    with pytest.raises(django.core.management.base.CommandError):
+        call_command("drain_clickhouse_spool")
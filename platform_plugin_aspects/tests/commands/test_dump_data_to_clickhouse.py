@@ -2,14 +2,28 @@
 Tests for the dump_data_to_clickhouse management command.
 """
 
+import logging
+import multiprocessing
+import re
+import time
 from collections import namedtuple
 from datetime import datetime
+from unittest.mock import Mock, patch
 
 import django.core.management.base
 import pytest
 from django.core.management import call_command
 from django_mock_queries.query import MockModel, MockSet
-
+from opaque_keys.edx.keys import CourseKey
+
+from platform_plugin_aspects.management.commands.dump_data_to_clickhouse import (
+    DumpOptions,
+    SharedProgress,
+    SinkDump,
+    get_pk_ranges,
+    plan_dump,
+    prefetch,
+)
 from platform_plugin_aspects.sinks.base_sink import ModelBaseSink
 
 CommandOptions = namedtuple(
@@ -97,6 +111,31 @@ class DummySink(ModelBaseSink):
         return self.factory(item_id)
 
 
+class SmallDummySink(ModelBaseSink):
+    """
+    Dummy sink with a smaller table, for testing --object all.
+    """
+
+    name = "Small Dummy"
+    model = "small_dummy"
+    unique_key = "id"
+    serializer_class = dummy_serializer_factory()
+    timestamp_field = "created"
+    clickhouse_table_name = "small_dummy_table"
+
+    def get_queryset(self, start_pk=None):
+        qs = MockSet(
+            MockModel(mock_name="ann", pk=1),
+            MockModel(mock_name="bob", pk=2),
+        )
+        if start_pk:
+            qs = qs.filter(pk__gt=start_pk)
+        return qs
+
+    def send_item_and_log(self, item_id, serialized_item, many):
+        pass
+
+
 def dump_command_basic_options():
     """
     Pytest params for all the different non-ClickHouse command options.
@@ -174,6 +213,69 @@ def dump_command_basic_options():
                 "Dumped 1 objects to ClickHouse",
             ],
         ),
+        CommandOptions(
+            options={
+                "object": "dummy",
+                "batch_size": 2,
+                "sleep_time": 0,
+                "concurrency": 2,
+            },
+            expected_num_submitted=2,
+            expected_logs=[
+                "Now dumping 2 Dummy to ClickHouse",
+                "Dumped 4 objects to ClickHouse",
+            ],
+        ),
+        CommandOptions(
+            options={
+                "object": "dummy",
+                "batch_size": 2,
+                "sleep_time": 0,
+                "prefetch_batches": 0,
+            },
+            expected_num_submitted=2,
+            expected_logs=[
+                "Now dumping 2 Dummy to ClickHouse",
+                "Dumped 4 objects to ClickHouse",
+            ],
+        ),
+        CommandOptions(
+            options={"object": "dummy", "limit": 3, "batch_size": 2, "sleep_time": 0},
+            expected_num_submitted=2,
+            expected_logs=[
+                "Now dumping 1 Dummy to ClickHouse",
+                "Limit of 3 eligible objects has been reached, quitting!",
+                "Dumped 3 objects to ClickHouse",
+            ],
+        ),
+        CommandOptions(
+            options={
+                "object": "dummy",
+                "batch_size": 1,
+                "sleep_time": 0,
+                "workers": 2,
+            },
+            expected_num_submitted=4,
+            expected_logs=[
+                "Worker 1 finished, dumped 1",
+                "Worker 2 finished, dumped 3",
+                "Dumped 4 objects to ClickHouse with 2 workers",
+            ],
+        ),
+        CommandOptions(
+            options={
+                "object": "dummy",
+                "batch_size": 1,
+                "sleep_time": 0,
+                "workers": 3,
+                "limit": 2,
+            },
+            expected_num_submitted=2,
+            expected_logs=[
+                "Limit of 2 eligible objects has been reached, quitting!",
+                "Dumped 2 objects to ClickHouse with 3 workers",
+            ],
+        ),
     ]
 
     for option in options:
@@ -217,6 +319,36 @@ def dump_basic_invalid_options():
             expected_num_submitted=1,
             expected_logs=[],
         ),
+        CommandOptions(
+            options={"object": "dummy", "concurrency": 0},
+            expected_num_submitted=0,
+            expected_logs=["'concurrency' must be greater than 0!"],
+        ),
+        CommandOptions(
+            options={"object": "dummy", "prefetch_batches": -1},
+            expected_num_submitted=0,
+            expected_logs=["'prefetch_batches' must not be negative!"],
+        ),
+        CommandOptions(
+            options={"object": "all", "ids": ["1"]},
+            expected_num_submitted=0,
+            expected_logs=["'ids' cannot be used with '--object all'."],
+        ),
+        CommandOptions(
+            options={"object": "all", "workers": 2},
+            expected_num_submitted=0,
+            expected_logs=["'workers' cannot be used with '--object all'."],
+        ),
+        CommandOptions(
+            options={"object": "dummy", "workers": 0},
+            expected_num_submitted=0,
+            expected_logs=["'workers' must be greater than 0!"],
+        ),
+        CommandOptions(
+            options={"object": "dummy", "resume": True},
+            expected_num_submitted=0,
+            expected_logs=["'resume' requires checkpoint_dir to be configured."],
+        ),
     ]
 
     for option in options:
@@ -233,3 +365,358 @@ def test_dump_courses_options_invalid(test_command_option, caplog):
     # assert mock_dump_data.apply_async.call_count == expected_num_submitted
     for expected_output in expected_outputs:
         assert expected_output in caplog.text
+
+
+@pytest.mark.parametrize(
+    "pks,workers,start_pk,expected",
+    [
+        ([1, 2, 3, 4, 5, 6], 3, None, [(None, 2), (2, 4), (4, None)]),
+        ([10, 11, 100], 2, 5, [(5, 54), (54, None)]),
+        ([1, 2], 4, None, [(None, 1), (1, None)]),
+        (["a", "b", "c", "d"], 2, None, [(None, "b"), ("b", None)]),
+        ([], 2, None, []),
+    ],
+)
+def test_get_pk_ranges(pks, workers, start_pk, expected):
+    """
+    Test that the primary keys are split into contiguous ranges.
+    """
+    queryset = MockSet(*[MockModel(pk=pk) for pk in pks])
+
+    assert get_pk_ranges(queryset, workers, start_pk) == expected
+
+
+class OrderedPks(list):
+    """
+    Primary keys returned by the database in its own order.
+    """
+
+    def first(self):
+        return self[0] if self else None
+
+    def last(self):
+        return self[-1] if self else None
+
+
+def test_get_pk_ranges_mixed_course_keys():
+    """
+    Test that course keys of different types, which can't be compared, are split.
+    """
+    pks = OrderedPks(
+        CourseKey.from_string(course_key)
+        for course_key in (
+            "Org/Course/Run",
+            "Org/Course/Run2",
+            "course-v1:Org+Course+Run",
+            "course-v1:Org+Course+Run2",
+            "library-v1:Org+Lib",
+        )
+    )
+    queryset = Mock()
+    queryset.order_by.return_value.values_list.return_value = pks
+    queryset.count.return_value = len(pks)
+
+    assert get_pk_ranges(queryset, 4, None) == [
+        (None, pks[0]),
+        (pks[0], pks[1]),
+        (pks[1], pks[2]),
+        (pks[2], None),
+    ]
+    assert get_pk_ranges(queryset, 10, None)[-1] == (pks[3], None)
+
+
+def test_sink_dump_limit_discards_ledger():
+    """
+    Test that the ledger hashes of objects cut by the limit are dropped.
+    """
+    sink = Mock()
+    sink_dump = SinkDump(sink, DumpOptions(sleep_time=0), limit=2)
+
+    assert not sink_dump.dump_batches([[MockModel(pk=pk) for pk in range(3)]])
+
+    assert [item.pk for item in sink.dump.call_args.args[0]] == [0, 1]
+    assert [item.pk for item in sink.discard_ledger.call_args.args[0]] == [2]
+
+
+def test_shared_progress_limit():
+    """
+    Test that the global limit is shared by the workers and stops the dump.
+    """
+    progress = SharedProgress(multiprocessing.get_context("fork"), limit=5)
+
+    assert progress.reserve(3) == 3
+    assert not progress.is_stopped()
+    assert progress.reserve(3) == 2
+    assert progress.is_stopped()
+    assert progress.reserve(1) == 0
+    assert progress.get_dumped() == 5
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_resume_from_checkpoint(workers, tmp_path, caplog, settings):
+    """
+    Test that a dump stopped by its limit continues from its checkpoint.
+    """
+    settings.EVENT_SINK_CLICKHOUSE_BACKEND_CONFIG = {
+        **settings.EVENT_SINK_CLICKHOUSE_BACKEND_CONFIG,
+        "checkpoint_dir": str(tmp_path),
+    }
+    options = {"object": "dummy", "batch_size": 1, "sleep_time": 0}
+
+    call_command("dump_data_to_clickhouse", limit=2, workers=workers, **options)
+
+    assert "Run again with --resume to continue Dummy dump" in caplog.text
+    assert len(list(tmp_path.iterdir())) == workers
+    caplog.clear()
+
+    call_command("dump_data_to_clickhouse", resume=True, workers=1, **options)
+
+    assert "Resuming Dummy dump" in caplog.text
+    assert "2 objects already dumped" in caplog.text
+    # Which objects the workers got to first varies, only the remaining ones
+    # are dumped when resuming.
+    assert len(re.findall(r"Last ID: \d+", caplog.text)) == 2
+    assert not list(tmp_path.iterdir())
+
+
+def test_prefetch():
+    """
+    Test that prefetched items come in order, and errors reach the consumer.
+    """
+    assert list(prefetch(iter(range(10)), 2)) == list(range(10))
+
+    def fail():
+        yield 1
+        raise ValueError("Fetch failed")
+
+    items = prefetch(fail(), 2)
+    assert next(items) == 1
+    with pytest.raises(ValueError, match="Fetch failed"):
+        next(items)
+
+
+def test_prefetch_bounded():
+    """
+    Test that the producer stays at most max_items ahead and stops when closed.
+    """
+    produced = []
+
+    def produce():
+        for i in range(100):
+            produced.append(i)
+            yield i
+
+    items = prefetch(produce(), 2)
+    assert next(items) == 0
+    time.sleep(0.3)
+    # One item consumed, two queued and one waiting to be queued
+    assert len(produced) <= 4
+
+    items.close()
+    assert len(produced) <= 4
+
+
+def test_adaptive_dump(settings, caplog):
+    """
+    Test that slow inserts make an adaptive dump send smaller batches.
+    """
+    settings.EVENT_SINK_CLICKHOUSE_BACKEND_CONFIG = {
+        **settings.EVENT_SINK_CLICKHOUSE_BACKEND_CONFIG,
+        "flow_min_batch_size": 1,
+        "flow_max_sleep_secs": 0,
+    }
+
+    def slow_insert(sink, *_args):
+        sink.ch_flow_controller.record_latency(10)
+
+    with patch.object(DummySink, "send_item_and_log", slow_insert), patch.object(
+        DummySink, "get_active_parts", return_value=0
+    ):
+        call_command(
+            "dump_data_to_clickhouse",
+            object="dummy",
+            batch_size=2,
+            sleep_time=0,
+            adaptive=True,
+            prefetch_batches=0,
+        )
+
+    assert (
+        "Adapting Dummy dump to ClickHouse, insert latency 10.00s: "
+        "batch size 2 -> 1, sleep time 0s -> 0s" in caplog.text
+    )
+    assert [int(n) for n in re.findall(r"Now dumping (\d+) Dummy", caplog.text)] == [
+        2,
+        1,
+        1,
+    ]
+
+
+@patch.object(DummySink, "clickhouse_schema", [("id", "String"), ("created", "String")])
+@patch.object(DummySink, "send_item")
+def test_plan(mock_send_item, caplog):
+    """
+    Test that a planned dump extrapolates its sample and sends nothing.
+    """
+    call_command(
+        "dump_data_to_clickhouse",
+        object="dummy",
+        batch_size=2,
+        sleep_time=3,
+        plan=True,
+        plan_sample_size=2,
+    )
+
+    mock_send_item.assert_not_called()
+    assert "Estimates are extrapolated from 2 sampled objects" in caplog.text
+    # The first object of the sample is skipped, so half of the 5 are dumped
+    assert "Rows: 2 of 5 selected objects, in 1 batches of 2" in caplog.text
+    assert "bytes with compression none" in caplog.text
+    assert "Dumped" not in caplog.text
+
+
+@patch.object(DummySink, "clickhouse_schema", [("id", "String"), ("created", "String")])
+def test_plan_dump():
+    """
+    Test the estimates of plan_dump.
+    """
+    sink = DummySink({}, logging.getLogger())
+
+    plan = plan_dump(
+        sink,
+        dump_options=DumpOptions(force=True, batch_size=2, sleep_time=10),
+        sample_size=2,
+    )
+    items = list(sink.get_queryset())[:2]
+    body = sink.encode_items(sink.serialize_item(items, many=True), many=True)
+
+    assert plan["rows"] == 5
+    assert plan["batches"] == 3
+    assert plan["bytes"] == pytest.approx(len(body) * 2.5, abs=10)
+    assert plan["compressed_bytes"] == plan["bytes"]
+    assert 20 <= plan["duration_secs"] < 25
+
+    plan = plan_dump(
+        sink,
+        dump_options=DumpOptions(force=True, batch_size=2, sleep_time=10),
+        workers=3,
+    )
+    assert plan["sampled"] == 5
+    assert 6.6 <= plan["duration_secs"] < 10
+
+    empty = plan_dump(sink, start_pk=5)
+    assert (empty["total_objects"], empty["rows"], empty["batches"]) == (0, 0, 0)
+    assert not empty["nested"]
+
+
+class DummyBlockSink(ModelBaseSink):  # pylint: disable=abstract-method
+    """
+    Dummy nested sink dumping 3 related rows per object, for testing --plan.
+    """
+
+    name = "Dummy Blocks"
+    model = "dummy_block"
+    unique_key = "id"
+    timestamp_field = "time_last_dumped"
+    clickhouse_table_name = "dummy_block_table"
+    clickhouse_schema = [("id", "String"), ("dump_id", "String")]
+
+    def iter_serialize_items(self, items, initial=None):
+        for block in range(3):
+            yield {"id": f"{items['id']}-{block}", "dump_id": initial["dump_id"]}
+
+
+@patch.object(DummySink, "clickhouse_schema", [("id", "String"), ("created", "String")])
+@patch.object(DummySink, "nested_sinks", [DummyBlockSink])
+def test_plan_dump_nested_sinks(caplog):
+    """
+    Test that the related objects of nested sinks are included in the plan.
+    """
+
+    def serialize_item(_sink, items, many):
+        return [
+            {
+                "id": item.pk,
+                "created": "2024-01-01",
+                "dump_id": "a",
+                "time_last_dumped": 1,
+            }
+            for item in items
+        ]
+
+    with patch.object(DummySink, "serialize_item", serialize_item):
+        sink = DummySink({}, logging.getLogger())
+        plan = plan_dump(
+            sink,
+            dump_options=DumpOptions(force=True, batch_size=2, sleep_time=10),
+            sample_size=2,
+        )
+
+        caplog.set_level(logging.INFO)
+        call_command(
+            "dump_data_to_clickhouse",
+            object="dummy",
+            force=True,
+            plan=True,
+            plan_sample_size=2,
+        )
+
+    assert plan["rows"] == 5
+    nested = plan["nested"]["Dummy Blocks"]
+    assert nested["rows"] == 15
+    assert nested["bytes"] == len(b'"1-0","a"\r\n') * 15
+    assert nested["compressed_bytes"] == nested["bytes"]
+    assert "Related Dummy Blocks: " in caplog.text
+
+
+def is_dummy_enabled(cls):
+    return cls.model in (DummySink.model, SmallDummySink.model)
+
+
+@pytest.mark.parametrize("concurrency", [1, 2])
+@patch.object(ModelBaseSink, "is_enabled", classmethod(is_dummy_enabled))
+def test_dump_all(concurrency, caplog):
+    """
+    Test that --object all dumps every enabled sink, smallest table first.
+    """
+    call_command(
+        "dump_data_to_clickhouse",
+        object="all",
+        batch_size=1,
+        sleep_time=0,
+        concurrency=concurrency,
+    )
+
+    assert "Dumping small_dummy (2 objects), dummy (5 objects)" in caplog.text
+    assert "Completed dumping 1 Small Dummy to ClickHouse" in caplog.text
+    assert (
+        "Resync progress: 6/7 objects, small_dummy done 2/2, dummy done 4/5"
+        in caplog.text
+    )
+
+
+@patch.object(ModelBaseSink, "is_enabled", classmethod(is_dummy_enabled))
+@patch.object(SmallDummySink, "send_item_and_log", side_effect=ValueError("Boom"))
+def test_dump_all_failure(_mock_send, caplog):
+    """
+    Test that the other sinks are still dumped when one fails.
+    """
+    with pytest.raises(
+        django.core.management.base.CommandError,
+        match="Dumping small_dummy failed",
+    ):
+        call_command(
+            "dump_data_to_clickhouse", object="all", batch_size=1, sleep_time=0
+        )
+
+    assert "small_dummy failed 0/2, dummy done 4/5" in caplog.text
+
+
+@patch.object(ModelBaseSink, "is_enabled", classmethod(lambda cls: False))
+def test_dump_all_nothing_enabled(caplog):
+    """
+    Test that --object all does nothing without enabled sinks.
+    """
+    call_command("dump_data_to_clickhouse", object="all")
+
+    assert "No enabled sink to dump" in caplog.text
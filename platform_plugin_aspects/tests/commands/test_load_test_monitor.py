@@ -8,6 +8,11 @@ from unittest.mock import DEFAULT, Mock, patch
 
 import pytest
 from django.core.management import call_command
+from django.test.utils import override_settings
+
+from platform_plugin_aspects.management.commands.monitor_load_test_tracking import (
+    Monitor,
+)
 
 CommandOptions = namedtuple("TestCommandOptions", ["options", "expected_logs"])
 KafkaPartition = namedtuple("KafkaPartition", ["offset", "topic", "partition"])
@@ -94,6 +99,14 @@ def test_monitor_options(test_command_option, caplog):
         confluent_kafka=DEFAULT,
         sleep=DEFAULT,
     ) as patches:
+        patches["settings"].EVENT_SINK_CLICKHOUSE_BACKEND_CONFIG = {
+            "url": "https://foo.bar",
+            "username": "bob",
+            "password": "secret",
+            "database": "cool_data",
+            "timeout_secs": 1,
+        }
+
         # First response is the ClickHouse call to get the run id
         patches["requests"].post.return_value.text.strip.return_value = "runabc"
 
@@ -152,3 +165,26 @@ def test_monitor_options(test_command_option, caplog):
 
     for expected_output in expected_outputs:
         assert expected_output in caplog.text
+
+
+@override_settings(
+    EVENT_SINK_CLICKHOUSE_BACKEND_CONFIG={
+        "url": ["https://foo.bar", "https://baz.bar"],
+        "username": "bob",
+        "password": "secret",
+        "database": "cool_data",
+        "timeout_secs": 1,
+    }
+)
+def test_monitor_url_list():
+    """
+    Test that the monitor queries the first of several configured URLs.
+    """
+    with patch(
+        "platform_plugin_aspects.management.commands.monitor_load_test_tracking.requests"
+    ) as mock_requests:
+        mock_requests.post.return_value.text = "runabc\n"
+        run_id = Monitor(sleep_time=0, backend="celery").check_for_run_id()
+
+    assert run_id == "runabc"
+    assert mock_requests.post.call_args.kwargs["url"] == "https://foo.bar"
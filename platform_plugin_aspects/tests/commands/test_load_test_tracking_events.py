@@ -7,6 +7,7 @@ from unittest.mock import DEFAULT, Mock, patch
 
 import pytest
 from django.core.management import call_command
+from django.test.utils import override_settings
 
 CommandOptions = namedtuple("TestCommandOptions", ["options", "expected_logs"])
 
@@ -108,3 +109,40 @@ def test_load_test_run_until_killed(caplog):
 
     assert f"Creating events until killed with 0 sleep between!" in caplog.text
     assert f"Killed by keyboard, finishing" in caplog.text
+
+
+@override_settings(
+    EVENT_SINK_CLICKHOUSE_BACKEND_CONFIG={
+        "url": ["https://foo.bar", "https://baz.bar"],
+        "username": "bob",
+        "password": "secret",
+        "database": "cool_data",
+        "timeout_secs": 1,
+    }
+)
+def test_load_test_url_list():
+    """
+    Test that run events are sent to the first of several configured URLs.
+    """
+    fake_course = Mock()
+    fake_course.return_value.id = "fake_course_id"
+
+    patch_prefix = (
+        "platform_plugin_aspects.management.commands.load_test_tracking_events"
+    )
+    with patch.multiple(
+        f"{patch_prefix}",
+        create_new_course_in_store=fake_course,
+        do_create_account=lambda _: (Mock(), DEFAULT, DEFAULT),
+        CourseEnrollment=DEFAULT,
+        AccountCreationForm=DEFAULT,
+        ModuleStoreEnum=DEFAULT,
+        RUNNING_IN_PLATFORM=True,
+        requests=DEFAULT,
+        sleep=DEFAULT,
+    ) as patches:
+        call_command("load_test_tracking_events", sleep_time=0)
+
+    assert patches["requests"].post.call_count == 2
+    for call in patches["requests"].post.call_args_list:
+        assert call.kwargs["url"] == "https://foo.bar"
@@ -5,7 +5,10 @@ Tests for the tasks module.
 import unittest
 from unittest.mock import MagicMock, patch
 
-from platform_plugin_aspects.tasks import dump_data_to_clickhouse
+from platform_plugin_aspects.tasks import (
+    drain_clickhouse_spool,
+    dump_data_to_clickhouse,
+)
 
 
 class TestTasks(unittest.TestCase):
@@ -57,3 +60,15 @@ class TestTasks(unittest.TestCase):
         mock_import_module.assert_called_once_with("sink_module")
         mock_Sink_class.assert_not_called()
         mock_Sink_instance.dump.assert_not_called()
+
+    @patch("platform_plugin_aspects.tasks.BaseSink")
+    @patch("platform_plugin_aspects.tasks.celery_log")
+    def test_drain_clickhouse_spool(self, mock_celery_log, mock_sink_class):
+        mock_sink_class.return_value.drain_spool.return_value = 3
+
+        self.assertEqual(drain_clickhouse_spool(table="table"), 3)
+
+        mock_sink_class.assert_called_once_with(
+            connection_overrides=None, log=mock_celery_log
+        )
+        mock_sink_class.return_value.drain_spool.assert_called_once_with(table="table")
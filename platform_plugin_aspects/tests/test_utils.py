@@ -15,6 +15,7 @@ from platform_plugin_aspects.utils import (
     get_ccx_courses,
     get_model,
     get_tags_for_block,
+    get_tags_for_blocks,
     get_user_dashboard_locale,
 )
 from test_utils.helpers import course_factory
@@ -273,6 +274,35 @@ class TestUtils(TestCase):
         assert course_tags == [1, 2, 3, 4, 5]
         mock_get_object_tags.assert_called_once_with(course.location)
 
+    @patch("platform_plugin_aspects.utils._get_tag_parents")
+    @patch("platform_plugin_aspects.utils._get_object_tags_for_blocks")
+    def test_get_tags_for_blocks(self, mock_get_object_tags, mock_get_tag_parents):
+        """
+        Tests that get_tags_for_blocks resolves the parents of every block's tags.
+        """
+        course = course_factory()
+        block1, block2, block3 = (
+            str(block.location) for block in course.get_children()[:3]
+        )
+        # Tag 3 is a child of 2, itself a child of 1. Tags 4 and 5 have no parent.
+        mock_get_object_tags.return_value = [
+            (block1, 3, 10),
+            (block1, 4, 20),
+            (block2, 2, 10),
+            (block2, 5, 20),
+        ]
+        mock_get_tag_parents.return_value = {1: None, 2: 1, 3: 2, 4: None, 5: None}
+
+        block_tags = get_tags_for_blocks([block1, block2, block3])
+
+        self.assertEqual(
+            {block_id: sorted(tags) for block_id, tags in block_tags.items()},
+            {block1: [1, 2, 3, 4], block2: [1, 2, 5], block3: []},
+        )
+        mock_get_object_tags.assert_called_once()
+        mock_get_tag_parents.assert_called_once_with({10, 20})
+        self.assertEqual(get_tags_for_blocks([]), {})
+
     @patch("platform_plugin_aspects.utils.get_model")
     def test_get_user_dashboard_locale(self, mock_get_model):
         """Test that get_user_dashboard_locale gets user language with fallback to 'en'."""
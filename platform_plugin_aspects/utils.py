@@ -261,6 +261,50 @@ def get_detached_xblock_types():  # pragma: no cover
     return DETACHED_XBLOCK_TYPES
 
 
+def get_published_course_structure(modulestore, course_key):  # pragma: no cover
+    """
+    Return the published split structure of the course, or None if it can't be read.
+
+    The structure is the raw dict stored by the split modulestore, with the "root"
+    BlockKey of the course and the BlockData of its "blocks". Reading it doesn't
+    build any XBlock. Courses in other modulestores return None.
+    """
+    # pylint: disable=import-outside-toplevel,protected-access
+    try:
+        from xmodule.modulestore import ModuleStoreEnum
+        from xmodule.modulestore.exceptions import ItemNotFoundError
+        from xmodule.modulestore.split_mongo.split import SplitMongoModuleStore
+    except ImportError:
+        return None
+
+    store = modulestore
+    if hasattr(store, "_get_modulestore_for_courselike"):
+        store = store._get_modulestore_for_courselike(course_key)
+    if not isinstance(store, SplitMongoModuleStore):
+        return None
+
+    try:
+        return store._lookup_course(
+            course_key.for_branch(ModuleStoreEnum.BranchName.published)
+        ).structure
+    except ItemNotFoundError:
+        return None
+
+
+def get_xblock_class(block_type):  # pragma: no cover
+    """
+    Return the XBlock class of the given block type, or None if it isn't installed.
+    """
+    # pylint: disable=import-outside-toplevel
+    from xblock.core import XBlock
+    from xblock.plugin import PluginMissingError
+
+    try:
+        return XBlock.load_class(block_type)
+    except PluginMissingError:
+        return None
+
+
 def get_ccx_courses(course_id):
     """
     Get the CCX courses for a given course.
@@ -294,6 +338,70 @@ def _get_object_tags(usage_key):  # pragma: no cover
         return {}
 
 
+def _get_object_tags_for_blocks(usage_keys):  # pragma: no cover
+    """
+    Return (object id, tag id, taxonomy id) for the tags applied to the given blocks.
+
+    Free-text tags and tags of disabled taxonomies are left out, as they are by
+    get_object_tags.
+    """
+    object_tag_model = get_model("object_tag")
+    if object_tag_model is None:
+        return []
+
+    return (
+        object_tag_model.objects.filter(
+            object_id__in=[str(usage_key) for usage_key in usage_keys],
+            tag__isnull=False,
+            taxonomy__enabled=True,
+        )
+        .order_by()
+        .values_list("object_id", "tag_id", "tag__taxonomy_id")
+    )
+
+
+def _get_tag_parents(taxonomy_ids):  # pragma: no cover
+    """
+    Return the {tag id: parent tag id} map of every tag in the given taxonomies.
+    """
+    tag_model = get_model("tag")
+    if tag_model is None or not taxonomy_ids:
+        return {}
+
+    return dict(
+        tag_model.objects.filter(taxonomy_id__in=taxonomy_ids)
+        .order_by()
+        .values_list("id", "parent_id")
+    )
+
+
+def get_tags_for_blocks(usage_keys) -> dict:
+    """
+    Return all the tags (and their parent tags) applied to each of the given blocks.
+
+    Unlike calling get_tags_for_block for each block, this reads the object tags of
+    every block in one query, and the parents of their tags in another one.
+
+    Returns a dict of block id to tag ids: {"block-v1:...": [1, 2, 3]}
+    """
+    block_tags = {str(usage_key): set() for usage_key in usage_keys}
+    if not block_tags:
+        return {}
+
+    object_tags = list(_get_object_tags_for_blocks(block_tags))
+    tag_parents = _get_tag_parents(
+        {taxonomy_id for _object_id, _tag_id, taxonomy_id in object_tags}
+    )
+
+    for object_id, tag_id, _taxonomy_id in object_tags:
+        serialized_tags = block_tags[object_id]
+        while tag_id and tag_id not in serialized_tags:
+            serialized_tags.add(tag_id)
+            tag_id = tag_parents.get(tag_id)
+
+    return {object_id: list(tags) for object_id, tags in block_tags.items()}
+
+
 def get_tags_for_block(usage_key) -> set:
     """
     Return all the tags (and their parent tags) applied to the given block.
@@ -158,6 +158,13 @@ setup(
     ),
     include_package_data=True,
     install_requires=load_requirements("requirements/base.in"),
+    extras_require={
+        # Optional insert body compression codecs
+        "zstd": ["zstandard"],
+        "lz4": ["lz4"],
+        # Optional asyncio transport of dump_data_to_clickhouse --concurrency
+        "async": ["aiohttp"],
+    },
     python_requires=">=3.12",
     license="Apache 2.0",
     zip_safe=False,
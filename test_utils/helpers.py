@@ -187,6 +187,60 @@ def mock_detached_xblock_types():
     return {"static_tab", "about", "course_info"}
 
 
+COURSE_OVERVIEW_COLUMNS = [
+    "org",
+    "course_key",
+    "display_name",
+    "course_start",
+    "course_end",
+    "enrollment_start",
+    "enrollment_end",
+    "self_paced",
+    "course_data_json",
+    "created",
+    "modified",
+    "dump_id",
+    "time_last_dumped",
+]
+
+COURSE_BLOCK_COLUMNS = [
+    "org",
+    "course_key",
+    "location",
+    "display_name",
+    "xblock_data_json",
+    "order",
+    "edited_on",
+    "dump_id",
+    "time_last_dumped",
+]
+
+
+def describe_table_body(columns):
+    """
+    Return a DESCRIBE TABLE ... FORMAT JSONEachRow response for the given columns.
+    """
+    return "\n".join(
+        json.dumps({"name": column, "type": "String", "default_type": ""})
+        for column in columns
+    )
+
+
+def get_clickhouse_describe_params(table):
+    """
+    Get the params used to describe a ClickHouse table.
+    """
+    return {"query": f"DESCRIBE TABLE cool_data.{table} FORMAT JSONEachRow"}
+
+
+def get_insert_query(table, columns):
+    """
+    Get the query used to insert the given columns into a ClickHouse table.
+    """
+    column_list = ", ".join(f"`{column}`" for column in columns)
+    return f"INSERT INTO cool_data.{table} ({column_list}) FORMAT CSV"
+
+
 def get_clickhouse_http_params():
     """
     Get the params used in ClickHouse queries.
@@ -194,12 +248,12 @@ def get_clickhouse_http_params():
     overview_params = {
         "input_format_allow_errors_num": 1,
         "input_format_allow_errors_ratio": 0.1,
-        "query": "INSERT INTO cool_data.course_overviews FORMAT CSV",
+        "query": get_insert_query("course_overviews", COURSE_OVERVIEW_COLUMNS),
     }
     blocks_params = {
         "input_format_allow_errors_num": 1,
         "input_format_allow_errors_ratio": 0.1,
-        "query": "INSERT INTO cool_data.course_blocks FORMAT CSV",
+        "query": get_insert_query("course_blocks", COURSE_BLOCK_COLUMNS),
     }
 
     return overview_params, blocks_params